@@ -1,5 +1,10 @@
 from __future__ import annotations
 
+import re
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.engine.url import make_url
 
@@ -24,6 +29,8 @@ def _sanitize_asyncpg_url(raw: str):
 
 
 url = _sanitize_asyncpg_url(settings.database_url)
+# alembic (app/migrations/env.py) ham aynan shu url + connect_args bilan ulanadi
+CONNECT_ARGS = {"ssl": "require"}
 
 engine = create_async_engine(
     url,
@@ -32,10 +39,40 @@ engine = create_async_engine(
     max_overflow=5,
     pool_timeout=30,
     pool_pre_ping=True,
-    connect_args={"ssl": "require"},
+    connect_args=CONNECT_ARGS,
 )
 
 SessionLocal = async_sessionmaker(
     engine,
     expire_on_commit=False,
 )
+
+
+# ---------------- schema version ----------------
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations" / "versions"
+
+
+def alembic_head() -> Optional[str]:
+    """Head revision read straight from the migration files (no alembic import at startup)."""
+    revisions, parents = set(), set()
+    for f in MIGRATIONS_DIR.glob("*.py"):
+        src = f.read_text(encoding="utf-8")
+        rev = re.search(r"^revision\s*=\s*[\"']([^\"']+)", src, re.M)
+        if not rev:
+            continue
+        revisions.add(rev.group(1))
+        down = re.search(r"^down_revision\s*=\s*(.+)$", src, re.M)
+        if down:
+            parents.update(re.findall(r"[\"']([^\"']+)[\"']", down.group(1)))
+    heads = revisions - parents
+    return heads.pop() if len(heads) == 1 else None
+
+
+async def schema_revision() -> Optional[str]:
+    """alembic_version of the connected DB; None if the table is missing (DB not migrated)."""
+    try:
+        async with engine.connect() as conn:
+            return (await conn.execute(text("SELECT version_num FROM alembic_version"))).scalar()
+    except Exception:
+        return None
@@ -8,12 +8,12 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
 from app.keyboards import (
     admin_menu_kb,
     admin_menu_reply_kb,
-    tests_list_kb,
+    tests_page_kb,
     answer_choice_kb,
     finish_kb,
     confirm_kb,
@@ -23,17 +23,18 @@ from app.keyboards import (
 )
 from app.settings import settings
 from app.services.repo import (
-    list_tests_by_category,
+    list_tests_page,
     create_test,
     replace_test_pdf,
     replace_test_answers,
     delete_test,
-    get_test,
+    get_test_info,
     ensure_baseline_users,
     count_baseline_submissions,
     save_submission,
     get_correct_answers,
 )
+from app.services.file_ids import invalidate_path, prewarm_before_publish
 from app.services.scoring import simple_check
 
 router = Router()
@@ -132,7 +133,7 @@ async def simple_admin_create_num(message: Message, state: FSMContext) -> None:
 
 
 @router.message(SimpleAdminFlow.creating_pdf)
-async def simple_admin_create_pdf(message: Message, state: FSMContext) -> None:
+async def simple_admin_create_pdf(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not message.from_user or not _is_admin(message.from_user.id):
         return
     if not message.document:
@@ -152,35 +153,36 @@ async def simple_admin_create_pdf(message: Message, state: FSMContext) -> None:
     # download to temp
     tmp_path = TESTS_DIR / f"tmp_{message.from_user.id}.pdf"
     await message.bot.download(doc, destination=tmp_path)
+    # test DB'da ko'rinishidan oldin: file_id kontent hash'i bo'yicha, rename'dan keyin ham ishlaydi
+    await prewarm_before_publish(message.bot, tmp_path)
 
-    async with SessionLocal() as session:
-        try:
-            t = await create_test(
-                session,
-                category=cat,
-                name=name,
-                num_questions=num_questions,
-                pdf_path=str(tmp_path),
-                correct_answers={},
-                is_rasch=is_rasch,
-            )
-        except Exception:
-            # likely unique constraint
-            try:
-                await session.rollback()
-            except Exception:
-                pass
-            await message.answer("Bu nomli test allaqachon bor. Boshqa nom tanlang.")
-            return
-
-        final_path = TESTS_DIR / f"test_{t.id}.pdf"
-        final_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        t = await create_test(
+            session,
+            category=cat,
+            name=name,
+            num_questions=num_questions,
+            pdf_path="",
+            correct_answers={},
+            is_rasch=is_rasch,
+            pdf_path_for=lambda tid: str(TESTS_DIR / f"test_{tid}.pdf"),
+        )
+    except Exception:
+        # likely unique constraint
         try:
-            tmp_path.replace(final_path)
+            await session.rollback()
         except Exception:
-            final_path.write_bytes(tmp_path.read_bytes())
-            tmp_path.unlink(missing_ok=True)
-        await replace_test_pdf(session, t.id, str(final_path))
+            pass
+        await message.answer("Bu nomli test allaqachon bor. Boshqa nom tanlang.")
+        return
+
+    final_path = TESTS_DIR / f"test_{t.id}.pdf"
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        tmp_path.replace(final_path)
+    except Exception:
+        final_path.write_bytes(tmp_path.read_bytes())
+        tmp_path.unlink(missing_ok=True)
 
     await state.clear()
 
@@ -206,7 +208,7 @@ async def simple_admin_edit_entry(message: Message, state: FSMContext) -> None:
 
 
 @router.message(SimpleAdminFlow.editing_category)
-async def simple_admin_edit_category(message: Message, state: FSMContext) -> None:
+async def simple_admin_edit_category(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not message.from_user or not _is_admin(message.from_user.id):
         return
     label = (message.text or "").strip()
@@ -218,14 +220,13 @@ async def simple_admin_edit_category(message: Message, state: FSMContext) -> Non
     if not cat:
         await message.answer("Iltimos, kategoriya tugmasidan tanlang.", reply_markup=categories_kb(back=True))
         return
-    async with SessionLocal() as session:
-        rows = await list_tests_by_category(session, cat)
-    if not rows:
+    page = await list_tests_page(session, cat)
+    if not page.rows:
         await message.answer("Bu kategoriyada test yo'q.", reply_markup=categories_kb(back=True))
         return
     await state.update_data(category=cat)
     await state.set_state(SimpleAdminFlow.editing_pick)
-    await message.answer("Tahrirlash uchun testni tanlang:", reply_markup=tests_list_kb(rows, prefix="editpick", include_back=True))
+    await message.answer("Tahrirlash uchun testni tanlang:", reply_markup=tests_page_kb(page, prefix="editpick"))
 
 
 @router.callback_query(lambda c: (c.data or "").startswith("editpick:"))
@@ -251,7 +252,7 @@ async def simple_admin_edit_pick(callback: CallbackQuery, state: FSMContext) ->
 
 
 @router.callback_query(lambda c: (c.data or "") in {"edit:open", "edit:name", "edit:pdf", "edit:back"})
-async def simple_admin_edit_action(callback: CallbackQuery, state: FSMContext) -> None:
+async def simple_admin_edit_action(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message or not callback.from_user or not _is_admin(callback.from_user.id):
         return
     await callback.answer()
@@ -264,10 +265,9 @@ async def simple_admin_edit_action(callback: CallbackQuery, state: FSMContext) -
     if callback.data == "edit:back":
         # go back to tests list in same category
         cat = str(data.get("category") or "")
-        async with SessionLocal() as session:
-            rows = await list_tests_by_category(session, cat)
+        page = await list_tests_page(session, cat)
         await state.set_state(SimpleAdminFlow.editing_pick)
-        await callback.message.answer("Tahrirlash uchun testni tanlang:", reply_markup=tests_list_kb(rows, prefix="editpick", include_back=True))
+        await callback.message.answer("Tahrirlash uchun testni tanlang:", reply_markup=tests_page_kb(page, prefix="editpick"))
         return
 
     if callback.data == "edit:open":
@@ -287,7 +287,7 @@ async def simple_admin_edit_action(callback: CallbackQuery, state: FSMContext) -
 
 
 @router.message(SimpleAdminFlow.editing_newname)
-async def simple_admin_edit_newname(message: Message, state: FSMContext) -> None:
+async def simple_admin_edit_newname(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not message.from_user or not _is_admin(message.from_user.id):
         return
     new_name = (message.text or "").strip()
@@ -300,16 +300,15 @@ async def simple_admin_edit_newname(message: Message, state: FSMContext) -> None
         await message.answer("Test tanlanmagan.")
         return
     from app.services.repo import replace_test_name
-    async with SessionLocal() as session:
+    try:
+        await replace_test_name(session, test_id, new_name)
+    except Exception:
         try:
-            await replace_test_name(session, test_id, new_name)
+            await session.rollback()
         except Exception:
-            try:
-                await session.rollback()
-            except Exception:
-                pass
-            await message.answer("Bu nomli test allaqachon bor. Boshqa nom tanlang.")
-            return
+            pass
+        await message.answer("Bu nomli test allaqachon bor. Boshqa nom tanlang.")
+        return
     await state.set_state(SimpleAdminFlow.editing_pick)
     await message.answer("✅ Nomi yangilandi.")
     # re-show edit options
@@ -324,7 +323,7 @@ async def simple_admin_edit_newname(message: Message, state: FSMContext) -> None
 
 
 @router.message(SimpleAdminFlow.editing_newpdf)
-async def simple_admin_edit_newpdf(message: Message, state: FSMContext) -> None:
+async def simple_admin_edit_newpdf(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not message.from_user or not _is_admin(message.from_user.id):
         return
     if not message.document:
@@ -343,14 +342,15 @@ async def simple_admin_edit_newpdf(message: Message, state: FSMContext) -> None:
     tmp_path = TESTS_DIR / f"tmp_replace_{message.from_user.id}.pdf"
     await message.bot.download(doc, destination=tmp_path)
     final_path = TESTS_DIR / f"test_{test_id}.pdf"
+    await invalidate_path(final_path)
     try:
         tmp_path.replace(final_path)
     except Exception:
         final_path.write_bytes(tmp_path.read_bytes())
         tmp_path.unlink(missing_ok=True)
 
-    async with SessionLocal() as session:
-        await replace_test_pdf(session, test_id, str(final_path))
+    await prewarm_before_publish(message.bot, final_path)
+    await replace_test_pdf(session, test_id, str(final_path))
 
     await state.set_state(SimpleAdminFlow.editing_pick)
     await message.answer("✅ PDF yangilandi. (Userlar endi qayta tekshirishi mumkin)")
@@ -550,7 +550,7 @@ async def admin_create_answer_cb(callback: CallbackQuery, state: FSMContext) ->
 
 
 @router.callback_query(AdminFlow.create_answers_finish, lambda c: (c.data or "").startswith("acreate:"))
-async def admin_create_finish(callback: CallbackQuery, state: FSMContext) -> None:
+async def admin_create_finish(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
@@ -571,25 +571,25 @@ async def admin_create_finish(callback: CallbackQuery, state: FSMContext) -> Non
 
     is_rasch = category in {"sat", "milliy"}
 
-    async with SessionLocal() as session:
-        t = await create_test(
-            session,
-            category=category,
-            name=name,
-            num_questions=n,
-            pdf_path="",  # hozircha
-            correct_answers=answers,
-            is_rasch=is_rasch,
-        )
-
-        final_pdf = TESTS_DIR / f"test_{t.id}.pdf"
-        tmp_pdf.replace(final_pdf)
-        await replace_test_pdf(session, t.id, str(final_pdf))
+    # test DB'da ko'rinishidan oldin: file_id kontent hash'i bo'yicha, rename'dan keyin ham ishlaydi
+    await prewarm_before_publish(callback.bot, tmp_pdf)
+    t = await create_test(
+        session,
+        category=category,
+        name=name,
+        num_questions=n,
+        pdf_path="",
+        correct_answers=answers,
+        is_rasch=is_rasch,
+        pdf_path_for=lambda tid: str(TESTS_DIR / f"test_{tid}.pdf"),
+    )
+    tmp_pdf.replace(TESTS_DIR / f"test_{t.id}.pdf")
 
     await state.set_state(AdminFlow.menu)
     msg = f"✅ Test yaratildi: *{name}* (ID: {t.id})."
     if is_rasch:
         msg += "\n\n⚠️ Bu Rasch test. Endi *Rasch bazasi (10 ta)* bo‘limida 10 ta baseline javoblarini kiriting."
+    msg += f"\n\n📣 Userlarga e'lon: /broadcast\\_test {t.id}"
     await callback.message.answer(msg, parse_mode="Markdown", reply_markup=admin_menu_kb())
 
 
@@ -607,7 +607,7 @@ async def admin_replace_start(callback: CallbackQuery, state: FSMContext) -> Non
 
 
 @router.message(AdminFlow.replace_choose_category)
-async def admin_replace_cat(message: Message, state: FSMContext) -> None:
+async def admin_replace_cat(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not _is_admin(message.from_user.id):
         return
     if (message.text or "").strip() in {"⬅️ Ortga", "⬅️ Orqaga", "🏠 Asosiy sahifa", "🏠 Asosiy"}:
@@ -618,15 +618,14 @@ async def admin_replace_cat(message: Message, state: FSMContext) -> None:
     if not cat_key:
         await message.answer("Kategoriya tugmasidan tanlang.", reply_markup=categories_kb(back=True))
         return
-    async with SessionLocal() as session:
-        rows = await list_tests_by_category(session, cat_key)
-    if not rows:
+    page = await list_tests_page(session, cat_key)
+    if not page.rows:
         await message.answer("Bu kategoriyada test yo‘q.", reply_markup=admin_menu_kb())
         await state.set_state(AdminFlow.menu)
         return
     await state.update_data(category=cat_key)
     await state.set_state(AdminFlow.replace_choose_test)
-    await message.answer("Testni tanlang:", reply_markup=tests_list_kb(rows, prefix="rpick", include_back=True))
+    await message.answer("Testni tanlang:", reply_markup=tests_page_kb(page, prefix="rpick"))
 
 
 @router.callback_query(AdminFlow.replace_choose_test, lambda c: (c.data or "").startswith("rpick:"))
@@ -645,7 +644,7 @@ async def admin_replace_pick(callback: CallbackQuery, state: FSMContext) -> None
 
 
 @router.message(AdminFlow.replace_pdf)
-async def admin_replace_pdf(message: Message, state: FSMContext) -> None:
+async def admin_replace_pdf(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not _is_admin(message.from_user.id):
         return
     if (message.text or "").strip().lower() == "/skip":
@@ -663,17 +662,18 @@ async def admin_replace_pdf(message: Message, state: FSMContext) -> None:
     tmp_path = TESTS_DIR / f"tmp_replace_{message.document.file_id}.pdf"
     await message.bot.download(message.document, destination=tmp_path)
 
-    async with SessionLocal() as session:
-        final_pdf = TESTS_DIR / f"test_{test_id}.pdf"
-        tmp_path.replace(final_pdf)
-        await replace_test_pdf(session, test_id, str(final_pdf))
+    final_pdf = TESTS_DIR / f"test_{test_id}.pdf"
+    await invalidate_path(final_pdf)
+    tmp_path.replace(final_pdf)
+    await prewarm_before_publish(message.bot, final_pdf)
+    await replace_test_pdf(session, test_id, str(final_pdf))
 
     await state.set_state(AdminFlow.replace_answers)
     await message.answer("✅ PDF yangilandi.\nEndi javoblarni yangilamoqchimisiz? (Agar yo‘q bo‘lsa /skip yozing)")
 
 
 @router.message(AdminFlow.replace_answers)
-async def admin_replace_answers(message: Message, state: FSMContext) -> None:
+async def admin_replace_answers(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not _is_admin(message.from_user.id):
         return
     if (message.text or "").strip().lower() == "/skip":
@@ -684,8 +684,7 @@ async def admin_replace_answers(message: Message, state: FSMContext) -> None:
     # Javoblarni qayta kiritish: savol sonini testdan olamiz, keyin inline orqali
     data = await state.get_data()
     test_id = int(data["test_id"])
-    async with SessionLocal() as session:
-        t = await get_test(session, test_id)
+    t = await get_test_info(session, test_id)
 
     await state.update_data(num_questions=t.num_questions, answers={}, q=1)
     await state.set_state(AdminFlow.create_answers)  # reuse aa callbacks, but we need separate prefix
@@ -698,7 +697,7 @@ async def admin_replace_answers(message: Message, state: FSMContext) -> None:
 
 
 @router.callback_query(lambda c: (c.data or "").startswith("aa2:"))
-async def admin_replace_answer_cb(callback: CallbackQuery, state: FSMContext) -> None:
+async def admin_replace_answer_cb(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
@@ -724,8 +723,7 @@ async def admin_replace_answer_cb(callback: CallbackQuery, state: FSMContext) ->
         await callback.message.answer(f"Savol {q_next}/{n}:", reply_markup=answer_choice_kb("aa2", include_back=True, include_finish=False))
     else:
         test_id = int(data["test_id"])
-        async with SessionLocal() as session:
-            await replace_test_answers(session, test_id, answers)
+        await replace_test_answers(session, test_id, answers)
         await state.set_state(AdminFlow.menu)
         await callback.message.answer("✅ Javoblar yangilandi.", reply_markup=admin_menu_kb())
 
@@ -744,7 +742,7 @@ async def admin_delete_start(callback: CallbackQuery, state: FSMContext) -> None
 
 
 @router.message(AdminFlow.delete_choose_category)
-async def admin_delete_cat(message: Message, state: FSMContext) -> None:
+async def admin_delete_cat(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not _is_admin(message.from_user.id):
         return
     if (message.text or "").strip() in {"⬅️ Ortga", "⬅️ Orqaga", "🏠 Asosiy sahifa", "🏠 Asosiy"}:
@@ -755,18 +753,17 @@ async def admin_delete_cat(message: Message, state: FSMContext) -> None:
     if not cat_key:
         await message.answer("Kategoriya tugmasidan tanlang.", reply_markup=categories_kb(back=True))
         return
-    async with SessionLocal() as session:
-        rows = await list_tests_by_category(session, cat_key)
-    if not rows:
+    page = await list_tests_page(session, cat_key)
+    if not page.rows:
         await state.set_state(AdminFlow.menu)
         await message.answer("Bu kategoriyada test yo‘q.", reply_markup=admin_menu_kb())
         return
     await state.set_state(AdminFlow.delete_choose_test)
-    await message.answer("O‘chiriladigan testni tanlang:", reply_markup=tests_list_kb(rows, prefix="dpick", include_back=True))
+    await message.answer("O‘chiriladigan testni tanlang:", reply_markup=tests_page_kb(page, prefix="dpick"))
 
 
 @router.callback_query(AdminFlow.delete_choose_test, lambda c: (c.data or "").startswith("dpick:"))
-async def admin_delete_pick(callback: CallbackQuery, state: FSMContext) -> None:
+async def admin_delete_pick(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
@@ -775,15 +772,14 @@ async def admin_delete_pick(callback: CallbackQuery, state: FSMContext) -> None:
         await callback.message.answer("🛠 Admin panel:", reply_markup=admin_menu_kb())
         return
     test_id = int(callback.data.split(":")[1])
-    async with SessionLocal() as session:
-        t = await get_test(session, test_id)
+    t = await get_test_info(session, test_id)
     await state.update_data(test_id=test_id)
     await state.set_state(AdminFlow.delete_confirm)
     await callback.message.answer(f"❗️ Rostdan ham *{t.name}* testini o‘chirmoqchimisiz?", parse_mode="Markdown", reply_markup=confirm_kb("dconf", yes_label="🗑 O‘chirish", no_label="Bekor"))
 
 
 @router.callback_query(AdminFlow.delete_confirm, lambda c: (c.data or "").startswith("dconf:"))
-async def admin_delete_confirm(callback: CallbackQuery, state: FSMContext) -> None:
+async def admin_delete_confirm(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
@@ -796,8 +792,7 @@ async def admin_delete_confirm(callback: CallbackQuery, state: FSMContext) -> No
         return
     data = await state.get_data()
     test_id = int(data["test_id"])
-    async with SessionLocal() as session:
-        await delete_test(session, test_id)
+    await delete_test(session, test_id)
     # pdf ni ham o‘chirishga urinib ko‘ramiz
     pdf = TESTS_DIR / f"test_{test_id}.pdf"
     if pdf.exists():
@@ -823,7 +818,7 @@ async def admin_baseline_start(callback: CallbackQuery, state: FSMContext) -> No
 
 
 @router.message(AdminFlow.baseline_choose_category)
-async def admin_baseline_cat(message: Message, state: FSMContext) -> None:
+async def admin_baseline_cat(message: Message, state: FSMContext, session: AsyncSession) -> None:
     if not _is_admin(message.from_user.id):
         return
     if (message.text or "").strip() in {"⬅️ Ortga", "⬅️ Orqaga", "🏠 Asosiy sahifa", "🏠 Asosiy"}:
@@ -834,18 +829,17 @@ async def admin_baseline_cat(message: Message, state: FSMContext) -> None:
     if cat_key not in {"sat", "milliy"}:
         await message.answer("Rasch faqat SAT yoki Milliy uchun. Iltimos, shu ikkisidan birini tanlang.")
         return
-    async with SessionLocal() as session:
-        rows = await list_tests_by_category(session, cat_key)
-    if not rows:
+    page = await list_tests_page(session, cat_key)
+    if not page.rows:
         await state.set_state(AdminFlow.menu)
         await message.answer("Bu kategoriyada test yo‘q.", reply_markup=admin_menu_kb())
         return
     await state.set_state(AdminFlow.baseline_choose_test)
-    await message.answer("Testni tanlang:", reply_markup=tests_list_kb(rows, prefix="bpick", include_back=True))
+    await message.answer("Testni tanlang:", reply_markup=tests_page_kb(page, prefix="bpick"))
 
 
 @router.callback_query(AdminFlow.baseline_choose_test, lambda c: (c.data or "").startswith("bpick:"))
-async def admin_baseline_pick(callback: CallbackQuery, state: FSMContext) -> None:
+async def admin_baseline_pick(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
@@ -855,17 +849,16 @@ async def admin_baseline_pick(callback: CallbackQuery, state: FSMContext) -> Non
         return
     test_id = int(callback.data.split(":")[1])
 
-    async with SessionLocal() as session:
-        t = await get_test(session, test_id)
-        if not t.is_rasch:
-            await callback.message.answer("Bu test Rasch emas.")
-            return
-        cnt = await count_baseline_submissions(session, test_id)
-        if cnt >= 10:
-            await callback.message.answer("✅ Bu test uchun baseline allaqachon 10 ta to‘ldirilgan.", reply_markup=admin_menu_kb())
-            await state.set_state(AdminFlow.menu)
-            return
-        await ensure_baseline_users(session)
+    t = await get_test_info(session, test_id)
+    if not t.is_rasch:
+        await callback.message.answer("Bu test Rasch emas.")
+        return
+    cnt = await count_baseline_submissions(session, test_id)
+    if cnt >= 10:
+        await callback.message.answer("✅ Bu test uchun baseline allaqachon 10 ta to‘ldirilgan.", reply_markup=admin_menu_kb())
+        await state.set_state(AdminFlow.menu)
+        return
+    await ensure_baseline_users(session)
 
     await state.update_data(test_id=test_id, fake_user_index=1, answers={}, q=1)
     await state.set_state(AdminFlow.baseline_answers)
@@ -876,7 +869,7 @@ async def admin_baseline_pick(callback: CallbackQuery, state: FSMContext) -> Non
 
 
 @router.callback_query(AdminFlow.baseline_answers, lambda c: (c.data or "").startswith("ba:"))
-async def admin_baseline_answer_cb(callback: CallbackQuery, state: FSMContext) -> None:
+async def admin_baseline_answer_cb(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
@@ -894,8 +887,7 @@ async def admin_baseline_answer_cb(callback: CallbackQuery, state: FSMContext) -
     q = int(data["q"])
     answers: Dict[int, str] = dict(data.get("answers", {}))
 
-    async with SessionLocal() as session:
-        t = await get_test(session, test_id)
+    t = await get_test_info(session, test_id)
 
     ans = "" if action == "_" else action
     answers[q] = ans
@@ -910,19 +902,18 @@ async def admin_baseline_answer_cb(callback: CallbackQuery, state: FSMContext) -
         return
 
     # fake user yakunlandi -> DB ga submission yozamiz (tg_id=-fake_i)
-    async with SessionLocal() as session:
-        correct = await get_correct_answers(session, test_id)
-        res_simple = simple_check(answers, correct, t.num_questions)
-        await save_submission(
-            session,
-            tg_id=-fake_i,  # baseline user tg_id
-            test_id=test_id,
-            answers=answers,
-            raw_correct=res_simple.raw_correct,
-            total=res_simple.total,
-            score=0.0,      # Rasch score keyin hisoblanadi (real user bilan birga)
-            is_rasch=True,
-        )
+    correct = await get_correct_answers(session, test_id)
+    res_simple = simple_check(answers, correct, t.num_questions)
+    await save_submission(
+        session,
+        tg_id=-fake_i,  # baseline user tg_id
+        test_id=test_id,
+        answers=answers,
+        raw_correct=res_simple.raw_correct,
+        total=res_simple.total,
+        score=0.0,      # Rasch score keyin hisoblanadi (real user bilan birga)
+        is_rasch=True,
+    )
 
     if fake_i < 10:
         await state.update_data(fake_user_index=fake_i + 1, answers={}, q=1)
@@ -1,157 +1,39 @@
 from __future__ import annotations
 
+import asyncio
+import time
 from datetime import datetime
-from pathlib import Path
-from typing import List, Tuple
 
 from aiogram import Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, FSInputFile
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.pdfgen import canvas
-from sqlalchemy import select
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
-from app.models import User
 from app.settings import settings
-from app.keyboards import ceo_menu_kb
+from app.keyboards import CATEGORIES, CEO_EXPORT_BUTTONS, CEO_STATS_BUTTON, ceo_menu_kb, webapp_open_kb
+from app.services import analytics
+from app.services.broadcast import BroadcastRun, broadcasts
+from app.services.certificate_export import ExportProgress, write_test_certificates_zip
+from app.services.db_session import standalone_session
+from app.services.repo import get_test_info
+from app.services.exports import DATASETS, EXPORTS_DIR, FORMATS, export_dataset, zip_file
+from app.services.file_ids import answer_document_cached
+from app.services.user_report import get_users_report
 
 
 router = Router()
 
-DATA_DIR = Path("data")
-REPORTS_DIR = DATA_DIR / "reports"
-REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+# Telegram bot API hujjat limiti (50 MB)
+TG_DOCUMENT_LIMIT = 50 * 1024 * 1024
 
 
 def _is_ceo(tg_id: int) -> bool:
     return tg_id in set(settings.ceo_tg_ids or [])
 
 
-async def _fetch_users() -> List[Tuple[int, str, str, str, str, str, str]]:
-    """Returns rows: (tg_id, full_name, username, phone, registered, baseline, created_at_str)."""
-    async with SessionLocal() as session:
-        res = await session.execute(select(User).order_by(User.created_at.asc(), User.id.asc()))
-        users = res.scalars().all()
-
-    out: List[Tuple[int, str, str, str, str, str, str]] = []
-    for u in users:
-        full = (f"{u.first_name or ''} {u.last_name or ''}").strip() or "-"
-        uname = (u.username or "").strip()
-        uname = f"@{uname}" if uname and not uname.startswith("@") else (uname or "-")
-        phone = (u.phone or "-").strip() or "-"
-        reg = "Ha" if u.is_registered else "Yo'q"
-        base = "Ha" if u.is_baseline else "Yo'q"
-        created = (u.created_at or datetime.utcnow()).strftime("%Y-%m-%d %H:%M")
-        out.append((int(u.tg_id), full, uname, phone, reg, base, created))
-    return out
-
-
-def _render_users_pdf(rows: List[Tuple[int, str, str, str, str, str, str]]) -> Path:
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    out = REPORTS_DIR / f"msr_users_{ts}.pdf"
-
-    c = canvas.Canvas(str(out), pagesize=A4)
-    w, h = A4
-    margin = 14 * mm
-
-    # Header
-    c.setTitle("MSR Users Report")
-    c.setFont("Helvetica-Bold", 15)
-    c.drawString(margin, h - margin, "MSR — Userlar hisobot")
-    c.setFont("Helvetica", 10)
-    c.drawString(margin, h - margin - 14, f"Yaratilgan: {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')}")
-    c.drawRightString(w - margin, h - margin - 14, f"Jami: {len(rows)}")
-
-    # Columns
-    y = h - margin - 34
-    line_h = 10
-    col = {
-        "tg": margin,
-        "name": margin + 44 * mm,
-        "user": margin + 110 * mm,
-        "phone": margin + 142 * mm,
-        "reg": margin + 172 * mm,
-        "created": margin + 188 * mm,
-    }
-
-    def header_row():
-        nonlocal y
-        c.setFont("Helvetica-Bold", 9)
-        c.setFillGray(0)
-        c.drawString(col["tg"], y, "TG_ID")
-        c.drawString(col["name"], y, "Ism Familiya")
-        c.drawString(col["user"], y, "Username")
-        c.drawString(col["phone"], y, "Telefon")
-        c.drawString(col["reg"], y, "Reg")
-        c.drawString(col["created"], y, "Qo'shilgan")
-        y -= line_h
-        c.setLineWidth(0.6)
-        c.setStrokeGray(0.75)
-        c.line(margin, y, w - margin, y)
-        y -= 6
-
-    def new_page():
-        nonlocal y
-        c.showPage()
-        c.setFont("Helvetica-Bold", 15)
-        c.drawString(margin, h - margin, "MSR — Userlar hisobot")
-        c.setFont("Helvetica", 10)
-        c.drawString(margin, h - margin - 14, f"Davom etadi — {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')}")
-        y = h - margin - 34
-        header_row()
-
-    header_row()
-
-    c.setFont("Helvetica", 8.5)
-    c.setFillGray(0)
-
-    for i, (tg_id, full, uname, phone, reg, base, created) in enumerate(rows, start=1):
-        if y < margin + 18:
-            new_page()
-
-        # TG id
-        c.drawString(col["tg"], y, str(tg_id))
-
-        # Name (truncate gently)
-        name_txt = (full[:42] + "…") if len(full) > 43 else full
-        c.drawString(col["name"], y, name_txt)
-
-        # Username
-        u_txt = (uname[:18] + "…") if len(uname) > 19 else uname
-        c.drawString(col["user"], y, u_txt)
-
-        # Phone
-        p_txt = (phone[:16] + "…") if len(phone) > 17 else phone
-        c.drawString(col["phone"], y, p_txt)
-
-        # Registered + baseline mark
-        r_txt = reg
-        if base == "Ha":
-            r_txt = f"{reg}*"
-        c.drawString(col["reg"], y, r_txt)
-
-        # Created
-        c.drawString(col["created"], y, created)
-
-        y -= line_h
-
-        # Subtle row lines
-        if i % 2 == 0:
-            c.setStrokeGray(0.92)
-            c.line(margin, y + 2, w - margin, y + 2)
-            c.setStrokeGray(0.75)
-
-    # Footer note
-    if y < margin + 40:
-        new_page()
-    c.setFont("Helvetica", 8)
-    c.setFillGray(0.35)
-    c.drawString(margin, margin + 10, "* Baseline = Rasch bazasi uchun fake user")
-
-    c.save()
-    return out
+def _is_staff(tg_id: int) -> bool:
+    return _is_ceo(tg_id) or tg_id in set(settings.admin_tg_ids or [])
 
 
 @router.message(Command("ceo"))
@@ -171,7 +53,329 @@ async def ceo_users_pdf(message: Message) -> None:
     if not _is_ceo(message.from_user.id):
         return
 
-    rows = await _fetch_users()
-    pdf_path = _render_users_pdf(rows)
-    caption = f"📄 Userlar hisobot (jami {len(rows)})"
-    await message.answer_document(FSInputFile(str(pdf_path)), caption=caption)
+    status = await message.answer("⏳ Hisobot tayyorlanmoqda...")
+    last_edit = 0.0
+
+    async def on_progress(done: int, total: int) -> None:
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < 3 or done >= total:
+            return
+        last_edit = now
+        try:
+            await status.edit_text(f"⏳ Hisobot: {done}/{total}")
+        except Exception:
+            pass
+
+    pdf_path, count, _cached = await get_users_report(progress=on_progress)
+    caption = f"📄 Userlar hisobot (jami {count})"
+    await answer_document_cached(message, pdf_path, caption=caption)
+    try:
+        await status.delete()
+    except Exception:
+        pass
+
+
+@router.message(Command("certs_zip"))
+async def ceo_certificates_zip(message: Message, command: CommandObject) -> None:
+    """/certs_zip <test_id> — test bo'yicha barcha sertifikatlar ZIP arxivda."""
+    if not message.from_user or not _is_staff(message.from_user.id):
+        return
+    arg = (command.args or "").strip()
+    if not arg.isdigit():
+        await message.answer("Foydalanish: /certs_zip <test_id>")
+        return
+    test_id = int(arg)
+    # uzoq handler: qisqa session, update connection'i ZIP davomida band bo'lib turmasin
+    try:
+        async with standalone_session() as session:
+            test = await get_test_info(session, test_id)
+    except NoResultFound:
+        await message.answer("Test topilmadi.")
+        return
+
+    status = await message.answer(f"⏳ Sertifikatlar tayyorlanmoqda: {test.name}")
+    last_edit = 0.0
+
+    async def on_progress(p: ExportProgress) -> None:
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < 3 and p.done < p.total:
+            return
+        last_edit = now
+        try:
+            await status.edit_text(f"⏳ {test.name}: {p.done}/{p.total} (yangi: {p.rendered}, xato: {p.failed})")
+        except Exception:
+            pass
+
+    EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    out = EXPORTS_DIR / f"certificates_test_{test_id}_{ts}.zip"
+    try:
+        with out.open("wb") as f:
+
+            async def write(chunk: bytes) -> None:
+                f.write(chunk)
+
+            prog = await write_test_certificates_zip(test_id, write, progress=on_progress)
+
+        if prog.total == 0:
+            await status.edit_text("Bu test bo'yicha ishtirokchilar yo'q.")
+            return
+        if out.stat().st_size > TG_DOCUMENT_LIMIT:
+            # to'g'ridan-to'g'ri /api havolasi ishlamaydi (initData auth kerak) -> Mini App admin ekrani
+            await status.edit_text(
+                f"Arxiv juda katta ({out.stat().st_size // (1024 * 1024)} MB). Mini App orqali yuklab oling.",
+                reply_markup=webapp_open_kb(
+                    url=f"{settings.effective_miniapp_url}/?mode=admin&test_id={test_id}", label="📦 Mini App"
+                ),
+            )
+            return
+        caption = f"📦 {test.name}: {prog.total - prog.failed}/{prog.total} sertifikat"
+        await message.answer_document(FSInputFile(str(out)), caption=caption)
+        try:
+            await status.delete()
+        except Exception:
+            pass
+    finally:
+        out.unlink(missing_ok=True)
+
+
+async def _send_export(message: Message, dataset: str, fmt: str, test_id: int = 0) -> None:
+    status = await message.answer("⏳ Eksport tayyorlanmoqda...")
+    last_edit = 0.0
+
+    async def on_progress(rows: int) -> None:
+        nonlocal last_edit
+        now = time.monotonic()
+        if now - last_edit < 3:
+            return
+        last_edit = now
+        try:
+            await status.edit_text(f"⏳ Eksport: {rows} qator")
+        except Exception:
+            pass
+
+    try:
+        out, rows = await export_dataset(dataset, fmt, test_id=test_id or None, progress=on_progress)
+    except NoResultFound:
+        await status.edit_text("Test topilmadi.")
+        return
+    try:
+        if out.stat().st_size > TG_DOCUMENT_LIMIT and fmt == "csv":
+            out = await asyncio.to_thread(zip_file, out)
+        size = out.stat().st_size
+        if size > TG_DOCUMENT_LIMIT:
+            # fayl serverda qoldirilmaydi (data/exports to'lib ketmasin), CEO'ga server yo'li ko'rsatilmaydi
+            await status.edit_text(
+                f"Fayl juda katta ({size // (1024 * 1024)} MB, Telegram limiti "
+                f"{TG_DOCUMENT_LIMIT // (1024 * 1024)} MB). Eksportni toraytiring: "
+                "bitta test uchun /export test <test_id> csv"
+            )
+            return
+        await message.answer_document(FSInputFile(str(out)), caption=f"📤 {out.name} — {rows} qator")
+        try:
+            await status.delete()
+        except Exception:
+            pass
+    finally:
+        out.unlink(missing_ok=True)
+
+
+@router.message(lambda m: (m.text or "").strip() in CEO_EXPORT_BUTTONS)
+async def ceo_export_button(message: Message) -> None:
+    if not message.from_user or not _is_ceo(message.from_user.id):
+        return
+    dataset, fmt = CEO_EXPORT_BUTTONS[(message.text or "").strip()]
+    await _send_export(message, dataset, fmt)
+
+
+@router.message(Command("export"))
+async def ceo_export(message: Message, command: CommandObject) -> None:
+    """/export users|submissions [csv|xlsx]  yoki  /export test <test_id> [csv|xlsx]"""
+    if not message.from_user or not _is_ceo(message.from_user.id):
+        return
+    args = (command.args or "").split()
+    dataset = args[0].lower() if args else ""
+    rest = args[1:]
+    test_id = 0
+    if dataset == "test":
+        if not rest or not rest[0].isdigit():
+            dataset = ""
+        else:
+            test_id = int(rest.pop(0))
+    fmt = rest[0].lower() if rest else "csv"
+    if dataset not in DATASETS or fmt not in FORMATS:
+        await message.answer(
+            "Foydalanish:\n"
+            "/export users [csv|xlsx]\n"
+            "/export submissions [csv|xlsx]\n"
+            "/export test <test_id> [csv|xlsx]"
+        )
+        return
+    await _send_export(message, dataset, fmt, test_id)
+
+
+# ---------------- analytics (faqat rollup jadvallar) ----------------
+
+def _format_dashboard(d: dict) -> str:
+    t = d["totals"]
+    lines = [
+        "📊 Statistika",
+        f"Userlar (jami): {t['signups']}",
+        f"Topshirishlar (jami): {t['submissions']}, o'rtacha ball: {t['avg_score']}",
+        "",
+        "Oxirgi kunlar (sana: yangi user / topshirish / o'rtacha):",
+    ]
+    for day in d["days"][-14:]:
+        lines.append(f"{day['day']}: {day['signups']} / {day['submissions']} / {day['avg_score']}")
+    if d["tests"]:
+        lines += ["", "Eng faol testlar:"]
+        for r in d["tests"]:
+            lines.append(f"#{r['test_id']} {r['name']} ({r['category']}): {r['submissions']} ta, o'rtacha {r['avg_score']}")
+    return "\n".join(lines)
+
+
+@router.message(lambda m: (m.text or "").strip() == CEO_STATS_BUTTON)
+@router.message(Command("stats"))
+async def ceo_stats(message: Message, session: AsyncSession) -> None:
+    if not message.from_user or not _is_ceo(message.from_user.id):
+        return
+    d = await analytics.dashboard(session, days=30)
+    await message.answer(_format_dashboard(d))
+
+
+@router.message(Command("stats_test"))
+async def ceo_stats_test(message: Message, command: CommandObject, session: AsyncSession) -> None:
+    """/stats_test <test_id> — ball/daraja taqsimoti."""
+    if not message.from_user or not _is_ceo(message.from_user.id):
+        return
+    arg = (command.args or "").strip()
+    if not arg.isdigit():
+        await message.answer("Foydalanish: /stats_test <test_id>")
+        return
+    try:
+        d = await analytics.test_distribution(session, int(arg))
+    except NoResultFound:
+        await message.answer("Test topilmadi.")
+        return
+    lines = [
+        f"📊 #{d['test_id']} {d['name']} ({d['category']})",
+        f"Topshirishlar: {d['submissions']}, o'rtacha ball: {d['avg_score']}",
+        "",
+    ]
+    lines += [f"{bucket}: {count}" for bucket, count in d["distribution"].items()] or ["Hali natija yo'q."]
+    await message.answer("\n".join(lines))
+
+
+@router.message(Command("stats_backfill"))
+async def ceo_stats_backfill(message: Message) -> None:
+    """Rollup jadvallarini butun tarixdan qayta hisoblaydi (migratsiyadan keyin bir marta)."""
+    if not message.from_user or not _is_ceo(message.from_user.id):
+        return
+    status = await message.answer("⏳ Statistika qayta hisoblanmoqda...")
+    started = time.monotonic()
+    async with standalone_session() as session:
+        r = await analytics.backfill(session)
+    await status.edit_text(
+        f"✅ Tayyor ({time.monotonic() - started:.1f}s): {r['days']} kun, {r['tests']} test, "
+        f"{r['submissions']} topshirish, {r['signups']} user"
+    )
+
+
+# ---------------- broadcasts (e'lonlar) ----------------
+
+def _format_eta(seconds) -> str:
+    if seconds is None:
+        return "—"
+    seconds = int(seconds)
+    return f"{seconds // 60}m {seconds % 60:02d}s" if seconds >= 60 else f"{seconds}s"
+
+
+def _format_broadcast(d: dict) -> str:
+    done = d["sent"] + d["blocked"] + d["failed"]
+    line = (
+        f"📣 #{d['id']} [{d['status']}] {done}/{d['total']}: "
+        f"yuborildi {d['sent']}, bloklagan {d['blocked']}, xato {d['failed']}"
+    )
+    if d.get("rate"):
+        line += f" | {d['rate']} msg/s, ETA {_format_eta(d.get('eta_s'))}"
+    return line
+
+
+async def _start_broadcast(message: Message, text: str, test_id: int = 0) -> None:
+    bid = await broadcasts.create(text=text, created_by=message.from_user.id, test_id=test_id or None)
+    status = await message.answer(f"⏳ E'lon #{bid} navbatga qo'yildi...")
+
+    async def on_progress(run: BroadcastRun) -> None:
+        try:
+            await status.edit_text(_format_broadcast(run.as_dict()))
+        except Exception:
+            pass
+
+    if not await broadcasts.start(message.bot, bid, progress=on_progress):
+        await status.edit_text(f"E'lon #{bid} boshqa process'da ishlayapti: /broadcast_status")
+
+
+@router.message(Command("broadcast_test"))
+async def broadcast_test(message: Message, command: CommandObject, session: AsyncSession) -> None:
+    """/broadcast_test <test_id> — yangi test haqida barcha userlarga e'lon (tugma: PDF deep-link)."""
+    if not message.from_user or not _is_staff(message.from_user.id):
+        return
+    arg = (command.args or "").strip()
+    if not arg.isdigit():
+        await message.answer("Foydalanish: /broadcast_test <test_id>")
+        return
+    try:
+        test = await get_test_info(session, int(arg))
+    except NoResultFound:
+        await message.answer("Test topilmadi.")
+        return
+    label = dict(CATEGORIES).get(test.category, test.category)
+    text = f"🆕 Yangi test: {test.name}\n{label}\n\nPDF'ni olish uchun pastdagi tugmani bosing."
+    await _start_broadcast(message, text, test.id)
+
+
+@router.message(Command("broadcast"))
+async def broadcast_text(message: Message, command: CommandObject) -> None:
+    """/broadcast <matn> — erkin matnli e'lon (faqat CEO)."""
+    if not message.from_user or not _is_ceo(message.from_user.id):
+        return
+    text = (command.args or "").strip()
+    if not text:
+        await message.answer("Foydalanish: /broadcast <matn>")
+        return
+    await _start_broadcast(message, text)
+
+
+@router.message(Command("broadcast_status"))
+async def broadcast_status(message: Message) -> None:
+    if not message.from_user or not _is_staff(message.from_user.id):
+        return
+    rows = await broadcasts.status(limit=5)
+    await message.answer("\n".join(_format_broadcast(d) for d in rows) or "Hali e'lon yo'q.")
+
+
+@router.message(Command("broadcast_cancel"))
+async def broadcast_cancel(message: Message, command: CommandObject) -> None:
+    if not message.from_user or not _is_staff(message.from_user.id):
+        return
+    arg = (command.args or "").strip()
+    if not arg.isdigit():
+        await message.answer("Foydalanish: /broadcast_cancel <id>")
+        return
+    ok = await broadcasts.cancel(int(arg))
+    await message.answer(f"🛑 E'lon #{arg} to'xtatildi." if ok else "Faol e'lon topilmadi.")
+
+
+@router.message(Command("broadcast_resume"))
+async def broadcast_resume(message: Message, command: CommandObject) -> None:
+    """To'xtab qolgan (xato/restart) e'lonni shu process'da davom ettiradi."""
+    if not message.from_user or not _is_staff(message.from_user.id):
+        return
+    arg = (command.args or "").strip()
+    if not arg.isdigit():
+        await message.answer("Foydalanish: /broadcast_resume <id>")
+        return
+    ok = await broadcasts.start(message.bot, int(arg))
+    await message.answer(f"▶️ E'lon #{arg} davom etmoqda." if ok else "E'lon tugagan yoki boshqa process'da ishlayapti.")
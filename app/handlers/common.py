@@ -3,10 +3,10 @@ from __future__ import annotations
 from pathlib import Path
 
 from aiogram import Router, F
-from aiogram.filters import CommandStart
-from aiogram.types import Message, FSInputFile, CallbackQuery
+from aiogram.filters import JOIN_TRANSITION, LEAVE_TRANSITION, ChatMemberUpdatedFilter, CommandStart
+from aiogram.types import CallbackQuery, ChatMemberUpdated, Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
 from app.keyboards import (
     join_gate_kb,
     main_menu_kb,
@@ -20,8 +20,10 @@ from app.services.repo import (
     get_setting,
     mark_registered,
     get_user,
+    set_user_blocked,
 )
 from app.services.certificates_store import get_certificate_path
+from app.services.file_ids import answer_document_cached
 
 router = Router()
 
@@ -50,25 +52,20 @@ def _normalize_chat_ref(ref: str) -> str:
     return r
 
 
-async def _get_required_channel() -> str:
-    async with SessionLocal() as session:
-        v = (await get_setting(session, "required_channel", settings.required_channel)).strip()
-    return v
+async def _get_required_channel(session: AsyncSession) -> str:
+    return (await get_setting(session, "required_channel", settings.required_channel)).strip()
 
 
-async def _get_required_group() -> str:
-    async with SessionLocal() as session:
-        v = (await get_setting(session, "required_group", settings.required_group)).strip()
-    return v
+async def _get_required_group(session: AsyncSession) -> str:
+    return (await get_setting(session, "required_group", settings.required_group)).strip()
 
 
-async def _get_required_urls() -> tuple[str, str]:
-    async with SessionLocal() as session:
-        ch_url = (await get_setting(session, "required_channel_url", settings.required_channel_url)).strip()
-        gr_url = (await get_setting(session, "required_group_url", settings.required_group_url)).strip()
+async def _get_required_urls(session: AsyncSession) -> tuple[str, str]:
+    ch_url = (await get_setting(session, "required_channel_url", settings.required_channel_url)).strip()
+    gr_url = (await get_setting(session, "required_group_url", settings.required_group_url)).strip()
 
-    ch = _normalize_chat_ref(await _get_required_channel())
-    gr = _normalize_chat_ref(await _get_required_group())
+    ch = _normalize_chat_ref(await _get_required_channel(session))
+    gr = _normalize_chat_ref(await _get_required_group(session))
 
     if not ch_url and ch.startswith("@"):
         ch_url = f"https://t.me/{ch[1:]}"
@@ -77,9 +74,9 @@ async def _get_required_urls() -> tuple[str, str]:
     return ch_url, gr_url
 
 
-async def _check_membership(message: Message) -> bool:
-    ch = _normalize_chat_ref(await _get_required_channel())
-    gr = _normalize_chat_ref(await _get_required_group())
+async def _check_membership(message: Message, session: AsyncSession) -> bool:
+    ch = _normalize_chat_ref(await _get_required_channel(session))
+    gr = _normalize_chat_ref(await _get_required_group(session))
     if not ch and not gr:
         return True
 
@@ -96,16 +93,16 @@ async def _check_membership(message: Message) -> bool:
 
 
 @router.callback_query(F.data == "gate_check")
-async def gate_check(callback: CallbackQuery) -> None:
+async def gate_check(callback: CallbackQuery, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
-    ok = await _check_membership(callback.message)
+    ok = await _check_membership(callback.message, session)
     if ok:
         tg_id = callback.from_user.id if callback.from_user else 0
         await callback.message.answer("✅ Tasdiqlandi. Menyu:", reply_markup=main_menu_kb(_roles_for_tg(tg_id)))
     else:
-        ch_url, gr_url = await _get_required_urls()
+        ch_url, gr_url = await _get_required_urls(session)
         await callback.message.answer(
             "❗️ Hali kanal/guruhga qo‘shilmagansiz. Iltimos, avval qo‘shiling.",
             reply_markup=join_gate_kb(ch_url, gr_url),
@@ -142,7 +139,7 @@ async def clear_chat(message: Message) -> None:
 
 # ✅ ENG MUHIM FIX: contact handler'ni F.contact bilan ushlash
 @router.message(F.contact)
-async def contact_received(message: Message) -> None:
+async def contact_received(message: Message, session: AsyncSession) -> None:
     if not message.from_user or not message.contact:
         return
 
@@ -153,15 +150,14 @@ async def contact_received(message: Message) -> None:
 
     phone = (message.contact.phone_number or "").strip()
 
-    async with SessionLocal() as session:
-        await get_or_create_user(
-            session,
-            tg_id=message.from_user.id,
-            first_name=message.from_user.first_name or "",
-            last_name=message.from_user.last_name or "",
-            username=message.from_user.username or "",
-        )
-        await mark_registered(session, message.from_user.id, phone)
+    await get_or_create_user(
+        session,
+        tg_id=message.from_user.id,
+        first_name=message.from_user.first_name or "",
+        last_name=message.from_user.last_name or "",
+        username=message.from_user.username or "",
+    )
+    await mark_registered(session, message.from_user.id, phone)
 
     kb = main_menu_kb(_roles_for_tg(message.from_user.id))
     # ixtiyoriy: contact keyboardni yopish uchun reply_markup=None ham qilish mumkin
@@ -202,7 +198,7 @@ async def go_back_to_main(message: Message) -> None:
     await message.answer("⬅️ Orqaga", reply_markup=main_menu_kb(_roles_for_tg(message.from_user.id)))
 
 
-async def _handle_start_payload(message: Message, payload: str) -> bool:
+async def _handle_start_payload(message: Message, session: AsyncSession, payload: str) -> bool:
     payload = (payload or "").strip()
     if not payload:
         return False
@@ -213,16 +209,15 @@ async def _handle_start_payload(message: Message, payload: str) -> bool:
         except Exception:
             return False
 
-        from app.services.repo import get_test
-        async with SessionLocal() as session:
-            t = await get_test(session, test_id)
+        from app.services.repo import get_test_info
+        t = await get_test_info(session, test_id)
 
         fpath = Path(t.pdf_path or "")
         if not fpath.exists():
             await message.answer("PDF topilmadi. Admin qayta yuklashi kerak.")
             return True
 
-        await message.answer_document(FSInputFile(str(fpath)), caption=f"📄 {t.name}")
+        await answer_document_cached(message, fpath, caption=f"📄 {t.name}")
         return True
 
     if payload.startswith("cert_"):
@@ -234,29 +229,41 @@ async def _handle_start_payload(message: Message, payload: str) -> bool:
         if not path:
             await message.answer("Sertifikat topilmadi.")
             return True
-        await message.answer_document(FSInputFile(str(path)), caption="📄 Sertifikat")
+        await answer_document_cached(message, path, caption="📄 Sertifikat")
         return True
 
     return False
 
 
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(LEAVE_TRANSITION))
+async def bot_blocked(event: ChatMemberUpdated, session: AsyncSession) -> None:
+    # user botni blokladi: e'lonlar unga yuborilmaydi
+    await set_user_blocked(session, event.from_user.id, True)
+
+
+@router.my_chat_member(F.chat.type == "private", ChatMemberUpdatedFilter(JOIN_TRANSITION))
+async def bot_unblocked(event: ChatMemberUpdated, session: AsyncSession) -> None:
+    # unblock (/start bosmasdan ham): e'lonlar yana yuboriladi
+    await set_user_blocked(session, event.from_user.id, False)
+
+
 @router.message(CommandStart())
-async def start(message: Message) -> None:
+async def start(message: Message, session: AsyncSession) -> None:
     if not message.from_user:
         return
 
-    async with SessionLocal() as session:
-        await get_or_create_user(
-            session,
-            tg_id=message.from_user.id,
-            first_name=message.from_user.first_name or "",
-            last_name=message.from_user.last_name or "",
-            username=message.from_user.username or "",
-        )
+    # bitta update -> bitta session/connection (DbSessionMiddleware)
+    await get_or_create_user(
+        session,
+        tg_id=message.from_user.id,
+        first_name=message.from_user.first_name or "",
+        last_name=message.from_user.last_name or "",
+        username=message.from_user.username or "",
+    )
 
-    ok = await _check_membership(message)
+    ok = await _check_membership(message, session)
     if not ok:
-        ch_url, gr_url = await _get_required_urls()
+        ch_url, gr_url = await _get_required_urls(session)
         await message.answer(
             "Botdan foydalanish uchun avval kanal va guruhga qo'shiling, so'ng ✅ Tekshirib ko'rish tugmasini bosing.",
             reply_markup=join_gate_kb(ch_url, gr_url),
@@ -266,15 +273,14 @@ async def start(message: Message) -> None:
     # payload
     parts = (message.text or "").split(maxsplit=1)
     if len(parts) == 2:
-        if await _handle_start_payload(message, parts[1]):
+        if await _handle_start_payload(message, session, parts[1]):
             return
 
     roles = _roles_for_tg(message.from_user.id)
     kb = main_menu_kb(roles)
 
     # registration (phone)
-    async with SessionLocal() as session:
-        u = await get_user(session, message.from_user.id)
+    u = await get_user(session, message.from_user.id)
 
     ceo_only = ("ceo" in roles) and ("admin" not in roles)
     if u and not u.is_registered and not ceo_only:
@@ -6,17 +6,19 @@ from typing import Optional
 from aiogram import Router
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import CallbackQuery, Message, FSInputFile
+from aiogram.types import CallbackQuery, Message
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
 from app.keyboards import (
     CATEGORIES,
     categories_kb,
     main_menu_kb,
-    tests_list_kb,
+    parse_page_callback,
+    tests_page_kb,
     webapp_open_kb,
 )
-from app.services.repo import list_tests_by_category, get_test
+from app.services.file_ids import answer_document_cached
+from app.services.repo import list_tests_page, get_test_info
 from app.settings import settings
 
 router = Router()
@@ -76,7 +78,7 @@ async def check_entry(message: Message, state: FSMContext) -> None:
 
 
 @router.message(Flow.choosing_category)
-async def choose_category(message: Message, state: FSMContext) -> None:
+async def choose_category(message: Message, state: FSMContext, session: AsyncSession) -> None:
     label = (message.text or "").strip()
     if label in {"⬅️ Ortga", "⬅️ Orqaga", "🏠 Asosiy sahifa", "🏠 Asosiy"}:
         await state.clear()
@@ -88,10 +90,9 @@ async def choose_category(message: Message, state: FSMContext) -> None:
         await message.answer("Iltimos, kategoriya tugmasidan tanlang.", reply_markup=categories_kb(back=True))
         return
 
-    async with SessionLocal() as session:
-        rows = await list_tests_by_category(session, cat_key)
+    page = await list_tests_page(session, cat_key)
 
-    if not rows:
+    if not page.rows:
         await message.answer("Hozircha bu kategoriyada test yo'q.", reply_markup=categories_kb(back=True))
         return
 
@@ -100,17 +101,36 @@ async def choose_category(message: Message, state: FSMContext) -> None:
     if mode == "check":
         await message.answer(
             "Testni tanlang (Tekshirish):",
-            reply_markup=tests_list_kb(rows, prefix="check", include_back=True),
+            reply_markup=tests_page_kb(page, prefix="check"),
         )
     else:
         await message.answer(
             "Testni tanlang (PDF):",
-            reply_markup=tests_list_kb(rows, prefix="pdf", include_back=True),
+            reply_markup=tests_page_kb(page, prefix="pdf"),
         )
 
 
+@router.callback_query(lambda c: (c.data or "").startswith("pg:"))
+async def tests_page_nav(callback: CallbackQuery, session: AsyncSession) -> None:
+    """◀️/▶️ barcha test ro'yxatlari uchun (user va admin): xabar o'rnida sahifa almashadi."""
+    parsed = parse_page_callback(callback.data or "")
+    if not callback.message or parsed is None:
+        await callback.answer()
+        return
+    prefix, category, cursor = parsed
+    page = await list_tests_page(session, category, cursor)
+    if not page.rows:
+        await callback.answer("Bu sahifada test qolmadi.", show_alert=False)
+        return
+    await callback.answer()
+    try:
+        await callback.message.edit_reply_markup(reply_markup=tests_page_kb(page, prefix=prefix))
+    except Exception:
+        pass  # "message is not modified" (tez-tez bosilganda)
+
+
 @router.callback_query(lambda c: (c.data or "").startswith("pdf:"))
-async def send_pdf(callback: CallbackQuery, state: FSMContext) -> None:
+async def send_pdf(callback: CallbackQuery, state: FSMContext, session: AsyncSession) -> None:
     if not callback.message:
         return
     await callback.answer()
@@ -120,8 +140,7 @@ async def send_pdf(callback: CallbackQuery, state: FSMContext) -> None:
         return
 
     test_id = int(callback.data.split(":")[1])
-    async with SessionLocal() as session:
-        t = await get_test(session, test_id)
+    t = await get_test_info(session, test_id)
 
     fpath = Path(t.pdf_path or "")
     if not fpath.exists():
@@ -129,7 +148,7 @@ async def send_pdf(callback: CallbackQuery, state: FSMContext) -> None:
         return
 
     await state.clear()
-    await callback.message.answer_document(FSInputFile(str(fpath)), caption=f"📄 {t.name}")
+    await answer_document_cached(callback.message, fpath, caption=f"📄 {t.name}")
 
 
 @router.callback_query(lambda c: (c.data or "").startswith("check:"))
@@ -1,5 +1,10 @@
 from __future__ import annotations
 
+import weakref
+from functools import lru_cache, wraps
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple, TypeVar, Union
+
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.types import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -9,8 +14,47 @@ from aiogram.types import (
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 
+from app.services.cache import LRUCache
 from app.settings import settings
 
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+    from app.services.catalog import TestsPage
+
+
+Markup = Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]
+M = TypeVar("M", InlineKeyboardMarkup, ReplyKeyboardMarkup)
+
+
+# ---------------- memoization ----------------
+# Menyular har xabarda bir xil: markup bir marta quriladi va umumiy obyekt qaytariladi.
+# Umumiy markup'larni hech kim o'zgartirmasligi kerak (aiogram ularni faqat o'qiydi).
+
+_shared: "weakref.WeakValueDictionary[int, Markup]" = weakref.WeakValueDictionary()
+
+
+def _share(markup: M) -> M:
+    _shared[id(markup)] = markup
+    return markup
+
+
+def is_shared(markup: Any) -> bool:
+    """True for memoized markups (safe to serialize once and reuse the JSON)."""
+    return _shared.get(id(markup)) is markup
+
+
+def _memoized(maxsize: Optional[int] = None) -> Callable[[Callable[..., M]], Callable[..., M]]:
+    def deco(fn: Callable[..., M]) -> Callable[..., M]:
+        @lru_cache(maxsize=maxsize)
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> M:
+            return _share(fn(*args, **kwargs))
+
+        return wrapper
+
+    return deco
+
 
 # 5 ta kategoriya (talab bo'yicha)
 CATEGORIES = [
@@ -22,6 +66,7 @@ CATEGORIES = [
 ]
 
 
+@_memoized()
 def user_menu_kb() -> ReplyKeyboardMarkup:
     """User panel: 3 tugma (talab bo'yicha)."""
     kb = ReplyKeyboardBuilder()
@@ -32,6 +77,7 @@ def user_menu_kb() -> ReplyKeyboardMarkup:
     return kb.as_markup(resize_keyboard=True)
 
 
+@_memoized()
 def admin_menu_reply_kb() -> ReplyKeyboardMarkup:
     """Admin panel: 3 tugma (talab bo'yicha)."""
     kb = ReplyKeyboardBuilder()
@@ -44,6 +90,7 @@ def admin_menu_reply_kb() -> ReplyKeyboardMarkup:
     return kb.as_markup(resize_keyboard=True)
 
 
+@_memoized()
 def request_contact_kb() -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardBuilder()
     kb.add(KeyboardButton(text="📞 Telefon raqamni ulashish", request_contact=True))
@@ -52,6 +99,7 @@ def request_contact_kb() -> ReplyKeyboardMarkup:
     return kb.as_markup(resize_keyboard=True)
 
 
+@_memoized(maxsize=64)
 def webapp_open_kb(url: str, label: str = "🔗 Mini App") -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.add(InlineKeyboardButton(text=label, web_app=WebAppInfo(url=url)))
@@ -65,7 +113,12 @@ def main_menu_kb(roles: set[str] | None = None) -> ReplyKeyboardMarkup:
     - Always shows user actions.
     - If roles include admin and/or ceo, shows buttons to open those panels.
     """
-    roles = roles or {"user"}
+    # rollar to'plami bo'yicha memo (user / +admin / +ceo -> 4 xil menyu)
+    return _main_menu_kb(frozenset(roles or {"user"}))
+
+
+@_memoized()
+def _main_menu_kb(roles: frozenset[str]) -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardBuilder()
 
     # User actions
@@ -84,20 +137,35 @@ def main_menu_kb(roles: set[str] | None = None) -> ReplyKeyboardMarkup:
     return kb.as_markup(resize_keyboard=True)
 
 
+CEO_STATS_BUTTON = "📊 Statistika"
+
+CEO_EXPORT_BUTTONS = {
+    "📤 Userlar CSV": ("users", "csv"),
+    "📤 Userlar XLSX": ("users", "xlsx"),
+    "📤 Natijalar CSV": ("submissions", "csv"),
+    "📤 Natijalar XLSX": ("submissions", "xlsx"),
+}
+
+
+@_memoized()
 def ceo_menu_kb() -> ReplyKeyboardMarkup:
-    """CEO menyusi: faqat userlar ro'yxati PDF.
+    """CEO menyusi: userlar ro'yxati PDF, statistika + CSV/XLSX eksportlar.
 
     CEO test yaratmaydi ham, test ishlamaydi ham.
     """
     kb = ReplyKeyboardBuilder()
     kb.add(KeyboardButton(text="Userlar ro'yxatini olish (pdf)"))
+    kb.add(KeyboardButton(text=CEO_STATS_BUTTON))
+    for text in CEO_EXPORT_BUTTONS:
+        kb.add(KeyboardButton(text=text))
     kb.add(KeyboardButton(text="⬅️ Orqaga"))
     kb.add(KeyboardButton(text="🏠 Asosiy sahifa"))
     kb.add(KeyboardButton(text="Clear"))
-    kb.adjust(2, 2)
+    kb.adjust(2, 2, 2, 2, 1)
     return kb.as_markup(resize_keyboard=True)
 
 
+@_memoized()
 def categories_kb(back: bool = True) -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardBuilder()
     for _, label in CATEGORIES:
@@ -109,6 +177,7 @@ def categories_kb(back: bool = True) -> ReplyKeyboardMarkup:
     return kb.as_markup(resize_keyboard=True)
 
 
+@_memoized()
 def back_reply_kb() -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardBuilder()
     kb.add(KeyboardButton(text="⬅️ Orqaga"))
@@ -116,6 +185,7 @@ def back_reply_kb() -> ReplyKeyboardMarkup:
     return kb.as_markup(resize_keyboard=True)
 
 
+@_memoized(maxsize=16)
 def join_gate_kb(channel_url: str, group_url: str) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     if channel_url:
@@ -138,6 +208,53 @@ def tests_list_kb(test_rows: list[tuple[int, str]], prefix: str, include_back: b
     return b.as_markup()
 
 
+# ---------------- paginated test lists ----------------
+# callback: "pg:<prefix>:<category>:<cursor>" (64 bayt limitiga sig'adi)
+
+PAGE_CB = "pg"
+
+# (category, prefix, include_back, cursor) -> (catalog version, markup)
+_tests_pages: LRUCache[Tuple[str, str, bool, str], Tuple[int, InlineKeyboardMarkup]] = LRUCache(512)
+
+
+def page_callback(prefix: str, category: str, cursor: str) -> str:
+    return f"{PAGE_CB}:{prefix}:{category}:{cursor}"
+
+
+def parse_page_callback(data: str) -> Optional[Tuple[str, str, str]]:
+    """``pg:<prefix>:<category>:<cursor>`` -> (prefix, category, cursor); None if not a page callback."""
+    parts = (data or "").split(":")
+    if len(parts) != 4 or parts[0] != PAGE_CB:
+        return None
+    return parts[1], parts[2], parts[3]
+
+
+def tests_page_kb(page: "TestsPage", prefix: str, include_back: bool = True) -> InlineKeyboardMarkup:
+    """One page of test buttons + ◀️/▶️; cached per page until the catalog version changes."""
+    key = (page.category, prefix, include_back, page.cursor)
+    hit = _tests_pages.get(key)
+    if hit is not None and hit[0] == page.version:
+        return hit[1]
+    b = InlineKeyboardBuilder()
+    for tid, name in page.rows:
+        b.add(InlineKeyboardButton(text=name, callback_data=f"{prefix}:{tid}"))
+    nav = []
+    if page.prev_cursor:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=page_callback(prefix, page.category, page.prev_cursor)))
+    if page.next_cursor:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=page_callback(prefix, page.category, page.next_cursor)))
+    b.adjust(1)
+    if nav:
+        b.row(*nav)
+    if include_back:
+        b.row(InlineKeyboardButton(text="⬅️ Orqaga", callback_data=f"{prefix}:back"))
+        b.row(InlineKeyboardButton(text="🏠 Asosiy sahifa", callback_data="nav:home"))
+    markup = _share(b.as_markup())
+    _tests_pages.set(key, (page.version, markup))
+    return markup
+
+
+@_memoized(maxsize=64)
 def confirm_kb(prefix: str, yes_label: str = "✅ Ha", no_label: str = "❌ Yo'q") -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.add(InlineKeyboardButton(text=yes_label, callback_data=f"{prefix}:yes"))
@@ -146,6 +263,7 @@ def confirm_kb(prefix: str, yes_label: str = "✅ Ha", no_label: str = "❌ Yo'q
     return b.as_markup()
 
 
+@_memoized(maxsize=64)
 def answer_choice_kb(prefix: str, *, include_back: bool = True, include_finish: bool = False) -> InlineKeyboardMarkup:
     """Javob tanlash uchun inline tugmalar.
 
@@ -163,6 +281,15 @@ def answer_choice_kb(prefix: str, *, include_back: bool = True, include_finish:
     return b.as_markup()
 
 
+@_memoized(maxsize=16)
+def test_link_kb(bot_username: str, test_id: int) -> InlineKeyboardMarkup:
+    """E'lon tugmasi: bot deep-link orqali test PDF'ini ochadi (/start pdf_<id>)."""
+    b = InlineKeyboardBuilder()
+    b.add(InlineKeyboardButton(text="📄 Testni olish", url=f"https://t.me/{bot_username}?start=pdf_{test_id}"))
+    return b.as_markup()
+
+
+@_memoized(maxsize=256)
 def after_result_kb(prefix: str, test_id: int) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.add(InlineKeyboardButton(text="📄 Sertifikatni olish", callback_data=f"{prefix}:cert:{test_id}"))
@@ -171,6 +298,7 @@ def after_result_kb(prefix: str, test_id: int) -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+@_memoized()
 def admin_menu_kb() -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.add(InlineKeyboardButton(text="➕ Yangi test yaratish", callback_data="admin:create"))
@@ -182,9 +310,34 @@ def admin_menu_kb() -> InlineKeyboardMarkup:
     return b.as_markup()
 
 
+@_memoized(maxsize=64)
 def finish_kb(prefix: str) -> InlineKeyboardMarkup:
     b = InlineKeyboardBuilder()
     b.add(InlineKeyboardButton(text="✅ Tekshirish", callback_data=f"{prefix}:finish"))
     b.add(InlineKeyboardButton(text="⬅️ Ortga", callback_data=f"{prefix}:back"))
     b.adjust(1)
     return b.as_markup()
+
+
+# ---------------- bot session ----------------
+
+class MarkupCachingSession(AiohttpSession):
+    """Bot HTTP session that serializes each memoized markup to JSON only once.
+
+    aiogram ``reply_markup`` maydonini har so'rovda model_dump + json.dumps qiladi;
+    umumiy (memoized) markup uchun natija o'zgarmaydi, shuning uchun JSON qayta ishlatiladi.
+    """
+
+    def __init__(self, *args: Any, markup_cache_size: int = 512, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._markup_json: LRUCache[int, Tuple[Markup, Any]] = LRUCache(markup_cache_size)
+
+    def prepare_value(self, value: Any, bot: "Bot", files: Dict[str, Any], _dumps_json: bool = True) -> Any:
+        if not (_dumps_json and is_shared(value)):
+            return super().prepare_value(value, bot=bot, files=files, _dumps_json=_dumps_json)
+        hit = self._markup_json.get(id(value))
+        if hit is not None and hit[0] is value:
+            return hit[1]
+        out = super().prepare_value(value, bot=bot, files=files)
+        self._markup_json.set(id(value), (value, out))
+        return out
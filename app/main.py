@@ -1,44 +1,196 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import logging
-
-from aiogram import Bot, Dispatcher
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterator, List, Tuple
 
 from app.settings import settings
-from app.db import engine
-from app.models import Base
-from app.handlers import common, admin, tests, ceo
-from app.miniapp_server import start_miniapp
 
+if TYPE_CHECKING:
+    from aiogram import Bot, Dispatcher
+
+
+class StartupProfile:
+    """STARTUP_PROFILE=true: startup bosqichlari vaqtini bitta log qatorida chiqaradi."""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - t))
+
+    def report(self) -> None:
+        if not self.enabled:
+            return
+        parts = ", ".join(f"{name} {sec * 1000:.0f}ms" for name, sec in self.phases)
+        logging.info("Startup profile: %s | total %.0fms", parts, (time.perf_counter() - self.started) * 1000)
+
+
+def _import_bot_modules() -> None:
+    # aiogram + handlerlar importi startning eng qimmat qismi; thread'da DB tekshiruvi bilan parallel
+    import aiogram  # noqa: F401
+    import app.handlers.admin  # noqa: F401
+    import app.handlers.ceo  # noqa: F401
+    import app.handlers.common  # noqa: F401
+    import app.handlers.tests  # noqa: F401
+    import app.miniapp_server  # noqa: F401
+
+
+async def init_db() -> str:
+    """Runs create_all only when the DB is not at the Alembic head; returns what was done."""
+    from app.db import alembic_head, engine, schema_revision
+
+    head = alembic_head()
+    current = await schema_revision()
+    if head is not None and current == head:
+        return f"schema at {head}, create_all skipped"
+
+    from app.models import Base
 
-async def init_db() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    # create_all faqat yetishmagan jadvallarni yaratadi, mavjud jadvallarga ustun qo'shmaydi
+    logging.warning("DB schema is at %s, code expects %s: run `alembic upgrade head`", current or "(unversioned)", head)
+    return "create_all"
+
+
+WEBHOOK_FINGERPRINT_KEY = "webhook:fingerprint"
+
+
+async def on_webhook_startup(bot: Bot, dispatcher: Dispatcher) -> None:
+    url = settings.webhook_url
+    if not url:
+        raise RuntimeError("BOT_MODE=webhook needs WEBHOOK_BASE_URL or MINIAPP_PUBLIC_URL")
+    from app.db import SessionLocal
+    from app.services.repo import get_setting, set_setting
+
+    allowed = sorted(dispatcher.resolve_used_update_types())
+    # secret getWebhookInfo'da qaytmaydi: (url, secret, allowed_updates) hash'i settings jadvalida
+    fingerprint = hashlib.sha256(
+        json.dumps([url, settings.effective_webhook_secret, allowed]).encode()
+    ).hexdigest()
+    info = await bot.get_webhook_info()
+    # replikalar ketma-ket ko'tarilganda setWebhook'ni qayta-qayta chaqirmaslik (rate limit)
+    if info.url == url and sorted(info.allowed_updates or []) == allowed:
+        try:
+            async with SessionLocal() as session:
+                stored = await get_setting(session, WEBHOOK_FINGERPRINT_KEY, "")
+        except Exception:
+            logging.exception("Webhook fingerprint read failed, setting webhook")
+            stored = ""
+        if stored == fingerprint:
+            logging.info("Webhook already set: %s", url)
+            return
+    await bot.set_webhook(url, secret_token=settings.effective_webhook_secret, allowed_updates=allowed)
+    logging.info("Webhook set: %s", url)
+    try:
+        async with SessionLocal() as session:
+            await set_setting(session, WEBHOOK_FINGERPRINT_KEY, fingerprint)
+    except Exception:
+        logging.exception("Webhook fingerprint save failed")
+
+
+async def on_webhook_shutdown(bot: Bot) -> None:
+    if settings.webhook_delete_on_shutdown:
+        await bot.delete_webhook()
+        logging.info("Webhook deleted")
 
 
 async def main() -> None:
     logging.basicConfig(level=logging.INFO)
+    started_at = datetime.utcnow()
+    profile = StartupProfile(settings.startup_profile)
+
+    async def load_modules() -> None:
+        with profile.phase("import"):
+            await asyncio.to_thread(_import_bot_modules)
+
+    imports = asyncio.create_task(load_modules())
 
     # DB ishlamasa ham app yi yiqitib yubormaymiz
+    with profile.phase("db init"):
+        try:
+            logging.info("DB init: %s", await init_db())
+        except Exception:
+            logging.exception("DB init failed, continuing without DB")
+    await imports
+
+    from aiogram import Bot, Dispatcher
+
+    from app.handlers import admin, ceo, common, tests
+    from app.keyboards import MarkupCachingSession
+    from app.services.broadcast import broadcasts
+    from app.services.certificate_jobs import pipeline as certificate_pipeline
+    from app.miniapp_server import start_miniapp
+    from app.services.db_session import db_session, release_before_request
+    from app.services.fsm_storage import create_storage
+    from app.services.shutdown import graceful_shutdown, install_signal_handlers
+    from app.services.update_scheduler import scheduler
+
+    with profile.phase("routers"):
+        # menyu markup'larining JSON'i bir marta hisoblanadi (keyboards memo)
+        bot = Bot(token=settings.bot_token, session=MarkupCachingSession())
+        # Telegram so'rovidan oldin update'ning DB connection'i pool'ga qaytadi (idle in transaction yo'q)
+        bot.session.middleware(release_before_request)
+        # FSM holati DB'da: restartdan keyin ham saqlanadi, bir nechta replika bitta holatni ko'radi
+        dp = Dispatcher(storage=create_storage())
+
+        dp.include_router(ceo.router)
+        dp.include_router(admin.router)
+        dp.include_router(tests.router)
+        dp.include_router(common.router)
+
+        # handlerlar cheklangan worker pool'da, bitta user update'lari qat'iy ketma-ket
+        scheduler.setup(dp)
+        # scheduler'dan keyin: session handler ishlayotgan worker ichida ochiladi/yopiladi
+        db_session.setup(dp)
+
+    # oldingi run'da render bo'lmay qolgan sertifikatlar (pending) -> failed, keyingi so'rovda qayta render
     try:
-        await init_db()
+        await certificate_pipeline.recover(started_at=started_at)
     except Exception:
-        logging.exception("DB init failed, continuing without DB")
+        logging.exception("Certificate recovery failed")
 
-    bot = Bot(token=settings.bot_token)
-    dp = Dispatcher()
+    # egasiz e'lonlar (lease'i bo'sh/tugagan) shu process'da davom etadi: darhol va har SWEEP_INTERVAL'da
+    broadcasts.start_sweeper(bot)
 
-    dp.include_router(ceo.router)
-    dp.include_router(admin.router)
-    dp.include_router(tests.router)
-    dp.include_router(common.router)
+    if settings.use_webhook:
+        # bitta process: MiniApp + bot update'lari; bir nechta replika parallel ishlashi mumkin
+        dp.startup.register(on_webhook_startup)
+        dp.shutdown.register(on_webhook_shutdown)
+        with profile.phase("server bind"):
+            runner = await start_miniapp(bot, dp)
+        profile.report()
+        stop = asyncio.Event()
+        install_signal_handlers(stop.set)
+        try:
+            await stop.wait()
+        finally:
+            await graceful_shutdown(bot=bot, dp=dp, runner=runner)
+        return
 
-    runner = await start_miniapp()
+    with profile.phase("server bind"):
+        runner = await start_miniapp()
+    profile.report()
     try:
+        # webhook rejimidan qaytilganda getUpdates ishlashi uchun
+        await bot.delete_webhook()
+        # SIGTERM/SIGINT: aiogram polling'ni to'xtatadi, so'ng navbatdagi ish drain qilinadi
         await dp.start_polling(bot)
     finally:
-        await runner.cleanup()
+        await graceful_shutdown(bot=bot, dp=dp, runner=runner)
 
 
 if __name__ == "__main__":
@@ -4,6 +4,8 @@ import asyncio
 from logging.config import fileConfig
 
 from alembic import context
+from typing import Any, Dict, Tuple
+
 from sqlalchemy import pool
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
@@ -17,8 +19,20 @@ if config.config_file_name is not None:
 target_metadata = Base.metadata
 
 
+def _db_url() -> Tuple[str, Dict[str, Any]]:
+    """The bot's own database (app.db.engine, DATABASE_URL) + its connect_args.
+
+    SQLITE_PATH is used only when DATABASE_URL is unset (local dev without Postgres).
+    """
+    if not settings.database_url:
+        return settings.sqlite_url, {}
+    from app.db import CONNECT_ARGS, url
+
+    return url.render_as_string(hide_password=False), CONNECT_ARGS
+
+
 def run_migrations_offline() -> None:
-    url = settings.sqlite_url
+    url, _ = _db_url()
     context.configure(
         url=url,
         target_metadata=target_metadata,
@@ -37,13 +51,15 @@ def do_run_migrations(connection) -> None:
 
 async def run_migrations_online() -> None:
     configuration = config.get_section(config.config_ini_section) or {}
-    configuration["sqlalchemy.url"] = settings.sqlite_url
+    url, connect_args = _db_url()
+    configuration["sqlalchemy.url"] = url
 
     connectable = async_engine_from_config(
         configuration,
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
         future=True,
+        connect_args=connect_args,
     )
 
     async with connectable.connect() as connection:
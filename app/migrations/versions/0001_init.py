@@ -17,6 +17,10 @@ depends_on = None
 
 
 def upgrade() -> None:
+    # bot o'zi create_all bilan yaratgan DB (alembic_version'siz): boshlang'ich sxema allaqachon bor
+    if sa.inspect(op.get_bind()).has_table("users"):
+        return
+
     op.create_table(
         "settings",
         sa.Column("key", sa.String(length=128), primary_key=True),
@@ -31,8 +35,8 @@ def upgrade() -> None:
         sa.Column("last_name", sa.String(length=128), nullable=False, server_default=""),
         sa.Column("username", sa.String(length=128), nullable=False, server_default=""),
         sa.Column("phone", sa.String(length=64), nullable=False, server_default=""),
-        sa.Column("is_registered", sa.Boolean(), nullable=False, server_default=sa.text("0")),
-        sa.Column("is_baseline", sa.Boolean(), nullable=False, server_default=sa.text("0")),
+        sa.Column("is_registered", sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column("is_baseline", sa.Boolean(), nullable=False, server_default=sa.false()),
         sa.Column("created_at", sa.DateTime(), nullable=False),
         sa.UniqueConstraint("tg_id", name="uq_users_tg_id"),
     )
@@ -45,7 +49,7 @@ def upgrade() -> None:
         sa.Column("name", sa.String(length=128), nullable=False),
         sa.Column("num_questions", sa.Integer(), nullable=False),
         sa.Column("pdf_path", sa.String(length=512), nullable=False, server_default=""),
-        sa.Column("is_rasch", sa.Boolean(), nullable=False, server_default=sa.text("0")),
+        sa.Column("is_rasch", sa.Boolean(), nullable=False, server_default=sa.false()),
         sa.Column("created_at", sa.DateTime(), nullable=False),
         sa.UniqueConstraint("category", "name", name="uq_tests_category_name"),
     )
@@ -70,7 +74,7 @@ def upgrade() -> None:
         sa.Column("raw_correct", sa.Integer(), nullable=False, server_default=sa.text("0")),
         sa.Column("total", sa.Integer(), nullable=False, server_default=sa.text("0")),
         sa.Column("score", sa.Float(), nullable=False, server_default=sa.text("0")),
-        sa.Column("is_rasch", sa.Boolean(), nullable=False, server_default=sa.text("0")),
+        sa.Column("is_rasch", sa.Boolean(), nullable=False, server_default=sa.false()),
         sa.Column("created_at", sa.DateTime(), nullable=False),
     )
     op.create_index("ix_submissions_user_id", "submissions", ["user_id"])
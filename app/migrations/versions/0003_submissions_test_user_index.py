@@ -0,0 +1,29 @@
+"""Composite (test_id, user_id) index on submissions for baseline progress queries.
+
+Revision ID: 0003_submissions_test_user_index
+Revises: 0002_expand_correct_answer_text
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0003_submissions_test_user_index"
+down_revision = "0002_expand_correct_answer_text"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    insp = sa.inspect(op.get_bind())
+    if "ix_submissions_test_user" in {ix["name"] for ix in insp.get_indexes("submissions")}:
+        return
+    op.create_index("ix_submissions_test_user", "submissions", ["test_id", "user_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_submissions_test_user", table_name="submissions")
@@ -0,0 +1,47 @@
+"""Certificates: status column for the async render pipeline.
+
+Revision ID: 0004_certificate_status
+Revises: 0003_submissions_test_user_index
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0004_certificate_status"
+down_revision = "0003_submissions_test_user_index"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # certificates jadvali avval faqat create_all orqali yaratilgan bo'lishi mumkin
+    insp = sa.inspect(op.get_bind())
+    if not insp.has_table("certificates"):
+        op.create_table(
+            "certificates",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("test_id", sa.Integer(), sa.ForeignKey("tests.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("pdf_path", sa.String(length=512), nullable=False, server_default=""),
+            sa.Column("score_text", sa.String(length=64), nullable=False, server_default=""),
+            sa.Column("status", sa.String(length=16), nullable=False, server_default="ready"),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_certificates_user_id", "certificates", ["user_id"])
+        op.create_index("ix_certificates_test_id", "certificates", ["test_id"])
+        return
+
+    cols = {c["name"] for c in insp.get_columns("certificates")}
+    if "status" not in cols:
+        with op.batch_alter_table("certificates") as batch:
+            batch.add_column(sa.Column("status", sa.String(length=16), nullable=False, server_default="ready"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("certificates") as batch:
+        batch.drop_column("status")
@@ -0,0 +1,34 @@
+"""Certificates: content_hash for content-addressed dedupe.
+
+Revision ID: 0005_certificate_content_hash
+Revises: 0004_certificate_status
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0005_certificate_content_hash"
+down_revision = "0004_certificate_status"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # create_all bilan yaratilgan DB'da ustun/indeks allaqachon bo'lishi mumkin
+    insp = sa.inspect(op.get_bind())
+    if "content_hash" not in {c["name"] for c in insp.get_columns("certificates")}:
+        with op.batch_alter_table("certificates") as batch:
+            batch.add_column(sa.Column("content_hash", sa.String(length=64), nullable=False, server_default=""))
+    if "ix_certificates_content_hash" not in {ix["name"] for ix in insp.get_indexes("certificates")}:
+        op.create_index("ix_certificates_content_hash", "certificates", ["content_hash"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_certificates_content_hash", table_name="certificates")
+    with op.batch_alter_table("certificates") as batch:
+        batch.drop_column("content_hash")
@@ -0,0 +1,35 @@
+"""Users: updated_at (CEO report watermark).
+
+Revision ID: 0006_users_updated_at
+Revises: 0005_certificate_content_hash
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0006_users_updated_at"
+down_revision = "0005_certificate_content_hash"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # create_all bilan yaratilgan DB'da ustun/indeks allaqachon bo'lishi mumkin
+    insp = sa.inspect(op.get_bind())
+    if "updated_at" not in {c["name"] for c in insp.get_columns("users")}:
+        with op.batch_alter_table("users") as batch:
+            batch.add_column(sa.Column("updated_at", sa.DateTime(), nullable=True))
+    op.execute("UPDATE users SET updated_at = created_at WHERE updated_at IS NULL")
+    if "ix_users_updated_at" not in {ix["name"] for ix in insp.get_indexes("users")}:
+        op.create_index("ix_users_updated_at", "users", ["updated_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_updated_at", table_name="users")
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("updated_at")
@@ -0,0 +1,54 @@
+"""Analytics rollups: daily_stats, test_stats, test_score_buckets.
+
+Revision ID: 0007_analytics_rollups
+Revises: 0006_users_updated_at
+Create Date: 2026-10-19
+
+Empty after upgrade: run the backfill (/stats_backfill) once.
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0007_analytics_rollups"
+down_revision = "0006_users_updated_at"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # create_all bilan yaratilgan DB'da jadvallar allaqachon bo'lishi mumkin
+    insp = sa.inspect(op.get_bind())
+    if not insp.has_table("daily_stats"):
+        op.create_table(
+            "daily_stats",
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("signups", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("submissions", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("score_sum", sa.Float(), nullable=False, server_default="0"),
+        )
+    if not insp.has_table("test_stats"):
+        op.create_table(
+            "test_stats",
+            sa.Column("test_id", sa.Integer(), sa.ForeignKey("tests.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("submissions", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("score_sum", sa.Float(), nullable=False, server_default="0"),
+            sa.Column("last_submission_at", sa.DateTime(), nullable=True),
+        )
+    if not insp.has_table("test_score_buckets"):
+        op.create_table(
+            "test_score_buckets",
+            sa.Column("test_id", sa.Integer(), sa.ForeignKey("tests.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("bucket", sa.String(length=16), primary_key=True),
+            sa.Column("count", sa.Integer(), nullable=False, server_default="0"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("test_score_buckets")
+    op.drop_table("test_stats")
+    op.drop_table("daily_stats")
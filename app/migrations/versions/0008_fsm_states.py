@@ -0,0 +1,37 @@
+"""Shared FSM storage table (fsm_states).
+
+Revision ID: 0008_fsm_states
+Revises: 0007_analytics_rollups
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0008_fsm_states"
+down_revision = "0007_analytics_rollups"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # create_all bilan yaratilgan DB'da jadval allaqachon bo'lishi mumkin
+    if sa.inspect(op.get_bind()).has_table("fsm_states"):
+        return
+    op.create_table(
+        "fsm_states",
+        sa.Column("key", sa.String(length=255), primary_key=True),
+        sa.Column("state", sa.String(length=255), nullable=True),
+        sa.Column("data", sa.Text(), nullable=False, server_default="{}"),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_fsm_states_updated_at", "fsm_states", ["updated_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_fsm_states_updated_at", table_name="fsm_states")
+    op.drop_table("fsm_states")
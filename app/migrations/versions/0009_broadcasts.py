@@ -0,0 +1,54 @@
+"""Broadcasts table and users.blocked_at.
+
+Revision ID: 0009_broadcasts
+Revises: 0008_fsm_states
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0009_broadcasts"
+down_revision = "0008_fsm_states"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # create_all bilan yaratilgan DB'da ustun/jadval allaqachon bo'lishi mumkin
+    insp = sa.inspect(op.get_bind())
+    if "blocked_at" not in {c["name"] for c in insp.get_columns("users")}:
+        with op.batch_alter_table("users") as batch:
+            batch.add_column(sa.Column("blocked_at", sa.DateTime(), nullable=True))
+
+    if insp.has_table("broadcasts"):
+        return
+    op.create_table(
+        "broadcasts",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("text", sa.Text(), nullable=False),
+        sa.Column("test_id", sa.Integer(), sa.ForeignKey("tests.id", ondelete="SET NULL"), nullable=True),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("created_by", sa.Integer(), nullable=False),
+        sa.Column("last_user_id", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("total", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("sent", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("failed", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("blocked", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("lease_until", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=True),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_broadcasts_status", "broadcasts", ["status"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_broadcasts_status", table_name="broadcasts")
+    op.drop_table("broadcasts")
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("blocked_at")
@@ -0,0 +1,31 @@
+"""FSM states: version column (compare-and-set for update_data across replicas).
+
+Revision ID: 0010_fsm_states_version
+Revises: 0009_broadcasts
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0010_fsm_states_version"
+down_revision = "0009_broadcasts"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # create_all bilan yaratilgan DB'da ustun allaqachon bo'lishi mumkin
+    if "version" in {c["name"] for c in sa.inspect(op.get_bind()).get_columns("fsm_states")}:
+        return
+    with op.batch_alter_table("fsm_states") as batch:
+        batch.add_column(sa.Column("version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("fsm_states") as batch:
+        batch.drop_column("version")
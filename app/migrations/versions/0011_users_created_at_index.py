@@ -0,0 +1,29 @@
+"""Users: created_at index (signup rollup watermark).
+
+Revision ID: 0011_users_created_at_index
+Revises: 0010_fsm_states_version
+Create Date: 2026-10-19
+"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0011_users_created_at_index"
+down_revision = "0010_fsm_states_version"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # create_all bilan yaratilgan DB'da indeks allaqachon bo'lishi mumkin
+    if "ix_users_created_at" in {ix["name"] for ix in sa.inspect(op.get_bind()).get_indexes("users")}:
+        return
+    op.create_index("ix_users_created_at", "users", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_created_at", table_name="users")
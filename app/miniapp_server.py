@@ -4,18 +4,23 @@ import json
 import os
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import SessionLocal
 from app.keyboards import CATEGORIES
 from app.settings import settings
 from app.services.telegram_webapp import extract_init_data, verify_init_data
 from app.services.repo import (
-    list_tests_by_category,
+    baseline_ready_tests,
+    list_tests_page,
     get_test,
+    get_test_info,
     get_correct_answers,
     save_submission,
     list_answer_matrices_for_test,
@@ -27,7 +32,7 @@ from app.services.repo import (
     delete_submissions_for_user_test,
     list_baseline_done_indices,
 )
-from app.services.scoring import simple_check, rasch_percentile_score, sat_scaled_from_percentile
+from app.services.scoring import simple_check, rasch_percentile_score, sat_scaled_from_percentile, milliy_level
 from app.services.answers import normalize_to_spec, encode_for_storage
 from app.services.certificates import (
     CertificateData,
@@ -37,6 +42,14 @@ from app.services.certificates import (
 )
 from app.services.certificates_store import create_certificate_record
 from app.services.certificates_store import get_certificate_path_for_user
+from app.services.certificates_store import get_certificate_status_for_user
+from app.services.certificate_jobs import pipeline as certificate_pipeline
+from app.services.certificate_export import write_test_certificates_zip
+from app.services import analytics
+from app.services.broadcast import broadcasts
+from app.services.update_scheduler import scheduler as update_scheduler
+from app.services.db_session import DB_KEY, db_session_middleware, standalone_session
+from app.services.shutdown import drain_middleware
 
 DATA_DIR = Path("data")
 CERT_DIR = DATA_DIR / "certificates"
@@ -50,26 +63,29 @@ def _normalize_chat_ref(ref: str) -> str:
     return r
 
 
-async def _get_required_channel() -> str:
+async def _get_setting(session: Optional[AsyncSession], key: str, default: str) -> str:
     from app.services.repo import get_setting
-    async with SessionLocal() as session:
-        return (await get_setting(session, "required_channel", settings.required_channel)).strip()
+    if session is not None:
+        return (await get_setting(session, key, default)).strip()
+    async with standalone_session() as s:
+        return (await get_setting(s, key, default)).strip()
 
 
-async def _get_required_group() -> str:
-    from app.services.repo import get_setting
-    async with SessionLocal() as session:
-        return (await get_setting(session, "required_group", settings.required_group)).strip()
+async def _get_required_channel(session: Optional[AsyncSession] = None) -> str:
+    return await _get_setting(session, "required_channel", settings.required_channel)
 
 
-async def _get_required_urls() -> tuple[str, str]:
-    from app.services.repo import get_setting
-    async with SessionLocal() as session:
-        ch_url = (await get_setting(session, "required_channel_url", settings.required_channel_url)).strip()
-        gr_url = (await get_setting(session, "required_group_url", settings.required_group_url)).strip()
+async def _get_required_group(session: Optional[AsyncSession] = None) -> str:
+    return await _get_setting(session, "required_group", settings.required_group)
+
+
+async def _get_required_urls(session: Optional[AsyncSession] = None) -> tuple[str, str]:
+    """``session``: odatda ``request[DB_KEY]`` (bitta request -> bitta connection)."""
+    ch_url = await _get_setting(session, "required_channel_url", settings.required_channel_url)
+    gr_url = await _get_setting(session, "required_group_url", settings.required_group_url)
 
-    ch = _normalize_chat_ref(await _get_required_channel())
-    gr = _normalize_chat_ref(await _get_required_group())
+    ch = _normalize_chat_ref(await _get_required_channel(session))
+    gr = _normalize_chat_ref(await _get_required_group(session))
     if not ch_url and ch.startswith("@"):
         ch_url = f"https://t.me/{ch[1:]}"
     if not gr_url and gr.startswith("@"):
@@ -99,27 +115,18 @@ async def _tg_is_member(tg_id: int, chat_ref: str) -> bool:
         return False
 
 
-async def _check_membership(tg_id: int) -> bool:
-    ch = _normalize_chat_ref(await _get_required_channel())
-    gr = _normalize_chat_ref(await _get_required_group())
+async def _check_membership(tg_id: int, session: Optional[AsyncSession] = None) -> bool:
+    ch = _normalize_chat_ref(await _get_required_channel(session))
+    gr = _normalize_chat_ref(await _get_required_group(session))
     return (await _tg_is_member(tg_id, ch)) and (await _tg_is_member(tg_id, gr))
 
 
 def _milliy_level(percent: float) -> str:
-    p = percent
-    if 50 <= p <= 59.999:
-        return "C"
-    if 60 <= p <= 69.999:
-        return "C+"
-    if 70 <= p <= 79.999:
-        return "B"
-    if 80 <= p <= 89.999:
-        return "B+"
-    if 90 <= p <= 94.999:
-        return "A"
-    if 95 <= p <= 100:
-        return "A+"
-    return "-"
+    return milliy_level(percent)
+
+
+def _is_staff(tg_id: int) -> bool:
+    return tg_id in set(settings.admin_tg_ids or []) | set(settings.ceo_tg_ids or [])
 
 
 async def _json(request: web.Request) -> Dict[str, Any]:
@@ -150,12 +157,192 @@ async def health(request: web.Request) -> web.Response:
     return web.json_response({"ok": True})
 
 
+async def handle_tests(request: web.Request) -> web.Response:
+    """Keyset-paginated tests of a category: ``category``, ``cursor``, ``limit``, ``for_check=1``.
+
+    Response carries ``next_cursor``/``prev_cursor`` (null at the ends) for the following requests.
+    """
+    try:
+        user = _user_from_request(request, {})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    category = (request.query.get("category") or "").strip()
+    if category not in {k for k, _ in CATEGORIES}:
+        return web.json_response({"error": "Kategoriya topilmadi"}, status=404)
+    try:
+        limit = min(100, max(1, int(request.query.get("limit") or settings.miniapp_tests_page_size)))
+    except ValueError:
+        return web.json_response({"error": "bad params"}, status=400)
+
+    tg_id = int(user.get("id") or 0)
+    session = request[DB_KEY]
+    if not _is_staff(tg_id) and not await _check_membership(tg_id, session):
+        ch_url, gr_url = await _get_required_urls(session)
+        return web.json_response(
+            {
+                "join_required": True,
+                "message": "Avval kanal va guruhga qo'shiling.",
+                "channel_url": ch_url,
+                "group_url": gr_url,
+            },
+            status=403,
+        )
+
+    page = await list_tests_page(session, category, request.query.get("cursor"), limit)
+    for_check = request.query.get("for_check") == "1"
+    infos = [await get_test_info(session, tid) for tid, _ in page.rows]
+    ready_ids = await baseline_ready_tests(session, [t.id for t in infos if t.is_rasch])
+    tests = []
+    for t in infos:
+        ready = not t.is_rasch or t.id in ready_ids
+        # for_check: tayyor bo'lmagan Rasch testlari yashiriladi (sahifa qisqaroq bo'lishi mumkin)
+        if for_check and not ready:
+            continue
+        tests.append(
+            {
+                "id": t.id,
+                "name": t.name,
+                "num_questions": t.num_questions,
+                "is_rasch": t.is_rasch,
+                "baseline_ready": ready,
+            }
+        )
+    return web.json_response(
+        {
+            "category": category,
+            "tests": tests,
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor,
+        }
+    )
+
+
+async def handle_certificate_status(request: web.Request) -> web.Response:
+    """Certificate readiness: poll, or long-poll with ``wait`` seconds (max 25)."""
+    try:
+        user = _user_from_request(request, {})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    try:
+        cert_id = int(request.query.get("certificate_id") or 0)
+        wait = min(25.0, max(0.0, float(request.query.get("wait") or 0)))
+    except ValueError:
+        return web.json_response({"error": "bad params"}, status=400)
+
+    tg_id = int(user.get("id") or 0)
+    status = await get_certificate_status_for_user(cert_id=cert_id, tg_id=tg_id)
+    if status is None:
+        return web.json_response({"error": "Sertifikat topilmadi"}, status=404)
+    if status == "pending" and wait > 0:
+        status = await certificate_pipeline.wait(cert_id, wait) or status
+    return web.json_response({"certificate_id": cert_id, "status": status})
+
+
+async def handle_admin_certificate_pipeline(request: web.Request) -> web.Response:
+    try:
+        user = _user_from_request(request, {})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    if not _is_staff(int(user.get("id") or 0)):
+        return web.json_response({"error": "forbidden"}, status=403)
+    return web.json_response({"running": certificate_pipeline.running, **certificate_pipeline.stats.as_dict()})
+
+
+async def handle_admin_update_scheduler(request: web.Request) -> web.Response:
+    try:
+        user = _user_from_request(request, {})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    if not _is_staff(int(user.get("id") or 0)):
+        return web.json_response({"error": "forbidden"}, status=403)
+    return web.json_response(
+        {"running": update_scheduler.running, "workers": update_scheduler.workers, **update_scheduler.stats.as_dict()}
+    )
+
+
+async def handle_admin_broadcasts(request: web.Request) -> web.Response:
+    """Latest broadcasts: counters, plus rate/ETA for the ones running in this process."""
+    try:
+        user = _user_from_request(request, {})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    if not _is_staff(int(user.get("id") or 0)):
+        return web.json_response({"error": "forbidden"}, status=403)
+    return web.json_response({"broadcasts": await broadcasts.status(limit=10)})
+
+
+async def handle_admin_stats(request: web.Request) -> web.Response:
+    """Dashboard numbers from the rollup tables (optionally one test: ``test_id``)."""
+    try:
+        user = _user_from_request(request, {})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    if not _is_staff(int(user.get("id") or 0)):
+        return web.json_response({"error": "forbidden"}, status=403)
+    try:
+        days = int(request.query.get("days") or 30)
+        test_id = int(request.query.get("test_id") or 0)
+    except ValueError:
+        return web.json_response({"error": "bad params"}, status=400)
+    session = request[DB_KEY]
+    if test_id:
+        try:
+            return web.json_response(await analytics.test_distribution(session, test_id))
+        except NoResultFound:
+            return web.json_response({"error": "Test topilmadi"}, status=404)
+    return web.json_response(await analytics.dashboard(session, days=days))
+
+
+async def handle_admin_certificates_zip(request: web.Request) -> web.StreamResponse:
+    """Streams a ZIP of all certificates of a test (missing ones are rendered on the fly)."""
+    try:
+        user = _user_from_request(request, {})
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=401)
+    if not _is_staff(int(user.get("id") or 0)):
+        return web.json_response({"error": "forbidden"}, status=403)
+    try:
+        test_id = int(request.query.get("test_id") or 0)
+        # stream uzoq davom etadi: request session'i o'rniga qisqa session (connection darhol qaytadi)
+        async with standalone_session() as session:
+            await get_test_info(session, test_id)
+    except (ValueError, NoResultFound):
+        return web.json_response({"error": "Test topilmadi"}, status=404)
+
+    resp = web.StreamResponse(
+        headers={
+            "Content-Type": "application/zip",
+            "Content-Disposition": f'attachment; filename="certificates_test_{test_id}.zip"',
+        }
+    )
+    resp.enable_chunked_encoding()
+    await resp.prepare(request)
+    await write_test_certificates_zip(test_id, resp.write)
+    await resp.write_eof()
+    return resp
+
+
 # ---- sizning qolgan handlerlaringiz (handle_categories, handle_tests, ...) O'ZGARMAGAN ----
 # (bu yerda siz bergan kodning qolgan qismi o'sha-o'sha qoladi)
 
 
-async def create_app() -> web.Application:
-    app = web.Application()
+def _mount_webhook(app: web.Application, bot: Bot, dp: Dispatcher) -> None:
+    """Bot updates on the same aiohttp app (BOT_MODE=webhook).
+
+    setup_application goes first so dp.shutdown (deleteWebhook) still runs before
+    the request handler closes the bot session.
+    """
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.effective_webhook_secret,
+    ).register(app, path=settings.webhook_path)
+
+
+async def create_app(bot: Optional[Bot] = None, dp: Optional[Dispatcher] = None) -> web.Application:
+    # drain: shutdown paytida yangi so'rovlar 503; har request uchun bitta lazy session: request[DB_KEY]
+    app = web.Application(middlewares=[drain_middleware, db_session_middleware])
 
     # health doim birinchi bo'lsin
     app.router.add_get("/health", health)
@@ -172,17 +359,28 @@ async def create_app() -> web.Application:
     app.router.add_get("/api/admin/baseline_status", handle_admin_baseline_status)
     app.router.add_post("/api/submit", handle_submit)
     app.router.add_post("/api/send_certificate", handle_send_certificate)
+    app.router.add_get("/api/certificate_status", handle_certificate_status)
+    app.router.add_get("/api/admin/certificate_pipeline", handle_admin_certificate_pipeline)
+    app.router.add_get("/api/admin/certificates_zip", handle_admin_certificates_zip)
+    app.router.add_get("/api/admin/stats", handle_admin_stats)
+    app.router.add_get("/api/admin/update_scheduler", handle_admin_update_scheduler)
+    app.router.add_get("/api/admin/broadcasts", handle_admin_broadcasts)
 
     static_dir = MINIAPP_DIR / "static"
     if static_dir.exists():
         app.router.add_static("/static", static_dir)
 
+    if bot is not None and dp is not None:
+        _mount_webhook(app, bot, dp)
+
     return app
 
 
-async def start_miniapp() -> web.AppRunner:
-    app = await create_app()
-    runner = web.AppRunner(app)
+async def start_miniapp(bot: Optional[Bot] = None, dp: Optional[Dispatcher] = None) -> web.AppRunner:
+    """bot+dp berilsa Telegram update'lari ham shu serverda (webhook) qabul qilinadi."""
+    app = await create_app(bot, dp)
+    # in-flight so'rovlar graceful_shutdown'da kutiladi; cleanup faqat qolganlariga qisqa muhlat beradi
+    runner = web.AppRunner(app, shutdown_timeout=5.0)
     await runner.setup()
 
     # Render: PORT ni settings already oladi, ammo fallback ham qoldiramiz
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from datetime import datetime
-from sqlalchemy import Boolean, DateTime, Float, ForeignKey, Integer, String, Text, UniqueConstraint
+from datetime import date, datetime
+from sqlalchemy import Boolean, Date, DateTime, Float, ForeignKey, Index, Integer, String, Text, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -25,7 +25,11 @@ class User(Base):
     phone: Mapped[str] = mapped_column(String(64), default="")
     is_registered: Mapped[bool] = mapped_column(Boolean, default=False)
     is_baseline: Mapped[bool] = mapped_column(Boolean, default=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    # CEO report watermark uchun; bulk upsert'lar buni o'zi qo'yadi (onupdate u yerda ishlamaydi)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # broadcast paytida 403 yoki my_chat_member=kicked (botni bloklagan); unblock/start/Mini App tozalaydi
+    blocked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     submissions: Mapped[list["Submission"]] = relationship(back_populates="user")
     certificates: Mapped[list["Certificate"]] = relationship(back_populates="user")
@@ -79,6 +83,9 @@ class Submission(Base):
     user: Mapped["User"] = relationship(back_populates="submissions")
     test: Mapped["Test"] = relationship(back_populates="submissions")
 
+    # baseline progress / per-test aggregatlar uchun (test_id, user_id) bo'yicha index-only scan
+    __table_args__ = (Index("ix_submissions_test_user", "test_id", "user_id"),)
+
 
 class Certificate(Base):
     __tablename__ = "certificates"
@@ -87,7 +94,74 @@ class Certificate(Base):
     test_id: Mapped[int] = mapped_column(ForeignKey("tests.id", ondelete="CASCADE"), index=True)
     pdf_path: Mapped[str] = mapped_column(String(512), default="")
     score_text: Mapped[str] = mapped_column(String(64), default="")
+    status: Mapped[str] = mapped_column(String(16), default="ready", server_default="ready")  # pending | ready | failed
+    # sha256 of the rendered inputs (style + user + test + matn); bir xil so'rov -> bir xil artefakt
+    content_hash: Mapped[str] = mapped_column(String(64), default="", server_default="", index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     user: Mapped["User"] = relationship(back_populates="certificates")
     test: Mapped["Test"] = relationship(back_populates="certificates")
+
+
+# ---------------- analytics rollups ----------------
+# Submissions are counted as they are saved (baseline users excluded), signups are rolled
+# up lazily from a users.id watermark; see app/services/analytics.py.
+
+
+class DailyStat(Base):
+    __tablename__ = "daily_stats"
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    signups: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    submissions: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    score_sum: Mapped[float] = mapped_column(Float, default=0.0, server_default="0")
+
+
+class TestStat(Base):
+    __tablename__ = "test_stats"
+    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id", ondelete="CASCADE"), primary_key=True)
+    submissions: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    score_sum: Mapped[float] = mapped_column(Float, default=0.0, server_default="0")
+    last_submission_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class TestScoreBucket(Base):
+    __tablename__ = "test_score_buckets"
+    test_id: Mapped[int] = mapped_column(ForeignKey("tests.id", ondelete="CASCADE"), primary_key=True)
+    bucket: Mapped[str] = mapped_column(String(16), primary_key=True)  # milliy: daraja, boshqalar: "90-100"
+    count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+
+# ---------------- FSM storage ----------------
+
+class FsmState(Base):
+    """aiogram FSM state/data (app/services/fsm_storage.py); bir nechta bot process bitta jadvalni ulashadi."""
+
+    __tablename__ = "fsm_states"
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)  # bot:chat:user:thread:business:destiny
+    state: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    data: Mapped[str] = mapped_column(Text(), default="{}", server_default="{}")
+    version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")  # update_data compare-and-set
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)  # TTL
+
+
+# ---------------- broadcasts ----------------
+
+class Broadcast(Base):
+    """Announcement to all users (app/services/broadcast.py); progress is a users.id keyset cursor."""
+
+    __tablename__ = "broadcasts"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    text: Mapped[str] = mapped_column(Text())
+    test_id: Mapped[int | None] = mapped_column(ForeignKey("tests.id", ondelete="SET NULL"), nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default="pending", index=True)  # pending|running|done|cancelled
+    created_by: Mapped[int] = mapped_column(Integer, default=0)  # tg_id
+    last_user_id: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    total: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    sent: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    failed: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    blocked: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    # ishlayotgan process shu vaqtgacha egalik qiladi; o'tib ketsa boshqa process davom ettiradi
+    lease_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import DailyStat, Setting, Submission, Test, TestScoreBucket, TestStat, User
+from app.services.repo import upsert_insert, get_setting, get_test_info, set_setting
+from app.services.scoring import milliy_level
+
+# users.created_at shu vaqtgacha (ISO, UTC) bo'lgan signuplar daily_stats'ga qo'shilgan
+SIGNUPS_WATERMARK_KEY = "analytics:users_created_until"
+# users.id ham, created_at ham commit tartibida emas: user faqat shuncha eski bo'lgach sanaladi,
+# shunda hali commit qilinmagan (ko'rinmaydigan) qatorlar watermark ortida qolib ketmaydi
+SIGNUPS_LAG = timedelta(minutes=2)
+
+BACKFILL_CHUNK = 5000
+
+# refresh/backfill bir vaqtda yurmasin (bir process ichida; replikalar orasida — watermark CAS)
+_lock = asyncio.Lock()
+
+
+def score_bucket(category: str, score: float) -> str:
+    """Milliy: sertifikat darajasi; boshqalar: 10 ballik oraliq ("90-100")."""
+    if category == "milliy":
+        return milliy_level(score)
+    lo = min(90, max(0, int(score // 10) * 10))
+    return f"{lo}-{lo + 10}"
+
+
+def _as_date(v: Any) -> date:
+    # SQLite date() -> "YYYY-MM-DD", Postgres -> date
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    return date.fromisoformat(str(v))
+
+
+# ---------------- incremental maintenance ----------------
+
+async def record_submission(session: AsyncSession, *, test_id: int, score: float, at: datetime) -> None:
+    """Adds one submission to the rollups (no commit: rides on the caller's transaction)."""
+    test = await get_test_info(session, test_id)
+
+    stmt = upsert_insert(session, DailyStat).values(day=at.date(), signups=0, submissions=1, score_sum=score)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[DailyStat.day],
+            set_={
+                "submissions": DailyStat.submissions + 1,
+                "score_sum": DailyStat.score_sum + stmt.excluded.score_sum,
+            },
+        )
+    )
+    stmt = upsert_insert(session, TestStat).values(test_id=test_id, submissions=1, score_sum=score, last_submission_at=at)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[TestStat.test_id],
+            set_={
+                "submissions": TestStat.submissions + 1,
+                "score_sum": TestStat.score_sum + stmt.excluded.score_sum,
+                "last_submission_at": stmt.excluded.last_submission_at,
+            },
+        )
+    )
+    stmt = upsert_insert(session, TestScoreBucket).values(test_id=test_id, bucket=score_bucket(test.category, score), count=1)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[TestScoreBucket.test_id, TestScoreBucket.bucket],
+            set_={"count": TestScoreBucket.count + 1},
+        )
+    )
+
+
+async def refresh_signups(session: AsyncSession) -> int:
+    """Rolls users created since the watermark into daily_stats.signups; returns number added.
+
+    The watermark is claimed with a conditional UPDATE (``WHERE value = :last``) in the same
+    transaction as the upserts, so with several replicas only one of them adds a given range.
+    Only users in (last, now - SIGNUPS_LAG] are read (created_at index).
+    """
+    async with _lock:
+        await session.execute(
+            upsert_insert(session, Setting)
+            .values(key=SIGNUPS_WATERMARK_KEY, value="")
+            .on_conflict_do_nothing(index_elements=[Setting.key])
+        )
+        last = await get_setting(session, SIGNUPS_WATERMARK_KEY, "")
+        upto = datetime.utcnow() - SIGNUPS_LAG
+        if last and datetime.fromisoformat(last) >= upto:
+            await session.commit()
+            return 0
+        claimed = await session.execute(
+            update(Setting)
+            .where(Setting.key == SIGNUPS_WATERMARK_KEY, Setting.value == last)
+            .values(value=upto.isoformat())
+        )
+        if claimed.rowcount != 1:
+            # boshqa replika shu oraliqni allaqachon oldi
+            await session.rollback()
+            return 0
+        day = func.date(User.created_at)
+        stmt = select(day, func.count(User.id)).where(User.created_at <= upto, User.is_baseline == False)  # noqa: E712
+        if last:
+            stmt = stmt.where(User.created_at > datetime.fromisoformat(last))
+        rows = (await session.execute(stmt.group_by(day))).all()
+        added = 0
+        for d, n in rows:
+            stmt = upsert_insert(session, DailyStat).values(day=_as_date(d), signups=int(n), submissions=0, score_sum=0.0)
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[DailyStat.day],
+                    set_={"signups": DailyStat.signups + stmt.excluded.signups},
+                )
+            )
+            added += int(n)
+        await session.commit()
+        return added
+
+
+async def _aggregate_submissions(
+    session: AsyncSession, *, test_id: Optional[int] = None
+) -> Tuple[Dict[date, List[float]], Dict[int, List[Any]], Dict[Tuple[int, str], int]]:
+    """Streams real (non-baseline) submissions once: per-day, per-test and per-bucket aggregates."""
+    # server-side cursor ochiq turganda shu session'da boshqa so'rov yubormaslik uchun oldindan
+    categories: Dict[int, str] = {int(i): c for i, c in (await session.execute(select(Test.id, Test.category))).all()}
+    stmt = (
+        select(Submission.test_id, Submission.score, Submission.created_at)
+        .join(User, User.id == Submission.user_id)
+        .where(User.is_baseline == False)  # noqa: E712
+    )
+    if test_id is not None:
+        stmt = stmt.where(Submission.test_id == test_id)
+    days: Dict[date, List[float]] = defaultdict(lambda: [0, 0.0])
+    tests: Dict[int, List[Any]] = defaultdict(lambda: [0, 0.0, None])
+    buckets: Dict[Tuple[int, str], int] = defaultdict(int)
+    result = await session.stream(stmt.execution_options(yield_per=BACKFILL_CHUNK))
+    async for part in result.partitions():
+        for tid, score, at in part:
+            tid = int(tid)
+            if tid not in categories or at is None:
+                continue
+            score = float(score or 0.0)
+            d = days[at.date()]
+            d[0] += 1
+            d[1] += score
+            t = tests[tid]
+            t[0] += 1
+            t[1] += score
+            t[2] = at if t[2] is None or at > t[2] else t[2]
+            buckets[(tid, score_bucket(categories[tid], score))] += 1
+    return days, tests, buckets
+
+
+async def _write_test_rollups(
+    session: AsyncSession, tests: Dict[int, List[Any]], buckets: Dict[Tuple[int, str], int]
+) -> None:
+    if tests:
+        await session.execute(
+            insert(TestStat),
+            [{"test_id": k, "submissions": v[0], "score_sum": v[1], "last_submission_at": v[2]} for k, v in tests.items()],
+        )
+    if buckets:
+        await session.execute(
+            insert(TestScoreBucket),
+            [{"test_id": k[0], "bucket": k[1], "count": v} for k, v in buckets.items()],
+        )
+
+
+async def rebuild_test(session: AsyncSession, test_id: int) -> None:
+    """Recomputes one test's rollups from its current submissions (after attempts are deleted).
+
+    daily_stats is an event log and is left as-is.
+    """
+    await session.execute(delete(TestStat).where(TestStat.test_id == test_id))
+    await session.execute(delete(TestScoreBucket).where(TestScoreBucket.test_id == test_id))
+    _, tests, buckets = await _aggregate_submissions(session, test_id=test_id)
+    await _write_test_rollups(session, tests, buckets)
+    await session.commit()
+
+
+async def backfill(session: AsyncSession) -> Dict[str, int]:
+    """Rebuilds all rollups from history (one streamed pass over submissions + one GROUP BY on users).
+
+    Run when the bot is quiet: submissions saved during the backfill may be counted twice or not at all.
+    """
+    async with _lock:
+        upto = datetime.utcnow() - SIGNUPS_LAG
+        day = func.date(User.created_at)
+        signups = {
+            _as_date(d): int(n)
+            for d, n in (
+                await session.execute(
+                    select(day, func.count(User.id))
+                    .where(User.created_at <= upto, User.is_baseline == False)  # noqa: E712
+                    .group_by(day)
+                )
+            ).all()
+        }
+        days, tests, buckets = await _aggregate_submissions(session)
+
+        await session.execute(delete(DailyStat))
+        await session.execute(delete(TestStat))
+        await session.execute(delete(TestScoreBucket))
+        all_days = set(signups) | set(days)
+        if all_days:
+            await session.execute(
+                insert(DailyStat),
+                [
+                    {
+                        "day": d,
+                        "signups": signups.get(d, 0),
+                        "submissions": int(days[d][0]) if d in days else 0,
+                        "score_sum": float(days[d][1]) if d in days else 0.0,
+                    }
+                    for d in sorted(all_days)
+                ],
+            )
+        await _write_test_rollups(session, tests, buckets)
+        await set_setting(session, SIGNUPS_WATERMARK_KEY, upto.isoformat())  # commits everything
+    return {
+        "days": len(all_days),
+        "tests": len(tests),
+        "submissions": sum(int(v[0]) for v in days.values()),
+        "signups": sum(signups.values()),
+    }
+
+
+# ---------------- reads (rollups only) ----------------
+
+async def dashboard(session: AsyncSession, *, days: int = 30, top_tests: int = 10) -> Dict[str, Any]:
+    """Totals, last ``days`` per-day series and the busiest tests — reads only rollup tables."""
+    await refresh_signups(session)
+    days = max(1, min(days, 366))
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+
+    total_signups, total_subs, total_sum = (
+        await session.execute(
+            select(
+                func.coalesce(func.sum(DailyStat.signups), 0),
+                func.coalesce(func.sum(DailyStat.submissions), 0),
+                func.coalesce(func.sum(DailyStat.score_sum), 0.0),
+            )
+        )
+    ).one()
+    series = (
+        await session.execute(select(DailyStat).where(DailyStat.day >= since).order_by(DailyStat.day.asc()))
+    ).scalars().all()
+    tests = (
+        await session.execute(
+            select(TestStat.test_id, Test.name, Test.category, TestStat.submissions, TestStat.score_sum)
+            .join(Test, Test.id == TestStat.test_id)
+            .order_by(TestStat.submissions.desc())
+            .limit(top_tests)
+        )
+    ).all()
+    return {
+        "totals": {
+            "signups": int(total_signups),
+            "submissions": int(total_subs),
+            "avg_score": round(float(total_sum) / total_subs, 2) if total_subs else 0.0,
+        },
+        "days": [
+            {
+                "day": s.day.isoformat(),
+                "signups": s.signups,
+                "submissions": s.submissions,
+                "avg_score": round(s.score_sum / s.submissions, 2) if s.submissions else 0.0,
+            }
+            for s in series
+        ],
+        "tests": [
+            {
+                "test_id": r.test_id,
+                "name": r.name,
+                "category": r.category,
+                "submissions": r.submissions,
+                "avg_score": round(r.score_sum / r.submissions, 2) if r.submissions else 0.0,
+            }
+            for r in tests
+        ],
+    }
+
+
+async def test_distribution(session: AsyncSession, test_id: int) -> Dict[str, Any]:
+    """Submissions, average and score/level distribution of one test (rollups only)."""
+    test = await get_test_info(session, test_id)
+    stat = (await session.execute(select(TestStat).where(TestStat.test_id == test_id))).scalar_one_or_none()
+    buckets = (
+        await session.execute(
+            select(TestScoreBucket.bucket, TestScoreBucket.count).where(TestScoreBucket.test_id == test_id)
+        )
+    ).all()
+    n = stat.submissions if stat else 0
+    return {
+        "test_id": test.id,
+        "name": test.name,
+        "category": test.category,
+        "submissions": n,
+        "avg_score": round(stat.score_sum / n, 2) if n else 0.0,
+        "last_submission_at": stat.last_submission_at.isoformat() if stat and stat.last_submission_at else None,
+        "distribution": {b: int(c) for b, c in sorted(buckets, key=lambda x: x[0])},
+    }
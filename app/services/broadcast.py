@@ -0,0 +1,454 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InlineKeyboardMarkup
+from sqlalchemy import case, func, or_, select, update
+
+from app.keyboards import test_link_kb
+from app.models import Broadcast, User
+from app.services.db_session import standalone_session
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_CANCELLED = "cancelled"
+
+# egalik muddati: progress shu vaqt ichida saqlanmasa, broadcast boshqa process'ga o'tadi
+LEASE = timedelta(minutes=2)
+# lease'i tugagan broadcast'larni qidirish oralig'i (startup'dan keyin ham, har bir replica'da)
+SWEEP_INTERVAL = 30.0
+
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+
+ProgressFn = Callable[["BroadcastRun"], Awaitable[None]]
+
+
+# ---------------- rate limiter ----------------
+
+class RateLimiter:
+    """Global pacing: at most ``rate`` sends per second across all broadcast tasks.
+
+    ``pause`` holds back every sender (a 429 ``retry_after`` applies to the whole bot).
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / max(0.1, float(rate))
+        self._next = 0.0
+        self._paused_until = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            at = max(now, self._next, self._paused_until)
+            self._next = at + self.interval
+            if at > now:
+                await asyncio.sleep(at - now)
+            # uxlab turganda pause kelgan bo'lsa, slot qaytadan olinadi
+            if time.monotonic() >= self._paused_until:
+                return
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+
+
+# ---------------- progress ----------------
+
+@dataclass
+class BroadcastRun:
+    """Live progress of a broadcast running in this process (counters include earlier runs)."""
+
+    id: int
+    total: int
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    last_user_id: int = 0
+    status: str = STATUS_RUNNING
+    processed_this_run: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.processed_this_run / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_s(self) -> Optional[float]:
+        rate = self.rate
+        if self.status != STATUS_RUNNING or rate <= 0:
+            return None
+        return max(0, self.total - self.processed) / rate
+
+    def as_dict(self) -> Dict[str, Any]:
+        eta = self.eta_s
+        return {
+            "id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "rate": round(self.rate, 2),
+            "eta_s": None if eta is None else round(eta),
+        }
+
+
+def _recipients(after: int = 0):
+    """Real users who have not blocked the bot, in users.id order (keyset)."""
+    return (
+        select(User.id, User.tg_id)
+        .where(User.id > after, User.tg_id > 0, User.is_baseline == False, User.blocked_at.is_(None))  # noqa: E712
+        .order_by(User.id.asc())
+    )
+
+
+# ---------------- engine ----------------
+
+class BroadcastEngine:
+    """Sends a text (optionally with a test deep-link button) to every user.
+
+    Recipients are streamed from ``users`` in keyset batches; after each batch the cursor,
+    counters and blocked users are saved, so a restart resumes where it stopped (at most
+    one in-flight chunk is sent twice). A row-level lease keeps replicas from sending the
+    same broadcast concurrently.
+    """
+
+    def __init__(self, *, rate: float = 25.0, batch_size: int = 200, concurrency: int = 8) -> None:
+        self.limiter = RateLimiter(rate)
+        self.batch_size = max(1, int(batch_size))
+        self.concurrency = max(1, int(concurrency))
+        self.runs: Dict[int, BroadcastRun] = {}
+        self._tasks: Dict[int, "asyncio.Task[None]"] = {}
+        self._sweeper: Optional["asyncio.Task[None]"] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def create(self, *, text: str, created_by: int, test_id: Optional[int] = None) -> int:
+        async with standalone_session() as session:
+            total = await session.scalar(select(func.count()).select_from(_recipients().subquery()))
+            row = Broadcast(
+                text=text,
+                test_id=test_id,
+                created_by=created_by,
+                total=int(total or 0),
+                status=STATUS_PENDING,
+            )
+            session.add(row)
+            await session.commit()
+            return row.id
+
+    async def start(self, bot: Bot, broadcast_id: int, progress: Optional[ProgressFn] = None) -> bool:
+        """Claims the broadcast and runs it in the background; False if it is owned elsewhere or finished."""
+        if broadcast_id in self._tasks:
+            return True
+        claimed = await self._claim(broadcast_id)
+        if claimed is None:
+            return False
+        run, text, test_id = claimed
+        self.runs[broadcast_id] = run
+        task = asyncio.create_task(self._run(bot, run, text, test_id, progress))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+        return True
+
+    def start_sweeper(self, bot: Bot, interval: float = SWEEP_INTERVAL) -> None:
+        """Runs ``resume`` now and then every ``interval`` seconds until ``stop``.
+
+        A replica that boots while a dead owner's lease is still valid picks the
+        broadcast up on a later sweep, once the lease expires.
+        """
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(bot, interval))
+
+    async def _sweep_loop(self, bot: Bot, interval: float) -> None:
+        while True:
+            try:
+                await self.resume(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Broadcast sweep failed")
+            await asyncio.sleep(interval)
+
+    async def resume(self, bot: Bot) -> List[int]:
+        """Continues pending/running broadcasts with no live owner (lease empty or expired)."""
+        async with standalone_session() as session:
+            ids = (
+                await session.scalars(
+                    select(Broadcast.id)
+                    .where(
+                        Broadcast.status.in_((STATUS_PENDING, STATUS_RUNNING)),
+                        or_(Broadcast.lease_until.is_(None), Broadcast.lease_until < datetime.utcnow()),
+                    )
+                    .order_by(Broadcast.id.asc())
+                )
+            ).all()
+        resumed = [bid for bid in ids if await self.start(bot, bid)]
+        if resumed:
+            log.info("Broadcasts resumed: %s", resumed)
+        return resumed
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """Marks the broadcast cancelled; the owner (this or another process) stops after its chunk."""
+        async with standalone_session() as session:
+            res = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status.in_((STATUS_PENDING, STATUS_RUNNING)))
+                .values(status=STATUS_CANCELLED, finished_at=datetime.utcnow(), lease_until=None)
+            )
+            await session.commit()
+        run = self.runs.get(broadcast_id)
+        if run is not None and run.status == STATUS_RUNNING:
+            run.status = STATUS_CANCELLED
+        return bool(res.rowcount)
+
+    async def stop(self, *, timeout: float = 10.0) -> int:
+        """Shutdown: finish the current chunk, save progress, release leases.
+
+        Returns how many broadcasts were interrupted (another replica's sweep or the next
+        start resumes them).
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        if not self.running:
+            return 0
+        self._stopping = True
+        try:
+            tasks = list(self._tasks.values())
+            _, pending = await asyncio.wait(tasks, timeout=max(0.0, timeout))
+            for t in pending:
+                t.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            self._stopping = False
+        return sum(1 for r in self.runs.values() if r.status == STATUS_RUNNING)
+
+    async def status(self, limit: int = 5) -> List[Dict[str, Any]]:
+        """Latest broadcasts; live rate/ETA for the ones running in this process."""
+        async with standalone_session() as session:
+            rows = (await session.scalars(select(Broadcast).order_by(Broadcast.id.desc()).limit(limit))).all()
+        out: List[Dict[str, Any]] = []
+        for row in rows:
+            run = self.runs.get(row.id)
+            if run is not None and row.id in self._tasks:
+                out.append(run.as_dict())
+                continue
+            out.append(
+                {
+                    "id": row.id,
+                    "status": row.status,
+                    "total": row.total,
+                    "sent": row.sent,
+                    "failed": row.failed,
+                    "blocked": row.blocked,
+                    "rate": None,
+                    "eta_s": None,
+                }
+            )
+        return out
+
+    # ---- internals ----
+
+    async def _claim(self, broadcast_id: int) -> Optional[Tuple[BroadcastRun, str, Optional[int]]]:
+        now = datetime.utcnow()
+        async with standalone_session() as session:
+            res = await session.execute(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status.in_((STATUS_PENDING, STATUS_RUNNING)),
+                    or_(Broadcast.lease_until.is_(None), Broadcast.lease_until < now),
+                )
+                .values(
+                    status=STATUS_RUNNING,
+                    lease_until=now + LEASE,
+                    started_at=func.coalesce(Broadcast.started_at, now),
+                )
+            )
+            if res.rowcount != 1:
+                await session.rollback()
+                return None
+            row = (
+                await session.execute(
+                    select(
+                        Broadcast.text,
+                        Broadcast.test_id,
+                        Broadcast.total,
+                        Broadcast.sent,
+                        Broadcast.failed,
+                        Broadcast.blocked,
+                        Broadcast.last_user_id,
+                    ).where(Broadcast.id == broadcast_id)
+                )
+            ).one()
+            await session.commit()
+        run = BroadcastRun(
+            id=broadcast_id,
+            total=row.total,
+            sent=row.sent,
+            failed=row.failed,
+            blocked=row.blocked,
+            last_user_id=row.last_user_id,
+        )
+        return run, row.text, row.test_id
+
+    async def _markup(self, bot: Bot, test_id: Optional[int]) -> Optional[InlineKeyboardMarkup]:
+        if not test_id:
+            return None
+        username = settings.bot_username.lstrip("@") or (await bot.me()).username or ""
+        return test_link_kb(username, test_id) if username else None
+
+    async def _next_batch(self, after: int) -> List[Tuple[int, int]]:
+        async with standalone_session() as session:
+            res = await session.execute(_recipients(after).limit(self.batch_size))
+            return [(int(uid), int(tg_id)) for uid, tg_id in res.all()]
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, markup: Optional[InlineKeyboardMarkup]) -> str:
+        for attempt in range(4):
+            await self.limiter.acquire()
+            try:
+                await bot.send_message(chat_id, text, reply_markup=markup)
+                return SENT
+            except TelegramRetryAfter as e:
+                log.warning("Broadcast: flood limit, pausing %ss", e.retry_after)
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED  # botni bloklagan yoki akkaunt o'chirilgan
+            except TelegramBadRequest as e:
+                return BLOCKED if "chat not found" in str(e).lower() else FAILED
+            except (TelegramNetworkError, TelegramServerError):
+                await asyncio.sleep(1 + attempt)
+        return FAILED
+
+    async def _save(self, run: BroadcastRun, blocked_ids: List[int], *, final: bool = False) -> bool:
+        """Persists cursor/counters (and blocked users); False if the row was cancelled meanwhile.
+
+        Counters are written for cancelled rows too, so the report shows what was actually sent.
+        """
+        now = datetime.utcnow()
+        running = Broadcast.status == STATUS_RUNNING
+        values: Dict[str, Any] = {
+            "last_user_id": run.last_user_id,
+            "sent": run.sent,
+            "failed": run.failed,
+            "blocked": run.blocked,
+            "lease_until": None if final else case((running, now + LEASE), else_=None),
+        }
+        if run.status == STATUS_DONE:
+            values.update(
+                status=case((running, STATUS_DONE), else_=Broadcast.status),
+                finished_at=case((running, now), else_=Broadcast.finished_at),
+            )
+        async with standalone_session() as session:
+            if blocked_ids:
+                # updated_at o'zgarmaydi: bu CEO hisobot watermark'iga tegishli emas
+                await session.execute(
+                    update(User)
+                    .where(User.id.in_(blocked_ids))
+                    .values(blocked_at=now, updated_at=User.updated_at)
+                )
+            # cancel boshqa process'dan ham kelishi mumkin: UPDATE'gacha bo'lgan status tekshiriladi
+            before = await session.scalar(select(Broadcast.status).where(Broadcast.id == run.id))
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == run.id, Broadcast.status.in_((STATUS_RUNNING, STATUS_CANCELLED)))
+                .values(**values)
+            )
+            await session.commit()
+        return before == STATUS_RUNNING
+
+    async def _run(
+        self,
+        bot: Bot,
+        run: BroadcastRun,
+        text: str,
+        test_id: Optional[int],
+        progress: Optional[ProgressFn],
+    ) -> None:
+        blocked_ids: List[int] = []
+        log.info("Broadcast #%s: started at user id > %s (%s recipients)", run.id, run.last_user_id, run.total)
+        try:
+            markup = await self._markup(bot, test_id)
+            while run.status == STATUS_RUNNING and not self._stopping:
+                batch = await self._next_batch(run.last_user_id)
+                if not batch:
+                    run.status = STATUS_DONE
+                    break
+                for i in range(0, len(batch), self.concurrency):
+                    chunk = batch[i : i + self.concurrency]
+                    results = await asyncio.gather(*(self._send(bot, tg_id, text, markup) for _, tg_id in chunk))
+                    for (uid, _), result in zip(chunk, results):
+                        if result == SENT:
+                            run.sent += 1
+                        elif result == BLOCKED:
+                            run.blocked += 1
+                            blocked_ids.append(uid)
+                        else:
+                            run.failed += 1
+                    run.last_user_id = chunk[-1][0]
+                    run.processed_this_run += len(chunk)
+                    if run.status != STATUS_RUNNING or self._stopping:
+                        break
+                if not await self._save(run, blocked_ids):
+                    run.status = STATUS_CANCELLED  # boshqa process/admin bekor qildi
+                blocked_ids = []
+                if progress is not None:
+                    try:
+                        await progress(run)
+                    except Exception:
+                        log.exception("Broadcast #%s: progress callback failed", run.id)
+        except Exception:
+            log.exception("Broadcast #%s: stopped by error; resumes on next start or /broadcast_resume", run.id)
+        finally:
+            try:
+                await self._save(run, blocked_ids, final=True)
+            except Exception:
+                log.exception("Broadcast #%s: final progress save failed (lease expires in %s)", run.id, LEASE)
+            log.info(
+                "Broadcast #%s: %s, sent %s, blocked %s, failed %s of %s (%.1f msg/s)",
+                run.id,
+                run.status,
+                run.sent,
+                run.blocked,
+                run.failed,
+                run.total,
+                run.rate,
+            )
+        if progress is not None and run.status != STATUS_RUNNING:
+            try:
+                await progress(run)
+            except Exception:
+                log.exception("Broadcast #%s: progress callback failed", run.id)
+
+
+broadcasts = BroadcastEngine(
+    rate=settings.broadcast_rate,
+    batch_size=settings.broadcast_batch,
+    concurrency=settings.broadcast_concurrency,
+)
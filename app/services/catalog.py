@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Setting, Test
+from app.settings import settings
+
+# settings jadvalidagi umumiy versiya: har mutatsiyada yangi token, replica'lar shu orqali bilib oladi
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+@dataclass(frozen=True)
+class TestInfo:
+    """Read-only snapshot of a Test row (same attribute names as the ORM model)."""
+
+    id: int
+    category: str
+    name: str
+    num_questions: int
+    pdf_path: str
+    is_rasch: bool
+    created_at: Optional[datetime]
+
+
+@dataclass(frozen=True)
+class TestsPage:
+    """One keyset page of a category's (id, name) list.
+
+    Cursors: ``"a<id>"`` = tests after id, ``"b<id>"`` = tests before id, ``""`` = first page.
+    """
+
+    category: str
+    version: int
+    cursor: str
+    rows: List[Tuple[int, str]]
+    prev_cursor: Optional[str]
+    next_cursor: Optional[str]
+
+
+def parse_cursor(cursor: Optional[str]) -> Tuple[str, int]:
+    """``"a12"`` -> ("a", 12); empty/invalid -> ("", 0) i.e. first page."""
+    c = (cursor or "").strip()
+    if len(c) > 1 and c[0] in "ab" and c[1:].isdigit():
+        return c[0], int(c[1:])
+    return "", 0
+
+
+class TestCatalog:
+    """In-memory test catalog: metadata + per-category ordered (id, name) lists.
+
+    ``version`` monotonically increases on every mutation (``bump``); the snapshot is
+    reloaded lazily (one SELECT) on the first read after a bump.
+
+    Mutations also write a fresh token to ``settings[CATALOG_VERSION_KEY]`` (``touch``, in the
+    mutating transaction). At most every ``check_interval`` seconds a read compares that token
+    (one PK lookup), so edits made on another replica bump the local version too.
+    """
+
+    def __init__(self, *, check_interval: float = 2.0) -> None:
+        self.version = 1
+        self._loaded_version = 0
+        self.check_interval = max(0.0, float(check_interval))
+        self._token: Optional[str] = None
+        self._checked_at = 0.0
+        self._tests: Dict[int, TestInfo] = {}
+        self._by_category: Dict[str, List[Tuple[int, str]]] = {}
+        self._ids_by_category: Dict[str, List[int]] = {}  # bisect uchun
+        self._lock = asyncio.Lock()
+
+    def bump(self) -> int:
+        self.version += 1
+        return self.version
+
+    async def touch(self, session: AsyncSession) -> None:
+        """Publishes a new shared version token (no commit: rides on the mutation's transaction)."""
+        from app.services.repo import upsert_insert  # repo imports this module
+
+        token = uuid.uuid4().hex
+        stmt = upsert_insert(session, Setting).values(key=CATALOG_VERSION_KEY, value=token)
+        await session.execute(stmt.on_conflict_do_update(index_elements=[Setting.key], set_={"value": token}))
+        self._token = token  # o'zimizniki: keyingi tekshiruvda qayta bump qilinmaydi
+
+    async def _check_shared(self, session: AsyncSession) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        token = (
+            await session.execute(select(Setting.value).where(Setting.key == CATALOG_VERSION_KEY))
+        ).scalar_one_or_none()
+        if token != self._token:
+            if self._token is not None or token is not None:
+                self.bump()
+            self._token = token
+
+    async def current_version(self, session: AsyncSession) -> int:
+        """Local version after picking up edits from other replicas (throttled token check)."""
+        await self._check_shared(session)
+        return self.version
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_version == self.version
+
+    async def _ensure(self, session: AsyncSession) -> None:
+        await self._check_shared(session)
+        if self.is_fresh:
+            return
+        async with self._lock:
+            if self.is_fresh:
+                return
+            version = self.version
+            res = await session.execute(
+                select(
+                    Test.id,
+                    Test.category,
+                    Test.name,
+                    Test.num_questions,
+                    Test.pdf_path,
+                    Test.is_rasch,
+                    Test.created_at,
+                ).order_by(Test.id.asc())
+            )
+            tests: Dict[int, TestInfo] = {}
+            by_category: Dict[str, List[Tuple[int, str]]] = {}
+            for row in res.all():
+                info = TestInfo(
+                    id=int(row.id),
+                    category=row.category,
+                    name=row.name,
+                    num_questions=int(row.num_questions),
+                    pdf_path=row.pdf_path or "",
+                    is_rasch=bool(row.is_rasch),
+                    created_at=row.created_at,
+                )
+                tests[info.id] = info
+                by_category.setdefault(info.category, []).append((info.id, info.name))
+            self._tests = tests
+            self._by_category = by_category
+            self._ids_by_category = {cat: [tid for tid, _ in rows] for cat, rows in by_category.items()}
+            # bump() during the SELECT keeps us stale -> next read reloads again
+            self._loaded_version = version
+
+    async def get(self, session: AsyncSession, test_id: int) -> TestInfo:
+        await self._ensure(session)
+        info = self._tests.get(int(test_id))
+        if info is None:
+            raise NoResultFound(f"test id={test_id} not found")
+        return info
+
+    async def list_by_category(self, session: AsyncSession, category: str) -> List[Tuple[int, str]]:
+        await self._ensure(session)
+        return list(self._by_category.get(category, []))
+
+    async def page_by_category(
+        self, session: AsyncSession, category: str, *, cursor: Optional[str] = None, limit: int = 10
+    ) -> TestsPage:
+        """Keyset page over the id-ordered snapshot (bisect, no OFFSET, no per-page query)."""
+        await self._ensure(session)
+        rows = self._by_category.get(category, [])
+        ids = self._ids_by_category.get(category, [])
+        limit = max(1, int(limit))
+        direction, anchor = parse_cursor(cursor)
+        if direction == "a":
+            start = bisect_right(ids, anchor)
+            end = min(len(rows), start + limit)
+        elif direction == "b":
+            end = bisect_left(ids, anchor)
+            start = max(0, end - limit)
+        else:
+            start, end = 0, min(len(rows), limit)
+        page = rows[start:end]
+        return TestsPage(
+            category=category,
+            version=self._loaded_version,
+            cursor=f"{direction}{anchor}" if direction else "",
+            rows=page,
+            prev_cursor=f"b{page[0][0]}" if page and start > 0 else None,
+            next_cursor=f"a{page[-1][0]}" if page and end < len(rows) else None,
+        )
+
+
+catalog = TestCatalog(check_interval=settings.catalog_check_seconds)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from app.models import Certificate, Submission, User
+from app.services.certificate_issue import issue_certificate
+from app.services.certificate_jobs import pipeline
+from app.services.certificates_store import STATUS_READY, get_certificate_path
+from app.services.db_session import standalone_session
+from app.services.repo import get_test_info
+
+log = logging.getLogger(__name__)
+
+RENDER_TIMEOUT = 120.0
+
+
+@dataclass
+class ExportProgress:
+    total: int = 0
+    done: int = 0
+    rendered: int = 0
+    failed: int = 0
+
+
+ProgressCb = Callable[[ExportProgress], Awaitable[None]]
+
+
+def _arcname(tg_id: int, first_name: str, last_name: str) -> str:
+    name = re.sub(r"[^\w.-]+", "_", f"{first_name or ''} {last_name or ''}".strip(), flags=re.UNICODE).strip("_")
+    return f"{tg_id}_{name or 'user'}.pdf"
+
+
+async def iter_test_certificates(
+    test_id: int, prog: ExportProgress, progress: Optional[ProgressCb] = None
+) -> AsyncIterator[Tuple[str, Path]]:
+    """Yields (arcname, pdf path) for every non-baseline participant of a test.
+
+    Ready certificates come first; missing ones are rendered through the
+    certificate pipeline and yielded in completion order.
+    """
+    async with standalone_session() as session:
+        test = await get_test_info(session, test_id)
+        latest_ids = (
+            select(func.max(Submission.id))
+            .join(User, User.id == Submission.user_id)
+            .where(Submission.test_id == test_id, User.is_baseline == False)  # noqa: E712
+            .group_by(Submission.user_id)
+        )
+        subs = (
+            await session.execute(
+                select(User.id, User.tg_id, User.first_name, User.last_name, Submission.score)
+                .join(Submission, Submission.user_id == User.id)
+                .where(Submission.id.in_(latest_ids))
+                .order_by(User.id.asc())
+            )
+        ).all()
+        ready = {
+            int(r.user_id): r.pdf_path
+            for r in (
+                await session.execute(
+                    select(Certificate.user_id, Certificate.pdf_path)
+                    .where(Certificate.test_id == test_id, Certificate.status == STATUS_READY)
+                    .order_by(Certificate.id.asc())  # keyingi (eng oxirgi) sertifikat ustun
+                )
+            ).all()
+        }
+
+    prog.total = len(subs)
+    missing = []
+    for row in subs:
+        path = ready.get(int(row.id))
+        if path:
+            prog.done += 1
+            yield _arcname(row.tg_id, row.first_name, row.last_name), Path(path)
+            if progress:
+                await progress(prog)
+        else:
+            missing.append(row)
+
+    async def render_one(row) -> Optional[Path]:
+        cert_id = await issue_certificate(
+            tg_id=int(row.tg_id),
+            test=test,
+            full_name=f"{row.first_name or ''} {row.last_name or ''}",
+            score=float(row.score or 0.0),
+        )
+        await pipeline.wait(cert_id, RENDER_TIMEOUT)
+        return await get_certificate_path(cert_id)
+
+    # fixed worker count (not one task per participant): pipeline navbatini to'ldirish uchun yetarli
+    todo = iter(missing)
+    results: "asyncio.Queue[Tuple[object, Optional[Path]]]" = asyncio.Queue()
+
+    async def worker() -> None:
+        for row in todo:  # umumiy iterator: har bir qator faqat bitta worker'ga tushadi
+            try:
+                path = await render_one(row)
+            except Exception:
+                log.exception("certificate export: render failed for tg_id=%s", row.tg_id)
+                path = None
+            results.put_nowait((row, path))
+
+    tasks: List["asyncio.Task[None]"] = [
+        asyncio.create_task(worker()) for _ in range(min(len(missing), pipeline.workers * 2))
+    ]
+    try:
+        for _ in range(len(missing)):
+            row, path = await results.get()
+            prog.done += 1
+            if path is None:
+                prog.failed += 1
+            else:
+                prog.rendered += 1
+                yield _arcname(row.tg_id, row.first_name, row.last_name), path
+            if progress:
+                await progress(prog)
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+class _ChunkSink:
+    """Write-only, non-seekable sink for zipfile; chunks are drained after every entry."""
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+        self._pos = 0
+
+    def write(self, b: bytes) -> int:
+        self._buf += b
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+async def write_test_certificates_zip(
+    test_id: int, write: Callable[[bytes], Awaitable[None]], *, progress: Optional[ProgressCb] = None
+) -> ExportProgress:
+    """Streams a ZIP of all certificates of a test to ``write`` entry by entry (constant memory)."""
+    prog = ExportProgress()
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        seen = set()
+        async for arcname, path in iter_test_certificates(test_id, prog, progress):
+            if arcname in seen:
+                arcname = f"{Path(arcname).stem}_{len(seen)}.pdf"
+            seen.add(arcname)
+            try:
+                await asyncio.to_thread(zf.write, path, arcname)
+            except OSError:
+                prog.failed += 1
+                continue
+            chunk = sink.drain()
+            if chunk:
+                await write(chunk)
+    tail = sink.drain()  # central directory
+    if tail:
+        await write(tail)
+    return prog
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from datetime import datetime
+from functools import partial
+from typing import Optional
+
+from app.services.catalog import TestInfo
+from app.services.certificate_jobs import pipeline
+from app.services.certificates import (
+    CertificateData,
+    render_milliy_certificate,
+    render_sat_style_certificate,
+    render_simple_certificate,
+)
+from app.services.certificates_store import certificate_key
+from app.services.scoring import milliy_level, sat_scaled_from_percentile
+
+
+async def issue_certificate(
+    *,
+    tg_id: int,
+    test: TestInfo,
+    full_name: str,
+    score: float,
+    issued_at: Optional[datetime] = None,
+) -> int:
+    """Queues (or dedupes) the certificate for a scored submission; returns certificate id.
+
+    score: Submission.score (oddiy: foiz; Rasch: percentil).
+    """
+    issued_at = issued_at or datetime.utcnow()
+    full_name = (full_name or "").strip() or "-"
+
+    if test.category == "sat":
+        score_text = str(sat_scaled_from_percentile(score))
+        style = "sat"
+        render = partial(
+            render_sat_style_certificate,
+            data=CertificateData(full_name=full_name, test_name=test.name, score_text=score_text, issued_at=issued_at),
+        )
+    elif test.category == "milliy":
+        level = milliy_level(score)
+        score_text = f"{score:.1f}% ({level})"
+        style = "milliy"
+        render = partial(
+            render_milliy_certificate,
+            full_name=full_name,
+            test_name=test.name,
+            percent=score,
+            level=level,
+            issued_at=issued_at,
+        )
+    else:
+        score_text = f"{score:.1f}%"
+        style = "simple"
+        render = partial(
+            render_simple_certificate,
+            data=CertificateData(full_name=full_name, test_name=test.name, score_text=score_text, issued_at=issued_at),
+        )
+
+    return await pipeline.enqueue(
+        tg_id=tg_id,
+        test_id=test.id,
+        score_text=score_text,
+        render=render,
+        content_hash=certificate_key(style, tg_id, test.id, full_name, test.name, score_text),
+    )
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from app.services.cache import LRUCache
+from app.services.certificates_store import (
+    STATUS_FAILED,
+    STATUS_PENDING,
+    STATUS_READY,
+    create_certificate_record,
+    fail_pending_before,
+    find_certificate,
+    set_certificate_status,
+    set_certificates_status,
+    sharded_certificate_path,
+)
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+RenderFn = Callable[[Path], None]
+
+
+@dataclass
+class _Job:
+    cert_id: int
+    out_path: Path
+    render: RenderFn
+    content_hash: str = ""
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class PipelineStats:
+    submitted: int = 0
+    deduped: int = 0
+    completed: int = 0
+    failed: int = 0
+    queue_depth: int = 0
+    in_flight: int = 0
+    last_render_ms: float = 0.0
+    max_render_ms: float = 0.0
+    total_render_ms: float = 0.0
+    total_wait_ms: float = 0.0
+
+    @property
+    def avg_render_ms(self) -> float:
+        done = self.completed + self.failed
+        return self.total_render_ms / done if done else 0.0
+
+    @property
+    def avg_wait_ms(self) -> float:
+        done = self.completed + self.failed
+        return self.total_wait_ms / done if done else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "submitted": self.submitted,
+            "deduped": self.deduped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "last_render_ms": round(self.last_render_ms, 2),
+            "avg_render_ms": round(self.avg_render_ms, 2),
+            "max_render_ms": round(self.max_render_ms, 2),
+            "avg_wait_ms": round(self.avg_wait_ms, 2),
+        }
+
+
+class CertificatePipeline:
+    """Certificate render queue: asyncio.Queue + N workers, reportlab runs in a thread pool.
+
+    ``enqueue`` stores a *pending* Certificate row and returns its id right away;
+    readiness is observable via ``wait`` (push) or the DB status (poll).
+    """
+
+    def __init__(self, workers: int = 2) -> None:
+        self.workers = max(1, int(workers))
+        self.stats = PipelineStats()
+        self._queue: "asyncio.Queue[_Job]" = asyncio.Queue()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._waiters: Dict[int, "asyncio.Future[str]"] = {}
+        self._finished: LRUCache[int, str] = LRUCache(4096)
+        self._by_hash: Dict[str, "asyncio.Future[int]"] = {}
+        self._active: Set[int] = set()  # hozir render bo'layotgan cert id'lar
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cert-render")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def recover(self, *, started_at: datetime) -> int:
+        """Startup sweep: pending rows from an earlier run have no worker left, mark them failed.
+
+        A replica that is still rendering one of them just sets it back to ready when done;
+        failed rows are re-rendered by the next identical ``enqueue``.
+        """
+        n = await fail_pending_before(started_at)
+        if n:
+            log.info("certificates: %d pending rows from an earlier run marked failed", n)
+        return n
+
+    async def stop(self, *, timeout: float = 10.0) -> int:
+        """Waits for queued jobs up to ``timeout``; returns number of abandoned jobs.
+
+        Abandoned jobs (still queued or rendering) are marked *failed*, so the next
+        identical request renders them again instead of waiting on a dead *pending* row.
+        """
+        if not self.running:
+            return 0
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        unfinished = set(self._active)
+        while not self._queue.empty():
+            unfinished.add(self._queue.get_nowait().cert_id)
+            self._queue.task_done()
+        self.stats.queue_depth = 0
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if unfinished:
+            try:
+                await set_certificates_status(unfinished, STATUS_FAILED)
+            except Exception:
+                log.exception("could not mark %d abandoned certificates failed", len(unfinished))
+        for cert_id in unfinished:
+            self._finished.set(cert_id, STATUS_FAILED)
+            fut = self._waiters.pop(cert_id, None)
+            if fut is not None and not fut.done():
+                fut.set_result(STATUS_FAILED)
+        self._by_hash.clear()
+        return len(unfinished)
+
+    async def enqueue(
+        self,
+        *,
+        tg_id: int,
+        test_id: int,
+        score_text: str,
+        render: RenderFn,
+        content_hash: str = "",
+        out_path: Optional[Path] = None,
+    ) -> int:
+        """Queues a certificate render and returns its id right away (status *pending*).
+
+        With ``content_hash`` (see certificates_store.certificate_key) an identical
+        ready certificate (or one pending in this process) is returned as-is: no render,
+        no new file, no new row. A pending row with no live job here is queued again.
+        """
+        if not content_hash:
+            if out_path is None:
+                raise ValueError("out_path or content_hash is required")
+            return await self._enqueue(tg_id, test_id, score_text, render, content_hash, out_path)
+
+        # single-flight per hash: concurrent identical requests share one row/render
+        claim = self._by_hash.get(content_hash)
+        if claim is not None:
+            self.stats.deduped += 1
+            return await asyncio.shield(claim)
+        claim = asyncio.get_running_loop().create_future()
+        self._by_hash[content_hash] = claim
+        try:
+            existing = await find_certificate(tg_id=tg_id, test_id=test_id, content_hash=content_hash)
+            if existing and (
+                existing[1] == STATUS_READY or (existing[1] == STATUS_PENDING and existing[0] in self._waiters)
+            ):
+                self.stats.deduped += 1
+                del self._by_hash[content_hash]
+                cert_id = existing[0]
+            else:
+                # failed, or pending without a live job here (lost with a restart): render again
+                cert_id = await self._enqueue(
+                    tg_id,
+                    test_id,
+                    score_text,
+                    render,
+                    content_hash,
+                    out_path or sharded_certificate_path(content_hash),
+                    existing_id=existing[0] if existing else None,
+                )
+        except BaseException as e:
+            self._by_hash.pop(content_hash, None)
+            claim.set_exception(e)
+            claim.exception()  # mark retrieved
+            raise
+        claim.set_result(cert_id)
+        return cert_id
+
+    async def _enqueue(
+        self,
+        tg_id: int,
+        test_id: int,
+        score_text: str,
+        render: RenderFn,
+        content_hash: str,
+        out_path: Path,
+        *,
+        existing_id: Optional[int] = None,
+    ) -> int:
+        self.start()
+        if existing_id is not None:
+            cert_id = existing_id
+            await set_certificate_status(cert_id, STATUS_PENDING)
+        else:
+            cert_id = await create_certificate_record(
+                tg_id=tg_id,
+                test_id=test_id,
+                pdf_path=str(out_path),
+                score_text=score_text,
+                status=STATUS_PENDING,
+                content_hash=content_hash,
+            )
+        self._finished.pop(cert_id)
+        self._waiters.setdefault(cert_id, asyncio.get_running_loop().create_future())
+        self._queue.put_nowait(_Job(cert_id=cert_id, out_path=out_path, render=render, content_hash=content_hash))
+        self.stats.submitted += 1
+        self.stats.queue_depth = self._queue.qsize()
+        return cert_id
+
+    async def wait(self, cert_id: int, timeout: float) -> Optional[str]:
+        """Final status of a job queued by this process, or None (unknown job / timeout)."""
+        done = self._finished.get(cert_id)
+        if done is not None:
+            return done
+        fut = self._waiters.get(cert_id)
+        if fut is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            self.stats.queue_depth = self._queue.qsize()
+            self.stats.in_flight += 1
+            self._active.add(job.cert_id)
+            started = time.monotonic()
+            status = STATUS_FAILED
+            try:
+                # render to a side file, then atomically publish under the final name
+                part = job.out_path.with_name(job.out_path.name + ".part")
+                await loop.run_in_executor(self._pool, job.render, part)
+                part.replace(job.out_path)
+                status = STATUS_READY
+            except Exception:
+                log.exception("certificate %s render failed", job.cert_id)
+            finally:
+                render_ms = (time.monotonic() - started) * 1000
+                st = self.stats
+                st.in_flight -= 1
+                self._active.discard(job.cert_id)
+                st.last_render_ms = render_ms
+                st.max_render_ms = max(st.max_render_ms, render_ms)
+                st.total_render_ms += render_ms
+                st.total_wait_ms += (started - job.enqueued_at) * 1000
+                if status == STATUS_READY:
+                    st.completed += 1
+                else:
+                    st.failed += 1
+                try:
+                    await set_certificate_status(job.cert_id, status)
+                except Exception:
+                    log.exception("certificate %s status update failed", job.cert_id)
+                self._finished.set(job.cert_id, status)
+                if job.content_hash:
+                    self._by_hash.pop(job.content_hash, None)
+                fut = self._waiters.pop(job.cert_id, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(status)
+                self._queue.task_done()
+
+
+pipeline = CertificatePipeline(workers=settings.cert_workers)
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import io
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING, Sequence, Tuple
 
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.pdfgen import canvas
+if TYPE_CHECKING:
+    from reportlab.pdfgen import canvas
 
 
 @dataclass
@@ -16,13 +19,106 @@ class CertificateData:
     issued_at: datetime
 
 
-def _base(out_path: Path):
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    c = canvas.Canvas(str(out_path), pagesize=landscape(A4))
-    w, h = landscape(A4)
-    # ramka
-    c.rect(20, 20, w - 40, h - 40)
-    return c, w, h
+PAGE_SIZE = (297 * (72 / 25.4), 210 * (72 / 25.4))  # landscape(A4) pt, reportlab import qilinmasdan
+
+# ---------------- output profile ----------------
+# Sertifikatlar Telegramga yuklanadi va data/certificates'da saqlanadi, shuning uchun hajm muhim.
+# Kalitlar rl_config nomlari bilan bir xil, lekin faqat sertifikat Canvas'iga beriladi
+# (global rl_config o'zgartirilmaydi — boshqa hisobotlar va thread'larga ta'sir qilmaydi):
+# - pageCompression: content stream FlateDecode bilan siqiladi
+# - useA85: 0 — siqilgan stream ASCII85 bilan qayta kodlanmaydi (binary PDF, ~25% kichikroq)
+# - shriftlar: faqat standart Type1 (Helvetica) — PDF ichiga umuman joylanmaydi;
+#   TTF qo'shilsa reportlab uni avtomatik subset qiladi
+PDF_PROFILE = {"pageCompression": 1, "useA85": 0}
+
+
+@lru_cache(maxsize=None)
+def _canvas_cls() -> "type[canvas.Canvas]":
+    """reportlab is imported on the first render, not at bot startup (cold start)."""
+    from reportlab.pdfbase.pdfdoc import PDFStream, PDFZCompress
+    from reportlab.pdfgen.canvas import Canvas
+
+    class _CertCanvas(Canvas):
+        """Canvas with a per-document ``useA85`` switch (reportlab only has the global rl_config one)."""
+
+        def __init__(self, *args, useA85: int = 1, **kwargs) -> None:
+            super().__init__(*args, **kwargs)
+            self._useA85 = useA85
+
+        def showPage(self) -> None:
+            super().showPage()
+            if self._useA85 or not self._pageCompression:
+                return
+            # PDFPage stream'ni faqat Contents bo'sh bo'lsa rl_config.useA85 bo'yicha yig'adi
+            page = self._doc.Pages.pages[-1]
+            page.Contents = PDFStream(content=page.stream, filters=[PDFZCompress])
+
+    return _CertCanvas
+
+
+@dataclass(frozen=True)
+class _Text:
+    font: str
+    size: float
+    x: float
+    y: float
+    text: str
+    align: str = "left"  # left | center | right
+
+
+@dataclass(frozen=True)
+class _Template:
+    """Static layout of one certificate style (ramka + watermark + sarlavhalar)."""
+
+    watermark: str
+    static: Tuple[_Text, ...]
+
+    @property
+    def fonts(self) -> Tuple[str, ...]:
+        """Every font the static layout uses (watermark first), registered up front in _render."""
+        out = ["Helvetica-Bold"]
+        for t in self.static:
+            if t.font not in out:
+                out.append(t.font)
+        return tuple(out)
+
+
+@lru_cache(maxsize=None)
+def _template(style: str) -> _Template:
+    w, h = PAGE_SIZE
+    if style == "sat":
+        return _Template(
+            watermark="SAT • MSR",
+            static=(
+                _Text("Helvetica-Bold", 22, 50, h - 70, "SAT MATH PRACTICE CERTIFICATE"),
+                _Text("Helvetica", 12, 50, h - 100, "Ta’qdim etiladi:"),
+            ),
+        )
+    if style == "milliy":
+        return _Template(
+            watermark="MILLIY • MSR",
+            static=(
+                _Text("Helvetica-Bold", 24, w / 2, h - 80, "MILLIY SERTIFIKAT — AMALIYOT", "center"),
+                _Text("Helvetica", 12, w / 2, h - 110, "Ushbu sertifikat quyidagi ishtirokchiga taqdim etiladi:", "center"),
+            ),
+        )
+    return _Template(
+        watermark="MSR",
+        static=(
+            _Text("Helvetica-Bold", 24, w / 2, h - 80, "SERTIFIKAT", "center"),
+            _Text("Helvetica", 12, w / 2, h - 110, "Ushbu sertifikat quyidagi ishtirokchiga taqdim etiladi:", "center"),
+        ),
+    )
+
+
+def _draw_text(c: canvas.Canvas, t: _Text) -> None:
+    c.setFont(t.font, t.size)
+    if t.align == "center":
+        c.drawCentredString(t.x, t.y, t.text)
+    elif t.align == "right":
+        c.drawRightString(t.x, t.y, t.text)
+    else:
+        c.drawString(t.x, t.y, t.text)
 
 
 def _watermark(c: canvas.Canvas, w: float, h: float, text: str = "MSR") -> None:
@@ -41,72 +137,105 @@ def _watermark(c: canvas.Canvas, w: float, h: float, text: str = "MSR") -> None:
             pass
 
 
+def _draw_static(c: canvas.Canvas, tpl: _Template) -> None:
+    w, h = PAGE_SIZE
+    # ramka
+    c.rect(20, 20, w - 40, h - 40)
+    _watermark(c, w, h, tpl.watermark)
+    for t in tpl.static:
+        _draw_text(c, t)
+
+
+def _register_fonts(c: canvas.Canvas, tpl: _Template) -> None:
+    # reportlab font resource nomlarini (/F1, /F2, ...) hujjat ichida birinchi ishlatilish
+    # tartibida beradi; keshlangan stream va har bir sertifikat bir xil tartibda ro'yxatdan
+    # o'tkazadi, shuning uchun nomlar doim mos keladi (setFont'dan farqli — stream'ga hech narsa yozilmaydi)
+    for font in tpl.fonts:
+        c._doc.getInternalFontName(font)
+
+
+@lru_cache(maxsize=None)
+def _static_code(style: str) -> str:
+    """PDF content operators of the static layout, drawn once per style and reused verbatim.
+
+    reportlab has no public "page template" across documents, so this reads the canvas'
+    pending operator list (``_code``) right after drawing — reportlab is pinned in requirements.txt.
+    """
+    tpl = _template(style)
+    c = _canvas_cls()(io.BytesIO(), pagesize=PAGE_SIZE)
+    _register_fonts(c, tpl)
+    start = len(c._code)
+    _draw_static(c, tpl)
+    return "\n".join(c._code[start:])
+
+
+def _render(out_path: Path, style: str, fields: Sequence[_Text]) -> None:
+    """Cached static layout (bytes reused per style) + the per-certificate text stamped on top."""
+    tpl = _template(style)
+    code = _static_code(style)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    c = _canvas_cls()(str(out_path), pagesize=PAGE_SIZE, **PDF_PROFILE)
+    # default Info ("untitled", "unspecified", "anonymous") o'rniga qisqa metadata
+    c.setTitle("MSR sertifikat")
+    c.setAuthor("MSR")
+    c.setSubject(style)
+    _register_fonts(c, tpl)
+    c.addLiteral(code)
+    for t in fields:
+        _draw_text(c, t)
+    c.showPage()
+    c.save()
+
+
+def _issued_text(issued_at: datetime) -> _Text:
+    w, _ = PAGE_SIZE
+    return _Text("Helvetica", 10, w - 60, 60, f"Berilgan sana: {issued_at.strftime('%Y-%m-%d %H:%M UTC')}", "right")
+
+
 def render_simple_certificate(out_path: Path, data: CertificateData) -> None:
     """
     Oddiy (DTM / Prezident / Mavzu) uchun.
     """
-    c, w, h = _base(out_path)
-    _watermark(c, w, h, "MSR")
-    c.setFont("Helvetica-Bold", 24)
-    c.drawCentredString(w / 2, h - 80, "SERTIFIKAT")
-    c.setFont("Helvetica", 12)
-    c.drawCentredString(w / 2, h - 110, "Ushbu sertifikat quyidagi ishtirokchiga taqdim etiladi:")
-    c.setFont("Helvetica-Bold", 20)
-    c.drawCentredString(w / 2, h - 150, data.full_name)
-
-    c.setFont("Helvetica", 12)
-    c.drawString(60, h - 200, f"Test: {data.test_name}")
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(60, h - 235, f"Natija: {data.score_text}")
-
-    c.setFont("Helvetica", 10)
-    c.drawRightString(w - 60, 60, f"Berilgan sana: {data.issued_at.strftime('%Y-%m-%d %H:%M UTC')}")
-    c.showPage()
-    c.save()
+    w, h = PAGE_SIZE
+    _render(
+        out_path,
+        "simple",
+        (
+            _Text("Helvetica-Bold", 20, w / 2, h - 150, data.full_name, "center"),
+            _Text("Helvetica", 12, 60, h - 200, f"Test: {data.test_name}"),
+            _Text("Helvetica-Bold", 16, 60, h - 235, f"Natija: {data.score_text}"),
+            _issued_text(data.issued_at),
+        ),
+    )
 
 
 def render_sat_style_certificate(out_path: Path, data: CertificateData) -> None:
     """
     SAT (Math) uchun soddalashtirilgan realistik ko‘rinish.
     """
-    c, w, h = _base(out_path)
-    _watermark(c, w, h, "SAT • MSR")
-    c.setFont("Helvetica-Bold", 22)
-    c.drawString(50, h - 70, "SAT MATH PRACTICE CERTIFICATE")
-    c.setFont("Helvetica", 12)
-    c.drawString(50, h - 100, "Ta’qdim etiladi:")
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(170, h - 104, data.full_name)
-
-    c.setFont("Helvetica", 12)
-    c.drawString(50, h - 140, f"Test: {data.test_name}")
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, h - 175, f"Math Score: {data.score_text} (200–800)")
-
-    c.setFont("Helvetica", 10)
-    c.drawRightString(w - 60, 60, f"Berilgan sana: {data.issued_at.strftime('%Y-%m-%d %H:%M UTC')}")
-    c.showPage()
-    c.save()
+    _, h = PAGE_SIZE
+    _render(
+        out_path,
+        "sat",
+        (
+            _Text("Helvetica-Bold", 20, 170, h - 104, data.full_name),
+            _Text("Helvetica", 12, 50, h - 140, f"Test: {data.test_name}"),
+            _Text("Helvetica-Bold", 16, 50, h - 175, f"Math Score: {data.score_text} (200–800)"),
+            _issued_text(data.issued_at),
+        ),
+    )
 
 
 def render_milliy_certificate(out_path: Path, *, full_name: str, test_name: str, percent: float, level: str, issued_at: datetime) -> None:
-    c, w, h = _base(out_path)
-    _watermark(c, w, h, "MILLIY • MSR")
-    c.setFont("Helvetica-Bold", 24)
-    c.drawCentredString(w / 2, h - 80, "MILLIY SERTIFIKAT — AMALIYOT")
-    c.setFont("Helvetica", 12)
-    c.drawCentredString(w / 2, h - 110, "Ushbu sertifikat quyidagi ishtirokchiga taqdim etiladi:")
-    c.setFont("Helvetica-Bold", 20)
-    c.drawCentredString(w / 2, h - 150, full_name)
-
-    c.setFont("Helvetica", 12)
-    c.drawString(60, h - 200, f"Test: {test_name}")
-    c.setFont("Helvetica-Bold", 18)
-    c.drawString(60, h - 235, f"Foiz: {percent:.1f}%")
-    c.setFont("Helvetica-Bold", 18)
-    c.drawString(60, h - 270, f"Daraja: {level}")
-
-    c.setFont("Helvetica", 10)
-    c.drawRightString(w - 60, 60, f"Berilgan sana: {issued_at.strftime('%Y-%m-%d %H:%M UTC')}")
-    c.showPage()
-    c.save()
+    w, h = PAGE_SIZE
+    _render(
+        out_path,
+        "milliy",
+        (
+            _Text("Helvetica-Bold", 20, w / 2, h - 150, full_name, "center"),
+            _Text("Helvetica", 12, 60, h - 200, f"Test: {test_name}"),
+            _Text("Helvetica-Bold", 18, 60, h - 235, f"Foiz: {percent:.1f}%"),
+            _Text("Helvetica-Bold", 18, 60, h - 270, f"Daraja: {level}"),
+            _issued_text(issued_at),
+        ),
+    )
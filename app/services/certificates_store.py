@@ -1,46 +1,156 @@
 from __future__ import annotations
 
+import hashlib
+import json
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional, Tuple
 
-from sqlalchemy import select
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError, NoResultFound
 
-from app.db import SessionLocal
-from app.models import Certificate, User
+from app.models import Certificate
+from app.services.db_session import standalone_session
+from app.services.repo import forget_user_id, resolve_user_id
 
 
-async def create_certificate_record(*, tg_id: int, test_id: int, pdf_path: str, score_text: str) -> int:
+STATUS_PENDING = "pending"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+CERT_DIR = Path("data") / "certificates"
+
+
+def certificate_key(style: str, tg_id: int, test_id: int, *fields: object) -> str:
+    """Content hash of a certificate's rendered inputs (issue date excluded -> idempotent re-issue)."""
+    payload = json.dumps([style, int(tg_id), int(test_id), *[str(f) for f in fields]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def sharded_certificate_path(content_hash: str) -> Path:
+    """data/certificates/ab/cd/abcd....pdf"""
+    return CERT_DIR / content_hash[:2] / content_hash[2:4] / f"{content_hash}.pdf"
+
+
+async def find_certificate(*, tg_id: int, test_id: int, content_hash: str) -> Optional[Tuple[int, str]]:
+    """(certificate id, status) of an already issued identical certificate."""
+    if not content_hash:
+        return None
+    async with standalone_session() as session:
+        user_id = await resolve_user_id(session, tg_id)
+        if user_id is None:
+            return None
+        res = await session.execute(
+            select(Certificate.id, Certificate.status)
+            .where(
+                Certificate.content_hash == content_hash,
+                Certificate.user_id == user_id,
+                Certificate.test_id == test_id,
+            )
+            .order_by(Certificate.id.desc())
+            .limit(1)
+        )
+        row = res.first()
+        return (int(row.id), row.status) if row else None
+
+
+async def create_certificate_record(
+    *,
+    tg_id: int,
+    test_id: int,
+    pdf_path: str,
+    score_text: str,
+    status: str = STATUS_READY,
+    content_hash: str = "",
+) -> int:
     """Returns certificate id."""
-    async with SessionLocal() as session:
-        res = await session.execute(select(User).where(User.tg_id == tg_id))
-        user = res.scalar_one()
-        cert = Certificate(user_id=user.id, test_id=test_id, pdf_path=str(pdf_path), score_text=score_text)
+    async with standalone_session() as session:
+        user_id = await resolve_user_id(session, tg_id)
+        if user_id is None:
+            raise NoResultFound(f"user tg_id={tg_id} not found")
+        cert = Certificate(
+            user_id=user_id,
+            test_id=test_id,
+            pdf_path=str(pdf_path),
+            score_text=score_text,
+            status=status,
+            content_hash=content_hash,
+        )
         session.add(cert)
-        await session.commit()
+        try:
+            await session.commit()
+        except IntegrityError:
+            # keshlangan users.id boshqa replikada o'chirilgan userniki bo'lishi mumkin
+            await session.rollback()
+            forget_user_id(tg_id)
+            raise
         await session.refresh(cert)
         return cert.id
 
 
-async def get_certificate_path(cert_id: int) -> Optional[Path]:
-    async with SessionLocal() as session:
-        res = await session.execute(select(Certificate).where(Certificate.id == cert_id))
-        cert = res.scalar_one_or_none()
-        if not cert:
+async def set_certificate_status(cert_id: int, status: str) -> None:
+    async with standalone_session() as session:
+        await session.execute(update(Certificate).where(Certificate.id == cert_id).values(status=status))
+        await session.commit()
+
+
+async def set_certificates_status(cert_ids: Iterable[int], status: str) -> int:
+    """One UPDATE for many certificates; returns number of rows changed."""
+    ids = [int(i) for i in cert_ids]
+    if not ids:
+        return 0
+    async with standalone_session() as session:
+        res = await session.execute(update(Certificate).where(Certificate.id.in_(ids)).values(status=status))
+        await session.commit()
+        return int(res.rowcount or 0)
+
+
+async def fail_pending_before(before: datetime) -> int:
+    """Marks *pending* rows created before ``before`` as failed (renders lost with an earlier run)."""
+    async with standalone_session() as session:
+        res = await session.execute(
+            update(Certificate)
+            .where(Certificate.status == STATUS_PENDING, Certificate.created_at < before)
+            .values(status=STATUS_FAILED)
+        )
+        await session.commit()
+        return int(res.rowcount or 0)
+
+
+async def get_certificate_status_for_user(*, cert_id: int, tg_id: int) -> Optional[str]:
+    """pending | ready | failed, or None if the certificate is not this user's."""
+    async with standalone_session() as session:
+        user_id = await resolve_user_id(session, tg_id)
+        if user_id is None:
             return None
-        p = Path(cert.pdf_path or "")
-        return p if p.exists() else None
+        res = await session.execute(
+            select(Certificate.status).where(Certificate.id == cert_id, Certificate.user_id == user_id)
+        )
+        return res.scalar_one_or_none()
+
+
+async def get_certificate_path(cert_id: int) -> Optional[Path]:
+    """Existence comes from the status column (set when the render finished), no stat() call."""
+    async with standalone_session() as session:
+        res = await session.execute(
+            select(Certificate.pdf_path).where(Certificate.id == cert_id, Certificate.status == STATUS_READY)
+        )
+        pdf_path = res.scalar_one_or_none()
+        return Path(pdf_path) if pdf_path else None
 
 
 async def get_certificate_path_for_user(*, cert_id: int, tg_id: int) -> Optional[Path]:
     """Returns certificate path only if it belongs to the given Telegram user."""
-    async with SessionLocal() as session:
-        resu = await session.execute(select(User).where(User.tg_id == tg_id))
-        u = resu.scalar_one_or_none()
-        if not u:
-            return None
-        res = await session.execute(select(Certificate).where(Certificate.id == cert_id, Certificate.user_id == u.id))
-        cert = res.scalar_one_or_none()
-        if not cert:
+    async with standalone_session() as session:
+        user_id = await resolve_user_id(session, tg_id)
+        if user_id is None:
             return None
-        p = Path(cert.pdf_path or "")
-        return p if p.exists() else None
+        res = await session.execute(
+            select(Certificate.pdf_path).where(
+                Certificate.id == cert_id,
+                Certificate.user_id == user_id,
+                Certificate.status == STATUS_READY,
+            )
+        )
+        pdf_path = res.scalar_one_or_none()
+        return Path(pdf_path) if pdf_path else None
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from aiohttp import web
+from sqlalchemy import Connection, Engine, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import ORMExecuteState, Session, SessionTransaction
+from sqlalchemy.util.concurrency import in_greenlet
+
+from app.db import SessionLocal
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+# aiohttp request'dagi kalit: handler ichida ``request[DB_KEY]``
+DB_KEY = "db"
+
+# joriy update/request session'i va uni ochgan task (faqat o'sha task connection'ni bo'shatadi)
+_current: ContextVar[Optional[Tuple[AsyncSession, "asyncio.Task[Any]"]]] = ContextVar("db_update_session", default=None)
+
+
+class PinnedSession(Session):
+    """Sync session that checks out one connection on first use and keeps it until close.
+
+    Oddiy session har commit'da connection'ni pool'ga qaytaradi va keyingi so'rovda yana
+    checkout qiladi (pre-ping bilan). repo funksiyalari o'zi commit qiladi, shuning uchun
+    bitta update ichida bu 3-5 ta checkout bo'lardi. Bu yerda commit connection'dagi
+    transaction'ni yopadi, connection esa session yopilguncha (yoki ``release`` gacha:
+    Telegram so'rovi / ichki SessionLocal oldidan) shu session'da qoladi.
+    """
+
+    _pinned: Optional[Connection] = None
+    _wrote = False  # joriy transaction'da INSERT/UPDATE/DELETE (yoki flush) bo'lganmi
+
+    def has_writes(self) -> bool:
+        """True if ending the open transaction would persist (or lose) something."""
+        return self._wrote or bool(self.new or self.dirty or self.deleted)
+
+    def get_bind(self, *args: Any, **kw: Any):  # type: ignore[override]
+        bind = super().get_bind(*args, **kw)
+        # greenlet'dan tashqarida (masalan dialect tekshiruvi) connect qilib bo'lmaydi -> engine
+        if not isinstance(bind, Engine) or not in_greenlet():
+            return bind
+        if self._pinned is None or self._pinned.closed:
+            self._pinned = bind.connect()
+        return self._pinned
+
+    def release(self) -> None:
+        """Returns the pinned connection to the pool (between transactions only)."""
+        if self._pinned is not None and not self.in_transaction():
+            conn, self._pinned = self._pinned, None
+            conn.close()
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            conn, self._pinned = self._pinned, None
+            if conn is not None:
+                conn.close()
+
+
+@event.listens_for(PinnedSession, "do_orm_execute")
+def _track_writes(state: ORMExecuteState) -> None:
+    # text() ham "yozuv" deb olinadi: ichida nima borligini bilmaymiz
+    if not state.is_select:
+        state.session._wrote = True  # type: ignore[attr-defined]
+
+
+@event.listens_for(PinnedSession, "after_flush")
+def _track_flush(session: PinnedSession, _ctx: Any) -> None:
+    session._wrote = True
+
+
+@event.listens_for(PinnedSession, "after_transaction_end")
+def _reset_writes(session: PinnedSession, transaction: SessionTransaction) -> None:
+    if transaction.parent is None:
+        session._wrote = False
+
+
+def update_session() -> AsyncSession:
+    """One lazily-connected session for a whole update/request (no checkout until first query)."""
+    return SessionLocal(sync_session_class=PinnedSession)
+
+
+async def release_update_connection(reason: str = "") -> None:
+    """Gives the current update's connection back to the pool if no writes are in flight.
+
+    Called before slow outbound I/O (Telegram API) and before a nested SessionLocal checkout,
+    so a handler never holds a connection idle while it waits, or two at once. A read-only
+    transaction is simply ended (nothing to persist; expire_on_commit=False keeps loaded rows).
+    A transaction with writes is never committed here: the handler decides, so the connection
+    stays checked out (logged) until its own commit or the end of the update.
+    """
+    cur = _current.get()
+    if cur is None:
+        return
+    session, owner = cur
+    # create_task context'ni nusxalaydi: fon task'lar handler session'iga tegmaydi
+    if owner is not asyncio.current_task():
+        return
+    sync = session.sync_session
+    if not isinstance(sync, PinnedSession):
+        return
+    if session.in_transaction():
+        if sync.has_writes():
+            if sync._pinned is not None:
+                log.warning("DB connection held across %s: update has uncommitted writes", reason or "outbound I/O")
+            return
+        await session.commit()
+    if sync._pinned is not None:
+        await session.run_sync(lambda s: s.release())
+
+
+@asynccontextmanager
+async def standalone_session() -> AsyncIterator[AsyncSession]:
+    """``SessionLocal()`` for service code that may run inside an update/request."""
+    await release_update_connection("standalone_session")
+    async with SessionLocal() as session:
+        yield session
+
+
+async def finish_session(session: AsyncSession, exc: Optional[BaseException] = None) -> None:
+    """Commit whatever is still open (or roll back on error) and release the connection."""
+    try:
+        if session.in_transaction():
+            if exc is None:
+                await session.commit()
+            else:
+                await session.rollback()
+    finally:
+        await session.close()
+
+
+# ---------------- aiogram ----------------
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Injects ``session`` into handler kwargs; one connection checkout per DB phase of an update.
+
+    The connection is released before every Bot API call (``release_before_request``) and
+    before ``standalone_session``, so it is not held across Telegram I/O (unless the handler
+    has uncommitted writes — those are never committed behind its back).
+
+    Register after the update scheduler so the session lives inside the worker that
+    actually runs the handler (the scheduler's own call returns immediately).
+    """
+
+    def setup(self, dp: Dispatcher) -> None:
+        dp.update.outer_middleware(self)
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        session = update_session()
+        data["session"] = session
+        token = _current.set((session, asyncio.current_task()))
+        try:
+            result = await handler(event, data)
+        except BaseException as e:
+            await finish_session(session, e)
+            raise
+        finally:
+            _current.reset(token)
+        await finish_session(session)
+        return result
+
+
+class ReleaseBeforeRequest(BaseRequestMiddleware):
+    """Bot API request middleware: the update's DB connection is released before the HTTP call."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        await release_update_connection(type(method).__name__)
+        return await make_request(bot, method)
+
+
+# ---------------- aiohttp (Mini App) ----------------
+
+@web.middleware
+async def db_session_middleware(request: web.Request, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]):
+    """Mini App counterpart: ``request[DB_KEY]`` is one lazily-connected session per request."""
+    session = update_session()
+    request[DB_KEY] = session
+    token = _current.set((session, asyncio.current_task()))
+    try:
+        resp = await handler(request)
+    except web.HTTPException:
+        # redirect/404 kabi "oddiy" javoblar: ochiq yozuvlar saqlanadi
+        await finish_session(session)
+        raise
+    except BaseException as e:
+        await finish_session(session, e)
+        raise
+    finally:
+        _current.reset(token)
+    await finish_session(session)
+    return resp
+
+
+db_session = DbSessionMiddleware()
+release_before_request = ReleaseBeforeRequest()
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import json
+import re
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Submission, Test, User
+from app.services.db_session import standalone_session
+from app.services.repo import get_correct_answers, get_test_info
+
+EXPORTS_DIR = Path("data") / "exports"
+FORMATS = ("csv", "xlsx")
+DATASETS = ("users", "submissions", "test")
+
+# DB'dan bir martada olinadigan qatorlar (yield_per) va thread'ga beriladigan bo'lak hajmi
+STREAM_CHUNK = 5000
+
+ProgressCb = Callable[[int], Awaitable[None]]
+Formatter = Callable[[Any], List[Any]]
+
+
+# ---------------- writers (sync, run in a worker thread) ----------------
+
+class CsvWriter:
+    def __init__(self, path: Path, header: Sequence[str]) -> None:
+        # utf-8-sig: Excel kirill/lotin harflarni to'g'ri ochishi uchun
+        self._f = path.open("w", newline="", encoding="utf-8-sig")
+        self._w = csv.writer(self._f)
+        self._w.writerow(header)
+
+    def write_rows(self, rows: List[List[Any]]) -> None:
+        self._w.writerows(rows)
+
+    def close(self) -> None:
+        self._f.close()
+
+
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _xlsx_col(i: int) -> str:
+    out = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        out = chr(65 + r) + out
+    return out
+
+
+class XlsxWriter:
+    """Minimal streaming XLSX (inline strings, no styles): sheet XML goes straight into the zip entry.
+
+    Excel sheet limit is 1,048,576 rows, so the writer rolls over to Sheet2, Sheet3, ...
+    """
+
+    MAX_ROWS = 1_048_576
+
+    def __init__(self, path: Path, header: Sequence[str]) -> None:
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self._header = list(header)
+        self._sheets = 0
+        self._entry = None
+        self._row = 0
+        self._new_sheet()
+
+    def _new_sheet(self) -> None:
+        if self._entry is not None:
+            self._entry.write(b"</sheetData></worksheet>")
+            self._entry.close()
+        self._sheets += 1
+        self._entry = self._zip.open(f"xl/worksheets/sheet{self._sheets}.xml", "w", force_zip64=True)
+        self._entry.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        self._row = 0
+        self._write_row(self._header)
+
+    def _cell(self, ref: str, v: Any) -> str:
+        if v is None or v == "":
+            return ""
+        if isinstance(v, bool):
+            return f'<c r="{ref}"><v>{int(v)}</v></c>'
+        if isinstance(v, (int, float)):
+            return f'<c r="{ref}"><v>{v}</v></c>'
+        if isinstance(v, datetime):
+            v = v.strftime("%Y-%m-%d %H:%M:%S")
+        text = escape(_XML_ILLEGAL.sub("", str(v)))
+        return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+    def _write_row(self, values: Sequence[Any]) -> None:
+        self._row += 1
+        n = self._row
+        cells = "".join(self._cell(f"{_xlsx_col(i)}{n}", v) for i, v in enumerate(values))
+        self._entry.write(f'<row r="{n}">{cells}</row>'.encode("utf-8"))
+
+    def write_rows(self, rows: List[List[Any]]) -> None:
+        for r in rows:
+            if self._row >= self.MAX_ROWS:
+                self._new_sheet()
+            self._write_row(r)
+
+    def close(self) -> None:
+        self._entry.write(b"</sheetData></worksheet>")
+        self._entry.close()
+        n = self._sheets
+        ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        rel_ns = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+        pkg_rel = "http://schemas.openxmlformats.org/package/2006/relationships"
+        doc_rel = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+        sheet_ct = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+        self._zip.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + "".join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{sheet_ct}"/>' for i in range(1, n + 1))
+            + "</Types>",
+        )
+        self._zip.writestr(
+            "_rels/.rels",
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><Relationships xmlns="{pkg_rel}">'
+            f'<Relationship Id="rId1" Type="{doc_rel}/officeDocument" Target="xl/workbook.xml"/></Relationships>',
+        )
+        self._zip.writestr(
+            "xl/workbook.xml",
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><workbook {ns} {rel_ns}><sheets>'
+            + "".join(f'<sheet name="Sheet{i}" sheetId="{i}" r:id="rId{i}"/>' for i in range(1, n + 1))
+            + "</sheets></workbook>",
+        )
+        self._zip.writestr(
+            "xl/_rels/workbook.xml.rels",
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><Relationships xmlns="{pkg_rel}">'
+            + "".join(
+                f'<Relationship Id="rId{i}" Type="{doc_rel}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+                for i in range(1, n + 1)
+            )
+            + "</Relationships>",
+        )
+        self._zip.close()
+
+
+def _open_writer(fmt: str, path: Path, header: Sequence[str]):
+    return XlsxWriter(path, header) if fmt == "xlsx" else CsvWriter(path, header)
+
+
+# ---------------- datasets ----------------
+
+def _answers(answers_json: str, n: int) -> List[str]:
+    try:
+        ans = json.loads(answers_json or "{}")
+    except Exception:
+        ans = {}
+    return [ans.get(str(q), "") or "" for q in range(1, n + 1)]
+
+
+def _users_query():
+    header = ["tg_id", "first_name", "last_name", "username", "phone", "is_registered", "is_baseline", "created_at"]
+    stmt = select(
+        User.tg_id,
+        User.first_name,
+        User.last_name,
+        User.username,
+        User.phone,
+        User.is_registered,
+        User.is_baseline,
+        User.created_at,
+    ).order_by(User.id.asc())
+    return header, stmt, list
+
+
+async def _submissions_query(session: AsyncSession):
+    max_q = int((await session.execute(select(func.max(Test.num_questions)))).scalar() or 0)
+    header = [
+        "submission_id", "created_at", "tg_id", "test_id", "test_name", "category",
+        "raw_correct", "total", "score", "is_rasch",
+    ] + [f"q{q}" for q in range(1, max_q + 1)]
+    stmt = (
+        select(
+            Submission.id,
+            Submission.created_at,
+            User.tg_id,
+            Submission.test_id,
+            Test.name,
+            Test.category,
+            Submission.raw_correct,
+            Submission.total,
+            Submission.score,
+            Submission.is_rasch,
+            Submission.answers_json,
+        )
+        .join(User, User.id == Submission.user_id)
+        .join(Test, Test.id == Submission.test_id)
+        .order_by(Submission.id.asc())
+    )
+
+    def fmt(r) -> List[Any]:
+        return list(r[:10]) + _answers(r.answers_json, max_q)
+
+    return header, stmt, fmt
+
+
+async def _test_results_query(session: AsyncSession, test_id: int):
+    """Per-test results: latest submission per real (non-baseline) user, best score first."""
+    test = await get_test_info(session, test_id)
+    correct = await get_correct_answers(session, test_id)
+    n = test.num_questions
+    header = ["rank", "tg_id", "full_name", "username", "raw_correct", "total", "score", "created_at"] + [
+        f"q{q} ({correct.get(q, '')})" for q in range(1, n + 1)
+    ]
+    latest_ids = (
+        select(func.max(Submission.id))
+        .join(User, User.id == Submission.user_id)
+        .where(Submission.test_id == test_id, User.is_baseline == False)  # noqa: E712
+        .group_by(Submission.user_id)
+    )
+    stmt = (
+        select(
+            User.tg_id,
+            User.first_name,
+            User.last_name,
+            User.username,
+            Submission.raw_correct,
+            Submission.total,
+            Submission.score,
+            Submission.created_at,
+            Submission.answers_json,
+        )
+        .join(User, User.id == Submission.user_id)
+        .where(Submission.id.in_(latest_ids))
+        .order_by(Submission.score.desc(), Submission.id.asc())
+    )
+    rank = 0
+
+    def fmt(r) -> List[Any]:
+        nonlocal rank
+        rank += 1
+        full = f"{r.first_name or ''} {r.last_name or ''}".strip()
+        return [rank, r.tg_id, full, r.username, r.raw_correct, r.total, r.score, r.created_at] + _answers(r.answers_json, n)
+
+    return header, stmt, fmt
+
+
+# ---------------- export ----------------
+
+async def export_dataset(
+    dataset: str,
+    fmt: str = "csv",
+    *,
+    test_id: Optional[int] = None,
+    progress: Optional[ProgressCb] = None,
+) -> Tuple[Path, int]:
+    """Streams ``dataset`` (users | submissions | test) into data/exports as CSV or XLSX.
+
+    Rows come from a server-side cursor (``yield_per``) in STREAM_CHUNK pieces; formatting
+    and file writes run in a worker thread, so memory stays flat and the loop stays free.
+    Returns (path, rows). Raises ValueError on a bad dataset/format, NoResultFound on a bad test.
+    """
+    if dataset not in DATASETS or fmt not in FORMATS:
+        raise ValueError(f"unknown export: {dataset}/{fmt}")
+    if dataset == "test" and not test_id:
+        raise ValueError("test_id is required")
+
+    EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    name = f"test_{test_id}" if dataset == "test" else dataset
+    out = EXPORTS_DIR / f"msr_{name}_{ts}.{fmt}"
+
+    rows_done = 0
+    writer = None
+    try:
+        async with standalone_session() as session:
+            if dataset == "users":
+                header, stmt, row_fmt = _users_query()
+            elif dataset == "submissions":
+                header, stmt, row_fmt = await _submissions_query(session)
+            else:
+                header, stmt, row_fmt = await _test_results_query(session, int(test_id))
+            writer = await asyncio.to_thread(_open_writer, fmt, out, header)
+
+            result = await session.stream(stmt.execution_options(yield_per=STREAM_CHUNK))
+            async for part in result.partitions():
+                await asyncio.to_thread(lambda p=part: writer.write_rows([row_fmt(r) for r in p]))
+                rows_done += len(part)
+                if progress:
+                    await progress(rows_done)
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        out.unlink(missing_ok=True)
+        raise
+    return out, rows_done
+
+
+def zip_file(path: Path) -> Path:
+    """Deflate a (large) CSV into ``<name>.zip`` next to it; the original is removed."""
+    out = path.with_suffix(path.suffix + ".zip")
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.write(path, path.name)
+    path.unlink(missing_ok=True)
+    return out
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple, Union
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from app.services.cache import LRUCache
+from app.services.db_session import standalone_session
+from app.services.repo import delete_setting, get_setting, set_setting
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+_KEY_PREFIX = "tgfile:"
+
+# (path, mtime_ns, size) -> sha256 (faylni har safar qayta hash qilmaslik uchun)
+_digests: LRUCache[Tuple[str, int, int], str] = LRUCache(4096)
+# sha256 -> Telegram file_id (DB dagi "settings" jadvalining oldidagi xotira qatlami)
+_file_ids: LRUCache[str, str] = LRUCache(4096)
+# sha256 -> in-flight upload (single-flight: bir xil fayl bir vaqtda faqat bir marta yuklanadi)
+_inflight: Dict[str, "asyncio.Future[str]"] = {}
+# background prewarm tasks (GC dan saqlash uchun)
+_background: Set["asyncio.Task[Optional[str]]"] = set()
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def file_digest(path: Union[str, Path]) -> str:
+    """Content hash of a file; re-hashed only when its mtime/size changes."""
+    p = Path(path)
+    st = p.stat()
+    memo_key = (str(p.resolve()), st.st_mtime_ns, st.st_size)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        digest = await asyncio.to_thread(_sha256_file, p)
+        _digests.set(memo_key, digest)
+    return digest
+
+
+async def get_file_id(digest: str) -> Optional[str]:
+    fid = _file_ids.get(digest)
+    if fid:
+        return fid
+    async with standalone_session() as session:
+        fid = (await get_setting(session, _KEY_PREFIX + digest, "")).strip()
+    if fid:
+        _file_ids.set(digest, fid)
+    return fid or None
+
+
+async def remember_file_id(digest: str, file_id: str) -> None:
+    if not file_id or _file_ids.get(digest) == file_id:
+        return
+    _file_ids.set(digest, file_id)
+    async with standalone_session() as session:
+        await set_setting(session, _KEY_PREFIX + digest, file_id)
+
+
+async def forget_file_id(digest: str) -> None:
+    _file_ids.pop(digest)
+    async with standalone_session() as session:
+        await delete_setting(session, _KEY_PREFIX + digest)
+
+
+async def invalidate_path(path: Union[str, Path]) -> None:
+    """Drop cached digest + file_id of the file currently at ``path`` (call before it is replaced)."""
+    p = Path(path or "")
+    if not str(path or "") or not p.exists():
+        return
+    try:
+        digest = await file_digest(p)
+    except OSError:
+        return
+    resolved = str(p.resolve())
+    for key in [k for k in _digests.keys() if k[0] == resolved]:
+        _digests.pop(key)
+    await forget_file_id(digest)
+
+
+async def _wait_inflight(digest: str) -> Optional[str]:
+    """file_id from the in-flight upload(s) of ``digest``; None when there is none (or all failed).
+
+    After a failed upload the first waiter to wake starts the retry and registers it, the rest
+    wait on that one: retries stay single-flight instead of every waiter uploading at once.
+    """
+    while True:
+        fut = _inflight.get(digest)
+        if fut is None:
+            return None
+        fid = await asyncio.shield(fut)
+        if fid:
+            return fid
+        if _inflight.get(digest) is None:
+            return None  # birinchi uyg'ongan waiter o'zi yuklaydi
+
+
+async def _upload(bot: Bot, chat_id: int, path: Path, digest: str, **kwargs) -> Message:
+    """Fresh upload registered as the in-flight upload for ``digest``."""
+    fut: "asyncio.Future[str]" = asyncio.get_running_loop().create_future()
+    _inflight[digest] = fut
+    fid = ""
+    try:
+        msg = await bot.send_document(chat_id, FSInputFile(str(path)), **kwargs)
+        if msg.document:
+            fid = msg.document.file_id
+            await remember_file_id(digest, fid)
+        return msg
+    finally:
+        # waiters get "" on failure; _wait_inflight lets only one of them retry at a time
+        fut.set_result(fid)
+        if _inflight.get(digest) is fut:
+            del _inflight[digest]
+
+
+async def send_document_cached(bot: Bot, chat_id: int, path: Union[str, Path], **kwargs) -> Message:
+    """send_document that reuses Telegram's file_id for identical file content.
+
+    Concurrent first sends of the same file share one upload; a stale file_id
+    rejected by Telegram falls back to a fresh upload.
+    """
+    p = Path(path)
+    digest = await file_digest(p)
+    fid = await get_file_id(digest) or await _wait_inflight(digest)
+    if fid:
+        try:
+            return await bot.send_document(chat_id, fid, **kwargs)
+        except TelegramBadRequest:
+            log.info("stale file_id for %s, re-uploading", p.name)
+            await forget_file_id(digest)
+
+    return await _upload(bot, chat_id, p, digest, **kwargs)
+
+
+async def answer_document_cached(message: Message, path: Union[str, Path], **kwargs) -> Message:
+    return await send_document_cached(message.bot, message.chat.id, path, **kwargs)
+
+
+async def prewarm(bot: Bot, path: Union[str, Path]) -> Optional[str]:
+    """Upload ``path`` to STORAGE_CHAT_ID once so the first real send is a file_id send."""
+    chat_id = settings.storage_chat_id
+    p = Path(path or "")
+    if not chat_id or not str(path or "") or not p.exists():
+        return None
+    digest = await file_digest(p)
+    fid = await get_file_id(digest) or await _wait_inflight(digest)
+    if fid:
+        return fid
+    msg = await _upload(bot, chat_id, p, digest, disable_notification=True, caption=p.name)
+    return msg.document.file_id if msg.document else None
+
+
+async def prewarm_before_publish(bot: Bot, path: Union[str, Path], timeout: Optional[float] = None) -> Optional[str]:
+    """Prewarm and wait up to ``timeout`` (PREWARM_TIMEOUT) before the PDF is published to users.
+
+    On timeout the upload keeps running in the background (drained on shutdown) and the
+    first user send joins it through the in-flight registry.
+    """
+    task = schedule_prewarm(bot, path)
+    if task is None:
+        return None
+    wait = settings.prewarm_timeout if timeout is None else timeout
+    done, _ = await asyncio.wait({task}, timeout=max(0.0, wait))
+    return task.result() if done else None
+
+
+def schedule_prewarm(bot: Bot, path: Union[str, Path]) -> Optional["asyncio.Task[Optional[str]]"]:
+    """Fire-and-forget prewarm (no-op when STORAGE_CHAT_ID is not configured)."""
+    if not settings.storage_chat_id:
+        return None
+
+    async def _run() -> Optional[str]:
+        try:
+            return await prewarm(bot, path)
+        except Exception:
+            log.exception("prewarm failed for %s", path)
+            return None
+
+    task = asyncio.create_task(_run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def drain_background(timeout: float) -> int:
+    """Waits up to ``timeout`` for prewarm uploads; cancels the rest and returns how many."""
+    pending = set(_background)
+    if not pending:
+        return 0
+    _, pending = await asyncio.wait(pending, timeout=max(0.0, timeout))
+    for t in pending:
+        t.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    return len(pending)
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.db import SessionLocal
+from app.models import FsmState
+from app.services.repo import upsert_insert
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+# TTL'dan o'tgan yozuvlar shu oraliqda tozalanadi
+GC_INTERVAL = 3600.0
+
+
+# ---------------- serialization ----------------
+# Ixcham JSON; admin oqimlari ``answers`` ni {int: str} sifatida saqlaydi, oddiy JSON esa
+# kalitlarni str'ga aylantirib yuboradi. Shunday dict'lar {"\0d": [[k, v], ...]} ko'rinishida yoziladi.
+
+_DICT_TAG = "\x00d"
+
+
+def _encode(v: Any) -> Any:
+    if isinstance(v, dict):
+        if all(isinstance(k, str) for k in v):
+            return {k: _encode(x) for k, x in v.items()}
+        return {_DICT_TAG: [[k, _encode(x)] for k, x in v.items()]}
+    if isinstance(v, (list, tuple)):
+        return [_encode(x) for x in v]
+    return v
+
+
+def _decode(v: Any) -> Any:
+    if isinstance(v, dict):
+        if len(v) == 1 and _DICT_TAG in v:
+            return {k: _decode(x) for k, x in v[_DICT_TAG]}
+        return {k: _decode(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_decode(x) for x in v]
+    return v
+
+
+def dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(_encode(data), separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(raw: Optional[str]) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    try:
+        data = _decode(json.loads(raw))
+    except ValueError:
+        log.warning("broken FSM data dropped: %.80s", raw)
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+# ---------------- storage ----------------
+
+# update_data: boshqa replica bilan to'qnashuvda qayta o'qib, qayta urinish soni (jitter bilan)
+CAS_RETRIES = 8
+CAS_BACKOFF = 0.01
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class FsmConflictError(RuntimeError):
+    """update_data lost the compare-and-set race CAS_RETRIES times in a row."""
+
+
+class SqlFsmStorage(BaseStorage):
+    """aiogram FSM storage on the app database (``fsm_states``), shared by all bot processes.
+
+    Write-through: every set_state/set_data is one upsert and every read goes to the row,
+    so a user's next update sees the same state on any replica. ``update_data`` is a
+    read-merge-write guarded by ``fsm_states.version`` (compare-and-set, retried on
+    conflict), so concurrent updates of one user on two replicas never drop each
+    other's keys. Flows untouched for ``ttl`` seconds read as empty and are deleted by
+    a periodic GC.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl: float = 48 * 3600,
+        session_factory: async_sessionmaker = SessionLocal,
+    ) -> None:
+        self.ttl = max(60.0, float(ttl))
+        self._session_factory = session_factory
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(
+            str(p)
+            for p in (
+                key.bot_id,
+                key.chat_id,
+                key.user_id,
+                key.thread_id or "",
+                key.business_connection_id or "",
+                key.destiny,
+            )
+        )
+
+    def _cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    # ---- reads ----
+
+    async def _read_row(self, k: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        async with self._session_factory() as session:
+            row = (
+                await session.execute(
+                    select(FsmState.state, FsmState.data, FsmState.updated_at).where(FsmState.key == k)
+                )
+            ).first()
+        if row is None or (row.updated_at is not None and row.updated_at < self._cutoff()):
+            return None, {}
+        return row.state, loads(row.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._read_row(self._key(key))
+        return state
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._read_row(self._key(key))
+        return dict(data)
+
+    # ---- writes (write-through) ----
+
+    async def _put(self, k: str, *, state: Any = None, data: Any = None, has_state: bool, has_data: bool) -> None:
+        """Upserts one field; the other keeps its value unless the row has expired."""
+        self._ensure_task()
+        expired = FsmState.updated_at < self._cutoff()
+        async with self._session_factory() as session:
+            stmt = upsert_insert(session, FsmState).values(
+                key=k,
+                state=state if has_state else None,
+                data=dumps(data) if has_data else "{}",
+                version=1,
+                updated_at=datetime.utcnow(),
+            )
+            set_: Dict[str, Any] = {
+                "state": stmt.excluded.state if has_state else case((expired, None), else_=FsmState.state),
+                "data": stmt.excluded.data if has_data else case((expired, "{}"), else_=FsmState.data),
+                "version": FsmState.version + 1,
+                "updated_at": stmt.excluded.updated_at,
+            }
+            await session.execute(stmt.on_conflict_do_update(index_elements=[FsmState.key], set_=set_))
+            # state.clear(): bo'sh yozuv saqlanmaydi
+            await session.execute(
+                delete(FsmState).where(FsmState.key == k, FsmState.state.is_(None), FsmState.data == "{}")
+            )
+            await session.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._put(self._key(key), state=_state_name(state), has_state=True, has_data=False)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._put(self._key(key), data=dict(data), has_state=False, has_data=True)
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Merges ``data`` into the stored dict with compare-and-set on ``version``."""
+        k = self._key(key)
+        self._ensure_task()
+        for attempt in range(CAS_RETRIES):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, CAS_BACKOFF * attempt))
+            now = datetime.utcnow()
+            async with self._session_factory() as session:
+                row = (
+                    await session.execute(
+                        select(FsmState.state, FsmState.data, FsmState.version, FsmState.updated_at).where(
+                            FsmState.key == k
+                        )
+                    )
+                ).first()
+                if row is None:
+                    merged = dict(data)
+                    stmt = upsert_insert(session, FsmState).values(
+                        key=k, state=None, data=dumps(merged), version=1, updated_at=now
+                    )
+                    res = await session.execute(stmt.on_conflict_do_nothing(index_elements=[FsmState.key]))
+                else:
+                    live = row.updated_at is None or row.updated_at >= self._cutoff()
+                    merged = {**(loads(row.data) if live else {}), **data}
+                    res = await session.execute(
+                        update(FsmState)
+                        .where(FsmState.key == k, FsmState.version == row.version)
+                        .values(
+                            state=row.state if live else None,
+                            data=dumps(merged),
+                            version=FsmState.version + 1,
+                            updated_at=now,
+                        )
+                    )
+                if res.rowcount:
+                    await session.commit()
+                    return dict(merged)
+                await session.rollback()  # boshqa replica oldinroq yozdi: qayta o'qiymiz
+        raise FsmConflictError(f"FSM update_data conflict for {k}")
+
+    # ---- GC ----
+
+    def _ensure_task(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._gc_loop())
+
+    async def _gc_loop(self) -> None:
+        while True:
+            await asyncio.sleep(GC_INTERVAL)
+            try:
+                removed = await self.gc()
+                if removed:
+                    log.info("FSM GC: %s expired flows removed", removed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("FSM GC failed; will retry")
+
+    async def gc(self) -> int:
+        """Deletes flows untouched for longer than the TTL; returns removed rows."""
+        async with self._session_factory() as session:
+            res = await session.execute(delete(FsmState).where(FsmState.updated_at < self._cutoff()))
+            await session.commit()
+        return int(res.rowcount or 0)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def create_storage() -> BaseStorage:
+    """FSM_STORAGE=sql (default, shared/persistent) | memory (single process, lost on restart)."""
+    if settings.fsm_storage.strip().lower() == "memory":
+        return MemoryStorage()
+    return SqlFsmStorage(ttl=settings.fsm_ttl_hours * 3600)
@@ -1,13 +1,76 @@
 from __future__ import annotations
 
 import json
+from dataclasses import dataclass, field
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
-from sqlalchemy import select, delete
+from sqlalchemy import and_, case, select, delete, func, insert, update
+from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import Setting, Submission, Test, TestQuestion, User, Certificate
+from app.models import Setting, Submission, Test, TestQuestion, TestScoreBucket, TestStat, User, Certificate
+from app.services.cache import LRUCache
+from app.services.catalog import TestInfo, TestsPage, catalog
+from app.settings import settings
+
+
+BASELINE_COUNT = 10
+
+# tg_id -> (users.id, users.is_baseline). id user o'chirilguncha o'zgarmaydi (delete_user
+# entry'ni forget_user_id bilan tozalaydi); is_baseline faqat
+# ensure_baseline_users / set_user_baseline orqali o'zgaradi va ular entry'ni yangilaydi.
+# Trade-off: boshqa replikadagi set_user_baseline bu keshga yetib bormaydi (entry LRU'dan
+# chiqquncha). Amalda baseline faqat tg_id -1..-10 uchun startup'da (har replikada bir xil) qo'yiladi.
+_user_ids: LRUCache[int, Tuple[int, bool]] = LRUCache(settings.user_id_cache_size)
+
+# test_id -> catalog.version, shu versiyada testda BASELINE_COUNT baseline user bor edi.
+# Faqat "tayyor" natija keshlanadi (yangi baseline submission uni o'zgartirmaydi); baseline
+# kamaytiradigan yo'llar (baseline submission o'chirish, set_user_baseline) catalog.touch()+bump()
+# qiladi -> bu va boshqa replikalardagi yozuvlar eskiradi.
+_baseline_ready: LRUCache[int, int] = LRUCache(4096)
+
+
+@dataclass
+class BaselineProgress:
+    count: int = 0                              # baseline submission rows
+    users: int = 0                              # distinct baseline users with a submission
+    done: Set[int] = field(default_factory=set)  # baseline slots (1..10), admin UI uchun
+
+    @property
+    def ready(self) -> bool:
+        return self.users >= BASELINE_COUNT
+
+
+def _baseline_slot(tg_id: int) -> Optional[int]:
+    """UI slot of a global baseline user (tg_id -1..-10). Baseline yoki yo'qligi faqat users.is_baseline."""
+    return -tg_id if -BASELINE_COUNT <= tg_id <= -1 else None
+
+
+async def _user_id_and_baseline(session: AsyncSession, tg_id: int) -> Optional[Tuple[int, bool]]:
+    """(users.id, is_baseline) for tg_id; served from the identity cache, DB only on a miss."""
+    found = _user_ids.get(tg_id)
+    if found is not None:
+        return found
+    row = (await session.execute(select(User.id, User.is_baseline).where(User.tg_id == tg_id))).first()
+    if row is None:
+        return None
+    found = (int(row.id), bool(row.is_baseline))
+    _user_ids.set(tg_id, found)
+    return found
+
+
+def upsert_insert(session: AsyncSession, model):
+    """Dialect-specific INSERT (ON CONFLICT support): Postgres prod, SQLite local.
+
+    Shared by the rollup/FSM services; callers add ``on_conflict_do_*`` themselves.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(model)
 
 
 # ---------------- Settings ----------------
@@ -31,24 +94,87 @@ async def set_setting(session: AsyncSession, key: str, value: str) -> None:
     await session.commit()
 
 
+async def delete_setting(session: AsyncSession, key: str) -> None:
+    await session.execute(delete(Setting).where(Setting.key == key))
+    await session.commit()
+
+
 # ---------------- Users ----------------
 
 async def get_or_create_user(session: AsyncSession, tg_id: int, first_name: str, last_name: str, username: str) -> User:
-    res = await session.execute(select(User).where(User.tg_id == tg_id))
-    user = res.scalar_one_or_none()
-    if user is None:
-        user = User(tg_id=tg_id, first_name=first_name, last_name=last_name, username=username)
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
+    """Single round trip: INSERT ... ON CONFLICT (tg_id) RETURNING.
+
+    Existing users are returned as-is (the update only makes RETURNING yield the row and
+    clears ``blocked_at``: /start or the Mini App means the bot is reachable again).
+    """
+    stmt = upsert_insert(session, User).values(
+        tg_id=tg_id,
+        first_name=first_name or "",
+        last_name=last_name or "",
+        username=username or "",
+    )
+    stmt = stmt.on_conflict_do_update(index_elements=[User.tg_id], set_={"tg_id": stmt.excluded.tg_id, "blocked_at": None})
+    res = await session.scalars(stmt.returning(User), execution_options={"populate_existing": True})
+    user = res.one()
+    await session.commit()
+    _user_ids.set(user.tg_id, (user.id, bool(user.is_baseline)))
     return user
 
 
+async def resolve_user_id(session: AsyncSession, tg_id: int) -> Optional[int]:
+    """users.id for tg_id; served from the identity cache, DB only on a miss."""
+    found = await _user_id_and_baseline(session, tg_id)
+    return found[0] if found is not None else None
+
+
+def forget_user_id(tg_id: int) -> None:
+    """Drops the cached users.id of tg_id; every path that deletes users must call this."""
+    _user_ids.pop(tg_id)
+
+
+async def upsert_users(session: AsyncSession, rows: Iterable[Dict[str, Any]], *, update_profile: bool = False) -> int:
+    """Bulk INSERT ... ON CONFLICT (tg_id) DO NOTHING / DO UPDATE.
+
+    rows: dicts with at least ``tg_id`` (plus any User columns).
+    update_profile=True overwrites first_name/last_name/username of existing users.
+    Returns number of rows sent.
+    """
+    values = [dict(r) for r in rows if r.get("tg_id") is not None]
+    if not values:
+        return 0
+    stmt = upsert_insert(session, User).values(values)
+    if update_profile:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.tg_id],
+            set_={
+                "first_name": stmt.excluded.first_name,
+                "last_name": stmt.excluded.last_name,
+                "username": stmt.excluded.username,
+                "updated_at": datetime.utcnow(),
+            },
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[User.tg_id])
+    await session.execute(stmt)
+    await session.commit()
+    return len(values)
+
+
 async def get_user(session: AsyncSession, tg_id: int) -> Optional[User]:
     res = await session.execute(select(User).where(User.tg_id == tg_id))
     return res.scalar_one_or_none()
 
 
+async def set_user_blocked(session: AsyncSession, tg_id: int, blocked: bool) -> None:
+    """Broadcast recipient flag from ``my_chat_member`` (user blocked / unblocked the bot)."""
+    await session.execute(
+        update(User)
+        .where(User.tg_id == tg_id)
+        .values(blocked_at=datetime.utcnow() if blocked else None, updated_at=User.updated_at)
+    )
+    await session.commit()
+
+
 async def mark_registered(session: AsyncSession, tg_id: int, phone: str) -> None:
     res = await session.execute(select(User).where(User.tg_id == tg_id))
     user = res.scalar_one()
@@ -57,32 +183,69 @@ async def mark_registered(session: AsyncSession, tg_id: int, phone: str) -> None
     await session.commit()
 
 
+async def delete_user(session: AsyncSession, tg_id: int) -> None:
+    await session.execute(delete(User).where(User.tg_id == tg_id))
+    await session.commit()
+    forget_user_id(tg_id)
+
+
 async def set_user_baseline(session: AsyncSession, tg_id: int, is_baseline: bool) -> None:
     res = await session.execute(select(User).where(User.tg_id == tg_id))
     user = res.scalar_one()
     user.is_baseline = is_baseline
+    await catalog.touch(session)  # baseline_ready_tests keshini (barcha replikalarda) eskirtiradi
     await session.commit()
+    catalog.bump()
+    _user_ids.set(tg_id, (user.id, bool(is_baseline)))
 
 
 # ---------------- Tests ----------------
 
 async def list_tests_by_category(session: AsyncSession, category: str) -> List[Tuple[int, str]]:
-    res = await session.execute(select(Test).where(Test.category == category).order_by(Test.id.asc()))
-    tests = res.scalars().all()
-    return [(t.id, t.name) for t in tests]
+    """Served from the in-memory catalog (DB only after a catalog version bump)."""
+    return await catalog.list_by_category(session, category)
+
+
+async def list_tests_page(
+    session: AsyncSession, category: str, cursor: Optional[str] = None, limit: Optional[int] = None
+) -> TestsPage:
+    """Keyset page of (id, name) for a category; ``cursor`` comes from a previous page."""
+    return await catalog.page_by_category(
+        session, category, cursor=cursor, limit=limit or settings.tests_page_size
+    )
 
 
 async def get_test(session: AsyncSession, test_id: int) -> Test:
+    """ORM row (for mutations). Read-only callers should use get_test_info."""
     res = await session.execute(select(Test).where(Test.id == test_id))
     return res.scalar_one()
 
 
+async def get_test_info(session: AsyncSession, test_id: int) -> TestInfo:
+    """Test metadata from the in-memory catalog."""
+    return await catalog.get(session, test_id)
+
+
 async def get_correct_answers(session: AsyncSession, test_id: int) -> Dict[int, str]:
     res = await session.execute(select(TestQuestion).where(TestQuestion.test_id == test_id).order_by(TestQuestion.q_num.asc()))
     qs = res.scalars().all()
     return {q.q_num: q.correct_answer for q in qs}
 
 
+def _question_rows(test_id: int, num_questions: int, correct_answers: Dict[int, str]) -> List[Dict[str, Any]]:
+    return [
+        {"test_id": test_id, "q_num": q, "correct_answer": (correct_answers.get(q, "") or "").strip()}
+        for q in range(1, num_questions + 1)
+    ]
+
+
+async def insert_question_keys(session: AsyncSession, test_id: int, num_questions: int, correct_answers: Dict[int, str]) -> None:
+    """One multi-row INSERT for all answer keys of a test (no commit)."""
+    rows = _question_rows(test_id, num_questions, correct_answers)
+    if rows:
+        await session.execute(insert(TestQuestion).values(rows))
+
+
 async def create_test(
     session: AsyncSession,
     *,
@@ -92,45 +255,64 @@ async def create_test(
     pdf_path: str,
     correct_answers: Dict[int, str],
     is_rasch: bool,
+    pdf_path_for: Optional[Callable[[int], str]] = None,
 ) -> Test:
+    """Inserts the test + answer keys and publishes it (commit + catalog bump) in one step.
+
+    ``pdf_path_for(test_id)`` sets the final PDF path before the commit, so the test never
+    becomes visible with a placeholder path.
+    """
     t = Test(category=category, name=name, num_questions=num_questions, pdf_path=pdf_path, is_rasch=is_rasch)
     session.add(t)
-    await session.commit()
-    await session.refresh(t)
+    await session.flush()  # t.id kerak
+    if pdf_path_for is not None:
+        t.pdf_path = pdf_path_for(t.id)
 
-    for q in range(1, num_questions + 1):
-        session.add(TestQuestion(test_id=t.id, q_num=q, correct_answer=(correct_answers.get(q, "") or "").strip()))
+    await insert_question_keys(session, t.id, num_questions, correct_answers)
+    await catalog.touch(session)
     await session.commit()
+    catalog.bump()
     return t
 
 
-async def replace_test_pdf(session: AsyncSession, test_id: int, pdf_path: str) -> None:
+async def replace_test_pdf(session: AsyncSession, test_id: int, pdf_path: str) -> int:
+    """Returns number of cleared non-baseline attempts/certificates."""
     t = await get_test(session, test_id)
     t.pdf_path = pdf_path
+    await catalog.touch(session)
     await session.commit()
+    catalog.bump()
     # any edit enables users to check again
-    await delete_nonbaseline_attempts_for_test(session, test_id)
+    return await delete_nonbaseline_attempts_for_test(session, test_id)
 
 
 async def replace_test_name(session: AsyncSession, test_id: int, new_name: str) -> None:
     t = await get_test(session, test_id)
     t.name = (new_name or "").strip() or t.name
+    await catalog.touch(session)
     await session.commit()
+    catalog.bump()
 
 
-async def replace_test_answers(session: AsyncSession, test_id: int, correct_answers: Dict[int, str]) -> None:
-    # delete existing questions and recreate
+async def replace_test_answers(session: AsyncSession, test_id: int, correct_answers: Dict[int, str]) -> int:
+    # delete existing questions and recreate (single multi-row insert)
     await session.execute(delete(TestQuestion).where(TestQuestion.test_id == test_id))
     t = await get_test(session, test_id)
-    for q in range(1, t.num_questions + 1):
-        session.add(TestQuestion(test_id=test_id, q_num=q, correct_answer=(correct_answers.get(q, "") or "").strip()))
+    await insert_question_keys(session, test_id, t.num_questions, correct_answers)
+    await catalog.touch(session)
     await session.commit()
-    await delete_nonbaseline_attempts_for_test(session, test_id)
+    catalog.bump()
+    return await delete_nonbaseline_attempts_for_test(session, test_id)
 
 
 async def delete_test(session: AsyncSession, test_id: int) -> None:
+    # SQLite'da FK cascade pragma'siz ishlamaydi, id esa qayta ishlatilishi mumkin
+    await session.execute(delete(TestStat).where(TestStat.test_id == test_id))
+    await session.execute(delete(TestScoreBucket).where(TestScoreBucket.test_id == test_id))
     await session.execute(delete(Test).where(Test.id == test_id))
+    await catalog.touch(session)
     await session.commit()
+    catalog.bump()
 
 
 # ---------------- Submissions ----------------
@@ -146,26 +328,42 @@ async def save_submission(
     score: float,
     is_rasch: bool,
 ) -> Submission:
-    res = await session.execute(select(User).where(User.tg_id == tg_id))
-    user = res.scalar_one()
+    from app.services.analytics import record_submission
+
+    found = await _user_id_and_baseline(session, tg_id)
+    if found is None:
+        raise NoResultFound(f"user tg_id={tg_id} not found")
+    user_id, is_baseline = found
+    now = datetime.utcnow()
     sub = Submission(
-        user_id=user.id,
+        user_id=user_id,
         test_id=test_id,
         answers_json=json.dumps({str(k): v for k, v in answers.items()}, ensure_ascii=False),
         raw_correct=raw_correct,
         total=total,
         score=score,
         is_rasch=is_rasch,
+        created_at=now,
     )
     session.add(sub)
-    await session.commit()
+    if not is_baseline:
+        # rollup'lar submission bilan bitta tranzaksiyada (backfill bilan bir xil predikat: users.is_baseline)
+        await record_submission(session, test_id=test_id, score=score, at=now)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # user boshqa replikada o'chirilgan bo'lsa keshlangan id eskirgan (FK xatosi):
+        # keyingi urinish DB'dan qayta o'qiydi
+        await session.rollback()
+        forget_user_id(tg_id)
+        raise
     await session.refresh(sub)
     return sub
 
 
 async def list_answer_matrices_for_test(session: AsyncSession, test_id: int) -> List[List[bool]]:
     """Returns list of boolean correctness arrays for each submission (baseline+real), in chronological order."""
-    test = await get_test(session, test_id)
+    test = await get_test_info(session, test_id)
     correct = await get_correct_answers(session, test_id)
     res = await session.execute(select(Submission).where(Submission.test_id == test_id).order_by(Submission.id.asc()))
     subs = res.scalars().all()
@@ -186,50 +384,117 @@ async def list_answer_matrices_for_test(session: AsyncSession, test_id: int) ->
 
 
 async def get_latest_submission(session: AsyncSession, tg_id: int, test_id: int) -> Optional[Submission]:
-    resu = await session.execute(select(User).where(User.tg_id == tg_id))
-    user = resu.scalar_one_or_none()
-    if not user:
+    user_id = await resolve_user_id(session, tg_id)
+    if user_id is None:
         return None
     res = await session.execute(
-        select(Submission).where(Submission.user_id == user.id, Submission.test_id == test_id).order_by(Submission.id.desc())
+        select(Submission).where(Submission.user_id == user_id, Submission.test_id == test_id).order_by(Submission.id.desc())
     )
     return res.scalars().first()
 
 
 async def delete_submissions_for_user_test(session: AsyncSession, tg_id: int, test_id: int) -> None:
     """Deletes ALL submissions for (tg_id, test_id) (user or baseline)."""
-    resu = await session.execute(select(User).where(User.tg_id == tg_id))
-    user = resu.scalar_one_or_none()
-    if not user:
+    found = await _user_id_and_baseline(session, tg_id)
+    if found is None:
         return
-    await session.execute(delete(Submission).where(Submission.user_id == user.id, Submission.test_id == test_id))
+    user_id, is_baseline = found
+    await session.execute(delete(Submission).where(Submission.user_id == user_id, Submission.test_id == test_id))
+    if is_baseline:
+        # test "tayyor" bo'lmay qolishi mumkin: baseline_ready_tests keshi eskiradi
+        await catalog.touch(session)
     await session.commit()
+    if is_baseline:
+        catalog.bump()
+    else:
+        from app.services.analytics import rebuild_test
 
+        await rebuild_test(session, test_id)
 
-async def delete_nonbaseline_attempts_for_test(session: AsyncSession, test_id: int) -> None:
-    """When admin edits a test, allow users to check again by clearing non-baseline attempts + certificates."""
-    # delete submissions of non-baseline users
-    res = await session.execute(select(User.id).where(User.is_baseline == False))  # noqa: E712
-    non_ids = [r[0] for r in res.all()]
-    if non_ids:
-        await session.execute(delete(Submission).where(Submission.test_id == test_id, Submission.user_id.in_(non_ids)))
-        await session.execute(delete(Certificate).where(Certificate.test_id == test_id, Certificate.user_id.in_(non_ids)))
-        await session.commit()
 
+async def delete_nonbaseline_attempts_for_test(session: AsyncSession, test_id: int, *, batch_size: int = 5000) -> int:
+    """When admin edits a test, allow users to check again by clearing non-baseline attempts + certificates.
 
-async def list_baseline_done_indices(session: AsyncSession, test_id: int) -> List[int]:
-    """Returns list of baseline indices (1..10) that already submitted for this test."""
+    Set-based: user filter is a subselect on users.is_baseline (no ids travel to Python),
+    deletes run in bounded batches inside one transaction. Returns deleted row count.
+    """
+    nonbaseline_ids = select(User.id).where(User.is_baseline == False)  # noqa: E712
+    deleted = 0
+    for model in (Submission, Certificate):
+        while True:
+            batch_ids = (
+                select(model.id)
+                .where(model.test_id == test_id, model.user_id.in_(nonbaseline_ids))
+                .limit(batch_size)
+            )
+            res = await session.execute(
+                delete(model).where(model.id.in_(batch_ids)).execution_options(synchronize_session=False)
+            )
+            n = res.rowcount or 0
+            deleted += n
+            if n < batch_size:
+                break
+    # test rollup'lari faqat real userlarni sanaydi -> endi bo'sh (daily_stats tarix sifatida qoladi)
+    await session.execute(delete(TestStat).where(TestStat.test_id == test_id))
+    await session.execute(delete(TestScoreBucket).where(TestScoreBucket.test_id == test_id))
+    await session.commit()
+    return deleted
+
+
+async def get_baseline_progress(session: AsyncSession, test_id: int) -> BaselineProgress:
+    """Baseline count + done slots: one GROUP BY query on the (test_id, user_id) index.
+
+    Not cached: only the admin baseline screens read it, right after baseline submissions
+    that may come from any replica. The user-facing check is baseline_ready_tests (cached).
+    """
     res = await session.execute(
-        select(User.tg_id)
+        select(User.tg_id, func.count(Submission.id))
         .join(Submission, Submission.user_id == User.id)
         .where(Submission.test_id == test_id, User.is_baseline == True)  # noqa: E712
+        .group_by(User.tg_id)
+    )
+    progress = BaselineProgress()
+    for tg_id, n in res.all():
+        progress.count += int(n)
+        progress.users += 1
+        slot = _baseline_slot(int(tg_id))
+        if slot is not None:
+            progress.done.add(slot)
+    return progress
+
+
+async def baseline_ready_tests(session: AsyncSession, test_ids: Iterable[int]) -> Set[int]:
+    """Which of ``test_ids`` have BASELINE_COUNT baseline users submitted.
+
+    Tests already seen ready at the current catalog version come from ``_baseline_ready``;
+    the rest of the page is checked with one GROUP BY.
+    """
+    version = await catalog.current_version(session)
+    ready: Set[int] = set()
+    ids: List[int] = []
+    for tid in test_ids:
+        if _baseline_ready.get(tid) == version:
+            ready.add(tid)
+        else:
+            ids.append(tid)
+    if not ids:
+        return ready
+    res = await session.execute(
+        select(Submission.test_id)
+        .join(User, Submission.user_id == User.id)
+        .where(Submission.test_id.in_(ids), User.is_baseline == True)  # noqa: E712
+        .group_by(Submission.test_id)
+        .having(func.count(func.distinct(Submission.user_id)) >= BASELINE_COUNT)
     )
-    tg_ids = {int(r[0]) for r in res.all()}
-    out = []
-    for i in range(1, 11):
-        if -i in tg_ids:
-            out.append(i)
-    return out
+    for tid in res.scalars().all():
+        _baseline_ready.set(int(tid), version)
+        ready.add(int(tid))
+    return ready
+
+
+async def list_baseline_done_indices(session: AsyncSession, test_id: int) -> List[int]:
+    """Returns list of baseline indices (1..10) that already submitted for this test."""
+    return sorted((await get_baseline_progress(session, test_id)).done)
 
 
 # ---------------- Baseline (Rasch) ----------------
@@ -238,37 +503,40 @@ async def ensure_baseline_users(session: AsyncSession) -> List[User]:
     """
     Global 10 ta baseline user (tg_id: -1..-10) yaratib qo‘yadi.
     Bu userlar faqat Rasch bazasi uchun ishlatiladi.
+    Bitta upsert statement: yo'qlari yaratiladi, borlari baseline deb belgilanadi.
     """
-    users: List[User] = []
-    for i in range(1, 11):
-        tg_id = -i
-        res = await session.execute(select(User).where(User.tg_id == tg_id))
-        u = res.scalar_one_or_none()
-        if not u:
-            u = User(
-                tg_id=tg_id,
-                first_name=f"Baseline{i}",
-                last_name="",
-                username="",
-                phone="",
-                is_registered=True,
-                is_baseline=True,
-            )
-            session.add(u)
-            await session.commit()
-            await session.refresh(u)
-        else:
-            if not u.is_baseline:
-                u.is_baseline = True
-                u.is_registered = True
-                await session.commit()
-        users.append(u)
+    rows = [
+        {
+            "tg_id": -i,
+            "first_name": f"Baseline{i}",
+            "last_name": "",
+            "username": "",
+            "phone": "",
+            "is_registered": True,
+            "is_baseline": True,
+        }
+        for i in range(1, BASELINE_COUNT + 1)
+    ]
+    stmt = upsert_insert(session, User).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={
+            "is_baseline": True,
+            "is_registered": True,
+            # faqat haqiqatan o'zgargan qatorlar report watermark'ini siljitadi
+            "updated_at": case(
+                (and_(User.is_baseline == True, User.is_registered == True), User.updated_at),  # noqa: E712
+                else_=datetime.utcnow(),
+            ),
+        },
+    )
+    res = await session.scalars(stmt.returning(User), execution_options={"populate_existing": True})
+    users = sorted(res.all(), key=lambda u: -u.tg_id)
+    await session.commit()
+    for u in users:
+        _user_ids.set(u.tg_id, (u.id, True))
     return users
 
 
 async def count_baseline_submissions(session: AsyncSession, test_id: int) -> int:
-    res = await session.execute(
-        select(Submission).join(User, Submission.user_id == User.id)
-        .where(Submission.test_id == test_id, User.is_baseline == True)  # noqa: E712
-    )
-    return len(res.scalars().all())
+    return (await get_baseline_progress(session, test_id)).count
@@ -167,3 +167,21 @@ def sat_scaled_from_percentile(pct: float) -> int:
     # 200..800
     pct = min(100.0, max(0.0, pct))
     return int(round(200 + 6 * pct))
+
+
+def milliy_level(percent: float) -> str:
+    """Milliy sertifikat darajasi (C .. A+) foiz bo'yicha."""
+    p = percent
+    if 50 <= p <= 59.999:
+        return "C"
+    if 60 <= p <= 69.999:
+        return "C+"
+    if 70 <= p <= 79.999:
+        return "B"
+    if 80 <= p <= 89.999:
+        return "B+"
+    if 90 <= p <= 94.999:
+        return "A"
+    if 95 <= p <= 100:
+        return "A+"
+    return "-"
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import time
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+
+# ---------------- HTTP in-flight tracking ----------------
+
+class HttpDrain:
+    """Counts in-flight Mini App/webhook requests; once draining, new ones get 503."""
+
+    def __init__(self) -> None:
+        self.draining = False
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> int:
+        """Returns how many requests were still running when ``timeout`` ran out."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            pass
+        return self.inflight
+
+
+http_drain = HttpDrain()
+
+
+@web.middleware
+async def drain_middleware(request: web.Request, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]):
+    if http_drain.draining:
+        # load balancer / Telegram boshqa replikaga yoki keyinroq qayta yuboradi
+        return web.json_response(
+            {"error": "shutting down"}, status=503, headers={"Retry-After": "5", "Connection": "close"}
+        )
+    http_drain.inflight += 1
+    http_drain._idle.clear()
+    try:
+        return await handler(request)
+    finally:
+        http_drain.inflight -= 1
+        if http_drain.inflight == 0:
+            http_drain._idle.set()
+
+
+# ---------------- shutdown sequence ----------------
+
+def install_signal_handlers(stop: Callable[[], None]) -> None:
+    """SIGTERM/SIGINT -> ``stop`` (webhook mode; polling handles signals itself)."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C -> KeyboardInterrupt, finally bloklari baribir ishlaydi
+
+
+async def graceful_shutdown(
+    *,
+    bot: Bot,
+    dp: Dispatcher,
+    runner: Optional[web.AppRunner],
+    timeout: Optional[float] = None,
+) -> None:
+    """Stop intake, drain in-flight work within one deadline, then close.
+
+    Order matters: the bot session and FSM storage are still needed while queued updates,
+    renders and uploads finish, so they are closed last.
+    """
+    from app.db import engine
+    from app.services import file_ids
+    from app.services.broadcast import broadcasts
+    from app.services.certificate_jobs import pipeline
+    from app.services.update_scheduler import scheduler
+
+    timeout = settings.shutdown_timeout if timeout is None else timeout
+    started = time.monotonic()
+
+    def left() -> float:
+        return max(0.0, timeout - (time.monotonic() - started))
+
+    log.info("Shutdown: draining (deadline %.0fs)", timeout)
+
+    # 1) yangi so'rov/update qabul qilinmaydi (polling allaqachon to'xtagan)
+    http_drain.draining = True
+    if runner is not None:
+        for site in list(runner.sites):
+            await site.stop()
+
+    # 2) in-flight ish: HTTP handlerlar (submit, webhook) -> update'lar -> render'lar -> upload'lar
+    http_left = await http_drain.wait_idle(left())
+    updates_left = await scheduler.stop(timeout=left())
+    renders_left = await pipeline.stop(timeout=left())
+    uploads_left = await file_ids.drain_background(left())
+    # e'lonlar: sweep to'xtaydi, joriy chunk tugaydi, progress saqlanadi; boshqa replica yoki keyingi start davom ettiradi
+    broadcasts_left = await broadcasts.stop(timeout=min(left(), 5.0))
+    drained = time.monotonic() - started
+
+    # 3) aiohttp cleanup (webhook rejimida dp.shutdown ham shu yerda), FSM storage, pool'lar
+    if runner is not None:
+        await runner.cleanup()
+    try:
+        await dp.storage.close()  # FSM write-through: faqat GC task to'xtaydi
+    except Exception:
+        log.exception("FSM storage close failed")
+    await bot.session.close()
+    await engine.dispose()
+
+    log.info(
+        "Shutdown: drained in %.2fs, total %.2fs; abandoned: http=%d updates=%d renders=%d uploads=%d; "
+        "broadcasts paused: %d",
+        drained,
+        time.monotonic() - started,
+        http_left,
+        updates_left,
+        renders_left,
+        uploads_left,
+        broadcasts_left,
+    )
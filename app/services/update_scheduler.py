@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import ErrorEvent, TelegramObject, Update
+
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+SHED_TEXT = "⏳ Bot hozir juda band. Iltimos, birozdan so'ng qayta urinib ko'ring."
+
+
+@dataclass
+class _Item:
+    handler: Handler
+    update: Update
+    data: Dict[str, Any]
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+@dataclass
+class SchedulerStats:
+    submitted: int = 0
+    processed: int = 0
+    failed: int = 0
+    shed: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    in_flight: int = 0
+    total_wait_ms: float = 0.0
+    max_wait_ms: float = 0.0
+    total_handler_ms: float = 0.0
+    max_handler_ms: float = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        done = self.processed + self.failed
+        return {
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "shed": self.shed,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "avg_wait_ms": round(self.total_wait_ms / done, 2) if done else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "avg_handler_ms": round(self.total_handler_ms / done, 2) if done else 0.0,
+            "max_handler_ms": round(self.max_handler_ms, 2),
+        }
+
+
+class UpdateScheduler(BaseMiddleware):
+    """Outer update middleware: bounded worker pool with strict per-user ordering.
+
+    Every update is parked in its user's FIFO and the middleware returns at once, so aiogram's
+    own per-update tasks stay tiny. ``workers`` tasks take one *user* at a time from a ready
+    queue, run that user's oldest update, and requeue the user if more are waiting: one user
+    never runs two updates concurrently, different users run in parallel.
+
+    Past ``max_pending`` queued updates in total (or ``per_user_limit`` for one user) new
+    updates are shed with a short "busy" reply.
+    """
+
+    def __init__(self, workers: int = 16, max_pending: int = 1000, per_user_limit: int = 20) -> None:
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.per_user_limit = max(1, int(per_user_limit))
+        self.stats = SchedulerStats()
+        self._dispatcher: Optional[Dispatcher] = None
+        self._pending: Dict[Hashable, Deque[_Item]] = {}
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def setup(self, dp: Dispatcher) -> None:
+        """Register as the innermost update outer-middleware (after errors/user-context/FSM)."""
+        self._dispatcher = dp
+        dp.update.outer_middleware(self)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, *, timeout: float = 10.0) -> int:
+        """Waits up to ``timeout`` for queued updates; returns how many were dropped."""
+        if not self.running:
+            return 0
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        dropped = self.stats.queue_depth + self.stats.in_flight
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._pending.clear()
+        self._ready = asyncio.Queue()
+        self.stats.queue_depth = 0
+        self.stats.in_flight = 0
+        self._idle.set()
+        return dropped
+
+    @staticmethod
+    def _key(update: Update, data: Dict[str, Any]) -> Hashable:
+        user = data.get("event_from_user")
+        if user is not None:
+            return ("user", user.id)
+        chat = data.get("event_chat")
+        if chat is not None:
+            return ("chat", chat.id)
+        return ("update", update.update_id)  # userless update: tartib shart emas
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+        update: Update = event  # type: ignore[assignment]
+        key = self._key(update, data)
+        queue = self._pending.get(key)
+        if self.stats.queue_depth >= self.max_pending or (queue is not None and len(queue) >= self.per_user_limit):
+            self.stats.shed += 1
+            await self._shed(update, data)
+            return None
+
+        self.start()
+        item = _Item(handler=handler, update=update, data=data)
+        if queue is None:
+            # foydalanuvchi bo'sh edi (va hozir ishlanmayapti) -> navbatga
+            self._pending[key] = deque([item])
+            self._ready.put_nowait(key)
+        else:
+            queue.append(item)
+        st = self.stats
+        st.submitted += 1
+        st.queue_depth += 1
+        st.max_queue_depth = max(st.max_queue_depth, st.queue_depth)
+        self._idle.clear()
+        return None
+
+    async def _shed(self, update: Update, data: Dict[str, Any]) -> None:
+        bot = data.get("bot")
+        if bot is None:
+            return
+        try:
+            if update.callback_query is not None:
+                await bot.answer_callback_query(update.callback_query.id, text=SHED_TEXT)
+            elif update.message is not None:
+                await bot.send_message(update.message.chat.id, SHED_TEXT)
+        except Exception:
+            log.debug("shed reply failed", exc_info=True)
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._pending.get(key)
+            if not queue:
+                self._pending.pop(key, None)
+                continue
+            item = queue[0]
+            st = self.stats
+            st.queue_depth -= 1
+            st.in_flight += 1
+            started = time.monotonic()
+            wait_ms = (started - item.enqueued_at) * 1000
+            ok = False
+            try:
+                await self._run(item)
+                ok = True
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Update id=%s failed", item.update.update_id)
+            finally:
+                handler_ms = (time.monotonic() - started) * 1000
+                st.in_flight -= 1
+                st.total_wait_ms += wait_ms
+                st.max_wait_ms = max(st.max_wait_ms, wait_ms)
+                st.total_handler_ms += handler_ms
+                st.max_handler_ms = max(st.max_handler_ms, handler_ms)
+                if ok:
+                    st.processed += 1
+                else:
+                    st.failed += 1
+                queue.popleft()
+                if queue:
+                    self._ready.put_nowait(key)  # navbatdagi update — boshqa userlardan keyin
+                else:
+                    self._pending.pop(key, None)
+                if st.queue_depth == 0 and st.in_flight == 0:
+                    self._idle.set()
+
+    async def _run(self, item: _Item) -> None:
+        # ErrorsMiddleware bu yergacha yetib kelmaydi (middleware allaqachon qaytgan) -> dp.errors'ni o'zimiz chaqiramiz
+        try:
+            await item.handler(item.update, item.data)
+        except Exception as e:
+            if self._dispatcher is None:
+                raise
+            response = await self._dispatcher.propagate_event(
+                update_type="error",
+                event=ErrorEvent(update=item.update, exception=e),
+                **item.data,
+            )
+            if response is UNHANDLED:
+                raise
+
+
+scheduler = UpdateScheduler(
+    workers=settings.update_workers,
+    max_pending=settings.update_queue_limit,
+    per_user_limit=settings.update_per_user_limit,
+)
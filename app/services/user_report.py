@@ -0,0 +1,419 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from app.models import User
+from app.services.db_session import standalone_session
+from app.services.file_ids import invalidate_path
+from app.settings import settings
+
+log = logging.getLogger(__name__)
+
+REPORTS_DIR = Path("data") / "reports"
+
+# (tg_id, full_name, username, phone, registered, baseline, created_at_str)
+UserRow = Tuple[int, str, str, str, str, str, str]
+ProgressCb = Callable[[int, int], Awaitable[None]]
+
+
+# ---------------- data (keyset pagination) ----------------
+
+@dataclass(frozen=True)
+class UsersSnapshot:
+    """Data watermark: report shu max_id gacha chiziladi (izchil snapshot)."""
+
+    count: int
+    max_id: int
+    updated_at: Optional[datetime]
+
+    @property
+    def key(self) -> str:
+        ts = self.updated_at.strftime("%Y%m%d%H%M%S%f") if self.updated_at else "0"
+        return f"{self.count}_{self.max_id}_{ts}"
+
+
+async def users_snapshot() -> UsersSnapshot:
+    async with standalone_session() as session:
+        count, max_id, updated_at = (
+            await session.execute(select(func.count(User.id), func.max(User.id), func.max(User.updated_at)))
+        ).one()
+    return UsersSnapshot(int(count or 0), int(max_id or 0), updated_at)
+
+
+def _format_row(r) -> UserRow:
+    full = (f"{r.first_name or ''} {r.last_name or ''}").strip() or "-"
+    uname = (r.username or "").strip()
+    uname = f"@{uname}" if uname and not uname.startswith("@") else (uname or "-")
+    phone = (r.phone or "-").strip() or "-"
+    reg = "Ha" if r.is_registered else "Yo'q"
+    base = "Ha" if r.is_baseline else "Yo'q"
+    created = (r.created_at or datetime.utcnow()).strftime("%Y-%m-%d %H:%M")
+    return int(r.tg_id), full, uname, phone, reg, base, created
+
+
+async def iter_user_rows(*, max_id: int, chunk_size: Optional[int] = None) -> AsyncIterator[List[UserRow]]:
+    """Users (id <= max_id) in id order, ``chunk_size`` rows per query; only report columns are loaded."""
+    chunk_size = max(1, chunk_size or settings.report_chunk_size)
+    last_id = 0
+    while last_id < max_id:
+        # har chunk uchun qisqa session: uzun report connection'ni band qilib turmaydi
+        async with standalone_session() as session:
+            rows = (
+                await session.execute(
+                    select(
+                        User.id,
+                        User.tg_id,
+                        User.first_name,
+                        User.last_name,
+                        User.username,
+                        User.phone,
+                        User.is_registered,
+                        User.is_baseline,
+                        User.created_at,
+                    )
+                    .where(User.id > last_id, User.id <= max_id)
+                    .order_by(User.id.asc())
+                    .limit(chunk_size)
+                )
+            ).all()
+        if not rows:
+            return
+        last_id = int(rows[-1].id)
+        yield [_format_row(r) for r in rows]
+
+
+# ---------------- PDF ----------------
+
+def _num(v: float) -> str:
+    return ("%.3f" % v).rstrip("0").rstrip(".") or "0"
+
+
+def _pdf_text(text: str) -> bytes:
+    # standart Type1 shriftlar WinAnsi: sig'maydigan belgilar "?" bo'ladi (reportlab ham shunday qiladi)
+    raw = text.encode("cp1252", errors="replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+class StreamingCanvas:
+    """The subset of reportlab's Canvas the users report uses, written to disk page by page.
+
+    reportlab's Canvas keeps every page in memory until ``save()``; a report of many thousand
+    users is thousands of pages. Here each finished page is compressed and written at once,
+    only object offsets and page ids stay in memory. Standard Type1 fonts only (not embedded).
+    """
+
+    FONTS = {"Helvetica": "F1", "Helvetica-Bold": "F2"}
+    # 1 catalog, 2 pages, 3.. fonts, keyin info; sahifa obyektlari undan keyin
+    _CATALOG, _PAGES, _FIRST_FONT = 1, 2, 3
+
+    def __init__(self, path: str, pagesize: Tuple[float, float]) -> None:
+        self.w, self.h = pagesize
+        self._f: BinaryIO = open(path, "wb")
+        self._offsets: Dict[int, int] = {}
+        self._pages: List[int] = []
+        self._info = self._FIRST_FONT + len(self.FONTS)
+        self._next_id = self._info + 1
+        self._ops: List[bytes] = []
+        self._font = ("Helvetica", 12.0)
+        self._title = ""
+        self._f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    # -- Canvas API --
+
+    def setTitle(self, title: str) -> None:
+        self._title = title
+
+    def setFont(self, name: str, size: float) -> None:
+        if name not in self.FONTS:
+            raise ValueError(f"unsupported font {name!r}")
+        self._font = (name, float(size))
+
+    def setFillGray(self, g: float) -> None:
+        self._ops.append(f"{_num(g)} g".encode())
+
+    def setStrokeGray(self, g: float) -> None:
+        self._ops.append(f"{_num(g)} G".encode())
+
+    def setLineWidth(self, w: float) -> None:
+        self._ops.append(f"{_num(w)} w".encode())
+
+    def line(self, x1: float, y1: float, x2: float, y2: float) -> None:
+        self._ops.append(f"{_num(x1)} {_num(y1)} m {_num(x2)} {_num(y2)} l S".encode())
+
+    def drawString(self, x: float, y: float, text: str) -> None:
+        name, size = self._font
+        self._ops.append(
+            f"BT /{self.FONTS[name]} {_num(size)} Tf 1 0 0 1 {_num(x)} {_num(y)} Tm (".encode()
+            + _pdf_text(text)
+            + b") Tj ET"
+        )
+
+    def drawRightString(self, x: float, y: float, text: str) -> None:
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
+        name, size = self._font
+        self.drawString(x - stringWidth(text, name, size), y, text)
+
+    def showPage(self) -> None:
+        content = zlib.compress(b"\n".join(self._ops))
+        self._ops = []
+        cid, pid = self._next_id, self._next_id + 1
+        self._next_id += 2
+        self._obj(cid, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content) + content + b"\nendstream")
+        fonts = b" ".join(b"/%s %d 0 R" % (ref.encode(), self._FIRST_FONT + i) for i, ref in enumerate(self.FONTS.values()))
+        self._obj(
+            pid,
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Resources << /Font << %s >> >> /Contents %d 0 R >>"
+            % (self._PAGES, _num(self.w).encode(), _num(self.h).encode(), fonts, cid),
+        )
+        self._pages.append(pid)
+
+    def save(self) -> None:
+        if self._ops or not self._pages:
+            self.showPage()
+        for i, name in enumerate(self.FONTS):
+            self._obj(
+                self._FIRST_FONT + i,
+                b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % name.encode(),
+            )
+        self._obj(self._info, b"<< /Producer (MSR) /Title (" + _pdf_text(self._title) + b") >>")
+        kids = b" ".join(b"%d 0 R" % pid for pid in self._pages)
+        self._obj(self._PAGES, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)))
+        self._obj(self._CATALOG, b"<< /Type /Catalog /Pages %d 0 R >>" % self._PAGES)
+        xref = self._f.tell()
+        size = self._next_id
+        lines = [b"xref", b"0 %d" % size, b"0000000000 65535 f "]
+        lines += [b"%010d 00000 n " % self._offsets[n] for n in range(1, size)]
+        self._f.write(b"\n".join(lines) + b"\n")
+        self._f.write(
+            b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (size, self._CATALOG, self._info, xref)
+        )
+        self._f.close()
+
+    def abort(self) -> None:
+        """Closes the file without finishing the PDF (the caller deletes it)."""
+        self._f.close()
+
+    def _obj(self, num: int, body: bytes) -> None:
+        self._offsets[num] = self._f.tell()
+        self._f.write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+
+class UsersPdf:
+    """Incremental users report: ``write_rows`` per chunk, ``close`` once (sync, run in a thread).
+
+    Pages go to disk as they fill up (StreamingCanvas), so memory does not grow with the user count.
+    """
+
+    def __init__(self, out: Path, total: int) -> None:
+        # reportlab faqat hisobot kerak bo'lganda yuklanadi (bot starti tezroq)
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.units import mm
+
+        self.out = out
+        self.count = 0
+        self.c = StreamingCanvas(str(out), pagesize=A4)
+        self.w, self.h = A4
+        self.margin = 14 * mm
+        self.line_h = 10
+        m = self.margin
+        self.col = {
+            "tg": m,
+            "name": m + 44 * mm,
+            "user": m + 110 * mm,
+            "phone": m + 142 * mm,
+            "reg": m + 172 * mm,
+            "created": m + 188 * mm,
+        }
+
+        # Header
+        c = self.c
+        c.setTitle("MSR Users Report")
+        c.setFont("Helvetica-Bold", 15)
+        c.drawString(m, self.h - m, "MSR — Userlar hisobot")
+        c.setFont("Helvetica", 10)
+        c.drawString(m, self.h - m - 14, f"Yaratilgan: {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')}")
+        c.drawRightString(self.w - m, self.h - m - 14, f"Jami: {total}")
+        self.y = self.h - m - 34
+        self._header_row()
+        self._row_font()
+
+    def _row_font(self) -> None:
+        self.c.setFont("Helvetica", 8.5)
+        self.c.setFillGray(0)
+
+    def _header_row(self) -> None:
+        c, col = self.c, self.col
+        c.setFont("Helvetica-Bold", 9)
+        c.setFillGray(0)
+        c.drawString(col["tg"], self.y, "TG_ID")
+        c.drawString(col["name"], self.y, "Ism Familiya")
+        c.drawString(col["user"], self.y, "Username")
+        c.drawString(col["phone"], self.y, "Telefon")
+        c.drawString(col["reg"], self.y, "Reg")
+        c.drawString(col["created"], self.y, "Qo'shilgan")
+        self.y -= self.line_h
+        c.setLineWidth(0.6)
+        c.setStrokeGray(0.75)
+        c.line(self.margin, self.y, self.w - self.margin, self.y)
+        self.y -= 6
+
+    def _new_page(self) -> None:
+        c, m = self.c, self.margin
+        c.showPage()
+        c.setFont("Helvetica-Bold", 15)
+        c.drawString(m, self.h - m, "MSR — Userlar hisobot")
+        c.setFont("Helvetica", 10)
+        c.drawString(m, self.h - m - 14, f"Davom etadi — {datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC')}")
+        self.y = self.h - m - 34
+        self._header_row()
+        self._row_font()
+
+    def write_rows(self, rows: List[UserRow]) -> None:
+        c, col, m = self.c, self.col, self.margin
+        for tg_id, full, uname, phone, reg, base, created in rows:
+            self.count += 1
+            if self.y < m + 18:
+                self._new_page()
+
+            c.drawString(col["tg"], self.y, str(tg_id))
+            # Name (truncate gently)
+            c.drawString(col["name"], self.y, (full[:42] + "…") if len(full) > 43 else full)
+            c.drawString(col["user"], self.y, (uname[:18] + "…") if len(uname) > 19 else uname)
+            c.drawString(col["phone"], self.y, (phone[:16] + "…") if len(phone) > 17 else phone)
+            # Registered + baseline mark
+            c.drawString(col["reg"], self.y, f"{reg}*" if base == "Ha" else reg)
+            c.drawString(col["created"], self.y, created)
+
+            self.y -= self.line_h
+
+            # Subtle row lines
+            if self.count % 2 == 0:
+                c.setStrokeGray(0.92)
+                c.line(m, self.y + 2, self.w - m, self.y + 2)
+                c.setStrokeGray(0.75)
+
+    def close(self) -> None:
+        # Footer note
+        if self.y < self.margin + 40:
+            self._new_page()
+        self.c.setFont("Helvetica", 8)
+        self.c.setFillGray(0.35)
+        self.c.drawString(self.margin, self.margin + 10, "* Baseline = Rasch bazasi uchun fake user")
+        self.c.save()
+
+    def abort(self) -> None:
+        self.c.abort()
+
+
+def _report_path(snap: UsersSnapshot) -> Path:
+    return REPORTS_DIR / f"msr_users_{snap.key}.pdf"
+
+
+async def build_users_report(snap: UsersSnapshot, *, progress: Optional[ProgressCb] = None) -> Tuple[Path, int]:
+    """Streams users from the DB into a PDF rendered in a worker thread; returns (path, rows).
+
+    Keyingi chunk DB'dan o'qilayotganda oldingisi thread'da chiziladi; xotirada ko'pi bilan 2 chunk.
+    The PDF is written to a ``.part`` file and renamed, so a half-written report is never reused.
+    """
+    total = snap.count
+    REPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    final = _report_path(snap)
+    out = final.with_name(final.name + ".part")
+    pdf = await asyncio.to_thread(UsersPdf, out, total)
+    pending: Optional["asyncio.Future[None]"] = None
+    try:
+        async for rows in iter_user_rows(max_id=snap.max_id):
+            if pending is not None:
+                await pending
+                if progress:
+                    await progress(pdf.count, total)
+            pending = asyncio.ensure_future(asyncio.to_thread(pdf.write_rows, rows))
+        if pending is not None:
+            await pending
+        await asyncio.to_thread(pdf.close)
+    except BaseException:
+        # to_thread'ni cancel qilish thread'ni to'xtatmaydi: yozish tugashini kutib, keyin o'chiramiz
+        if pending is not None:
+            await asyncio.wait([pending])
+        pdf.abort()
+        out.unlink(missing_ok=True)
+        raise
+    out.replace(final)
+    if progress:
+        await progress(pdf.count, total)
+    return final, pdf.count
+
+
+# ---------------- cache + retention ----------------
+
+_building: Dict[str, "asyncio.Future[Tuple[Path, int]]"] = {}
+
+
+async def get_users_report(*, progress: Optional[ProgressCb] = None) -> Tuple[Path, int, bool]:
+    """(path, rows, cached). Unchanged watermark -> the existing artifact is returned as-is
+    (same bytes, so file_ids also reuses its Telegram file_id)."""
+    snap = await users_snapshot()
+    path = _report_path(snap)
+    if path.exists():
+        return path, snap.count, True
+
+    # single-flight: bir vaqtda bosilgan tugmalar bitta report'ni kutadi
+    fut = _building.get(snap.key)
+    if fut is not None:
+        p, n = await asyncio.shield(fut)
+        return p, n, True
+    fut = asyncio.get_running_loop().create_future()
+    _building[snap.key] = fut
+    try:
+        result = await build_users_report(snap, progress=progress)
+    except BaseException as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved
+        raise
+    else:
+        fut.set_result(result)
+    finally:
+        _building.pop(snap.key, None)
+    try:
+        await gc_reports(keep_path=result[0])
+    except Exception:
+        log.exception("report GC failed")
+    return result[0], result[1], False
+
+
+async def gc_reports(*, keep_path: Optional[Path] = None) -> int:
+    """Retention: newest REPORT_KEEP reports always stay; older ones go after REPORT_RETENTION_DAYS.
+
+    Stale ``.part`` leftovers (crash mid-build) older than a day are removed too. Returns removed count.
+    """
+    if not REPORTS_DIR.exists():
+        return 0
+    now = time.time()
+    max_age = max(0, settings.report_retention_days) * 86400
+    reports = sorted(REPORTS_DIR.glob("msr_users_*.pdf"), key=lambda p: p.stat().st_mtime, reverse=True)
+    removed = 0
+    for i, p in enumerate(reports):
+        if i < max(1, settings.report_keep) or p == keep_path:
+            continue
+        if now - p.stat().st_mtime < max_age:
+            continue
+        await invalidate_path(p)
+        p.unlink(missing_ok=True)
+        removed += 1
+    active = {f"msr_users_{k}.pdf.part" for k in _building}
+    for p in REPORTS_DIR.glob("msr_users_*.pdf.part"):
+        if p.name not in active and now - p.stat().st_mtime > 86400:
+            p.unlink(missing_ok=True)
+            removed += 1
+    return removed
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import hashlib
 import os
 from pathlib import Path
 from typing import List
@@ -16,6 +17,8 @@ class Settings(BaseSettings):
     bot_username: str = Field(default="", alias="BOT_USERNAME")  # without @
     admin_tg_ids: List[int] = Field(default_factory=list, alias="ADMIN_TG_IDS")  # comma-separated
     ceo_tg_ids: List[int] = Field(default_factory=list, alias="CEO_TG_IDS")      # comma-separated
+    storage_chat_id: int = Field(default=0, alias="STORAGE_CHAT_ID")  # PDF prewarm uchun xizmat chati (0 = o'chiq)
+    prewarm_timeout: float = Field(default=10.0, alias="PREWARM_TIMEOUT")  # test e'lon qilinishidan oldin kutiladi
 
     # Subscription gate
     required_channel: str = Field(default="", alias="REQUIRED_CHANNEL")  # @username or https://t.me/...
@@ -26,6 +29,29 @@ class Settings(BaseSettings):
     # Database
     database_url: str = Field(default="", alias="DATABASE_URL")
     sqlite_path: str = Field(default="data/bot.db", alias="SQLITE_PATH")
+    user_id_cache_size: int = Field(default=50000, alias="USER_ID_CACHE_SIZE")  # tg_id -> users.id LRU
+
+    # Certificate render pipeline (thread pool)
+    cert_workers: int = Field(default=2, alias="CERT_WORKERS")
+
+    # Update scheduler (per-user ordered worker pool)
+    update_workers: int = Field(default=16, alias="UPDATE_WORKERS")
+    update_queue_limit: int = Field(default=1000, alias="UPDATE_QUEUE_LIMIT")  # above -> "bot band" reply
+    update_per_user_limit: int = Field(default=20, alias="UPDATE_PER_USER_LIMIT")
+
+    # FSM storage: sql (shared by bot processes, survives restarts) | memory
+    fsm_storage: str = Field(default="sql", alias="FSM_STORAGE")
+    fsm_ttl_hours: int = Field(default=48, alias="FSM_TTL_HOURS")  # abandoned flows expire
+
+    # Broadcasts (e'lonlar): Telegram ~30 msg/s global limitidan pastda
+    broadcast_rate: float = Field(default=25.0, alias="BROADCAST_RATE")  # messages per second
+    broadcast_batch: int = Field(default=200, alias="BROADCAST_BATCH")  # recipients per DB page / progress save
+    broadcast_concurrency: int = Field(default=8, alias="BROADCAST_CONCURRENCY")  # parallel sendMessage calls
+
+    # CEO reports
+    report_chunk_size: int = Field(default=2000, alias="REPORT_CHUNK_SIZE")  # rows per keyset page
+    report_keep: int = Field(default=3, alias="REPORT_KEEP")  # always keep the newest N reports
+    report_retention_days: int = Field(default=7, alias="REPORT_RETENTION_DAYS")
 
     # Admin panel (aiohttp, optional)
     admin_panel_host: str = Field(default="127.0.0.1", alias="ADMIN_PANEL_HOST")
@@ -42,6 +68,26 @@ class Settings(BaseSettings):
     miniapp_public_url: str = Field(default="", alias="MINIAPP_PUBLIC_URL")
     miniapp_dev_bypass: bool = Field(default=False, alias="MINIAPP_DEV_BYPASS")
 
+    # Bot updates: polling (default) | webhook (served by the MiniApp aiohttp server)
+    bot_mode: str = Field(default="polling", alias="BOT_MODE")
+    webhook_base_url: str = Field(default="", alias="WEBHOOK_BASE_URL")  # empty -> MINIAPP_PUBLIC_URL
+    webhook_path: str = Field(default="/tg/webhook", alias="WEBHOOK_PATH")
+    webhook_secret: str = Field(default="", alias="WEBHOOK_SECRET")  # empty -> derived from BOT_TOKEN
+    # several replicas: false, otherwise one stopping replica turns the webhook off for all
+    webhook_delete_on_shutdown: bool = Field(default=True, alias="WEBHOOK_DELETE_ON_SHUTDOWN")
+
+    # Graceful shutdown: drain deadline for in-flight updates/requests/renders (seconds)
+    shutdown_timeout: float = Field(default=25.0, alias="SHUTDOWN_TIMEOUT")
+
+    # Startup: log import / DB init / routers / server bind timings
+    startup_profile: bool = Field(default=False, alias="STARTUP_PROFILE")
+
+    # Test ro'yxatlari: bot inline klaviaturasi va Mini App /api/tests sahifa hajmi
+    tests_page_size: int = Field(default=10, alias="TESTS_PAGE_SIZE")
+    miniapp_tests_page_size: int = Field(default=50, alias="MINIAPP_TESTS_PAGE_SIZE")
+    # boshqa replica'dagi test o'zgarishlari shu oraliqda ko'rinadi (settings'dagi catalog versiyasi)
+    catalog_check_seconds: float = Field(default=2.0, alias="CATALOG_CHECK_SECONDS")
+
     # UX
     emoji_mode_default: bool = Field(default=True, alias="EMOJI_MODE_DEFAULT")
 
@@ -67,7 +113,7 @@ class Settings(BaseSettings):
         v = (value or "").strip()
         if not v:
             return ""
-        for prefix in ("ADMIN_PANEL_PUBLIC_URL=", "MINIAPP_PUBLIC_URL="):
+        for prefix in ("ADMIN_PANEL_PUBLIC_URL=", "MINIAPP_PUBLIC_URL=", "WEBHOOK_BASE_URL="):
             if v.startswith(prefix):
                 v = v[len(prefix):].strip()
         return v
@@ -95,4 +141,21 @@ class Settings(BaseSettings):
         return f"http://{self.miniapp_host}:{self.miniapp_port}".rstrip("/")
 
 
+    @property
+    def use_webhook(self) -> bool:
+        return (self.bot_mode or "").strip().lower() == "webhook"
+
+    @property
+    def webhook_url(self) -> str:
+        base = self._normalize_url(self.webhook_base_url) or self._normalize_url(self.miniapp_public_url)
+        return f"{base.rstrip('/')}/{self.webhook_path.lstrip('/')}" if base else ""
+
+    @property
+    def effective_webhook_secret(self) -> str:
+        """X-Telegram-Bot-Api-Secret-Token; derived from the bot token so every replica agrees."""
+        if self.webhook_secret:
+            return self.webhook_secret
+        return hashlib.sha256(f"webhook:{self.bot_token}".encode()).hexdigest()
+
+
 settings = Settings()
@@ -15,6 +15,7 @@ const state = {
   roles: ['user'],
   categories: [],
   tests: [],
+  testsCursor: null, // /api/tests next_cursor (null: oxirgi sahifa)
   selectedCategory: null,
   selectedTest: null,
   answers: {}, // {q: {choices: string[], manual: string[]}}
@@ -502,11 +503,39 @@ function renderTests() {
     item.appendChild(right);
     list.appendChild(item);
   });
+
+  if (state.testsCursor) {
+    const more = document.createElement('button');
+    more.className = 'btn';
+    more.type = 'button';
+    more.textContent = 'Yana yuklash';
+    more.onclick = () => loadTestsPage(state.selectedCategory, state.testsCursor).catch(() => setStatus('Xatolik'));
+    list.appendChild(more);
+  }
+}
+
+async function loadTestsPage(catKey, cursor) {
+  const forCheck = isAdminUI() ? '' : '&for_check=1';
+  const after = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+  const res = await apiGet(`/api/tests?category=${encodeURIComponent(catKey)}${forCheck}${after}`);
+  const data = await res.json();
+
+  if (res.status === 403 && data.join_required) {
+    showGate(true, data.message, data.channel_url, data.group_url);
+    return;
+  }
+  if (state.selectedCategory !== catKey) return; // boshqa kategoriya tanlangan
+
+  state.tests = cursor ? state.tests.concat(data.tests || []) : data.tests || [];
+  state.testsCursor = data.next_cursor || null;
+  showGate(false);
+  renderTests();
 }
 
 async function selectCategory(catKey) {
   state.selectedCategory = catKey;
   state.tests = [];
+  state.testsCursor = null;
   state.selectedTest = null;
   setSolveVisible(false);
 
@@ -514,18 +543,7 @@ async function selectCategory(catKey) {
   setStatus('Yuklanmoqda…');
 
   try {
-    const forCheck = isAdminUI() ? '' : '&for_check=1';
-    const res = await apiGet(`/api/tests?category=${encodeURIComponent(catKey)}${forCheck}`);
-    const data = await res.json();
-
-    if (res.status === 403 && data.join_required) {
-      showGate(true, data.message, data.channel_url, data.group_url);
-      return;
-    }
-
-    state.tests = data.tests || [];
-    showGate(false);
-    renderTests();
+    await loadTestsPage(catKey, null);
   } catch (e) {
     setStatus('Xatolik');
   }
@@ -558,6 +576,22 @@ async function loadMe() {
   } catch (_) {}
 }
 
+async function waitCertificateReady(certId) {
+  // Sertifikat fonda render qilinadi: tayyor bo'lguncha long-poll qilamiz.
+  for (let i = 0; i < 6; i++) {
+    try {
+      const r = await apiGet(`/api/certificate_status?certificate_id=${encodeURIComponent(certId)}&wait=10`);
+      const j = await r.json();
+      if (!r.ok) return false;
+      if (j.status === 'ready') return true;
+      if (j.status === 'failed') return false;
+    } catch (_) {
+      return false;
+    }
+  }
+  return false;
+}
+
 function showResult(data) {
   $('result').hidden = false;
   $('mCorrect').textContent = `${data.result.raw_correct} / ${data.result.total}`;
@@ -577,6 +611,10 @@ function showResult(data) {
     if (!certId) return;
     $('btnCert').disabled = true;
     try {
+      if (!(await waitCertificateReady(certId))) {
+        alert('Sertifikat tayyorlanmadi, keyinroq urinib ko‘ring');
+        return;
+      }
       const r = await apiPost('/api/send_certificate', { certificate_id: certId });
       const j = await r.json();
       if (!r.ok) {
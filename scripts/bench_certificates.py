@@ -0,0 +1,198 @@
+"""Sertifikat renderer benchmark: per-certificate render time va PDF hajmi.
+
+    py scripts/bench_certificates.py [-n 200] [--check]
+
+``legacy`` — eski renderer, reportlab default sozlamalari bilan (har sertifikatda
+ramka/watermark/sarlavhalar qaytadan chiziladi),
+``current`` — app.services.certificates (keshlangan statik qism + PDF_PROFILE:
+FlateDecode, ASCII85'siz — "vs legacy" ustunida hajm farqi ko'rinadi).
+
+``--check``: current legacy'dan katta fayl bersa yoki sezilarli sekin bo'lsa exit 1.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from reportlab import rl_config, rl_settings  # noqa: E402
+from reportlab.lib.pagesizes import A4, landscape  # noqa: E402
+from reportlab.pdfgen import canvas  # noqa: E402
+
+from app.services import certificates as cert  # noqa: E402
+
+
+# current vaqt bo'yicha legacy'dan ko'pi bilan shuncha sekin bo'lishi mumkin (--check)
+TIME_TOLERANCE = 1.10
+# o'lchovdan oldingi render'lar (import, lru_cache, font metrikalar) — natijaga kirmaydi
+WARMUP = 10
+
+
+@contextlib.contextmanager
+def _reportlab_defaults() -> Iterator[None]:
+    """Legacy renderer'lar PDF_PROFILE'siz, reportlab default'lari bilan ishlashi uchun."""
+    saved = {k: getattr(rl_config, k) for k in cert.PDF_PROFILE}
+    for k in saved:
+        setattr(rl_config, k, getattr(rl_settings, k))
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            setattr(rl_config, k, v)
+
+
+# ---------------- legacy renderer (reference) ----------------
+
+def _legacy_base(out_path: Path):
+    c = canvas.Canvas(str(out_path), pagesize=landscape(A4))
+    w, h = landscape(A4)
+    c.rect(20, 20, w - 40, h - 40)
+    return c, w, h
+
+
+def _legacy_simple(out_path: Path, data: cert.CertificateData) -> None:
+    c, w, h = _legacy_base(out_path)
+    cert._watermark(c, w, h, "MSR")
+    c.setFont("Helvetica-Bold", 24)
+    c.drawCentredString(w / 2, h - 80, "SERTIFIKAT")
+    c.setFont("Helvetica", 12)
+    c.drawCentredString(w / 2, h - 110, "Ushbu sertifikat quyidagi ishtirokchiga taqdim etiladi:")
+    c.setFont("Helvetica-Bold", 20)
+    c.drawCentredString(w / 2, h - 150, data.full_name)
+    c.setFont("Helvetica", 12)
+    c.drawString(60, h - 200, f"Test: {data.test_name}")
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(60, h - 235, f"Natija: {data.score_text}")
+    c.setFont("Helvetica", 10)
+    c.drawRightString(w - 60, 60, f"Berilgan sana: {data.issued_at.strftime('%Y-%m-%d %H:%M UTC')}")
+    c.showPage()
+    c.save()
+
+
+def _legacy_sat(out_path: Path, data: cert.CertificateData) -> None:
+    c, w, h = _legacy_base(out_path)
+    cert._watermark(c, w, h, "SAT • MSR")
+    c.setFont("Helvetica-Bold", 22)
+    c.drawString(50, h - 70, "SAT MATH PRACTICE CERTIFICATE")
+    c.setFont("Helvetica", 12)
+    c.drawString(50, h - 100, "Ta’qdim etiladi:")
+    c.setFont("Helvetica-Bold", 20)
+    c.drawString(170, h - 104, data.full_name)
+    c.setFont("Helvetica", 12)
+    c.drawString(50, h - 140, f"Test: {data.test_name}")
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, h - 175, f"Math Score: {data.score_text} (200–800)")
+    c.setFont("Helvetica", 10)
+    c.drawRightString(w - 60, 60, f"Berilgan sana: {data.issued_at.strftime('%Y-%m-%d %H:%M UTC')}")
+    c.showPage()
+    c.save()
+
+
+def _legacy_milliy(out_path: Path, data: cert.CertificateData) -> None:
+    c, w, h = _legacy_base(out_path)
+    cert._watermark(c, w, h, "MILLIY • MSR")
+    c.setFont("Helvetica-Bold", 24)
+    c.drawCentredString(w / 2, h - 80, "MILLIY SERTIFIKAT — AMALIYOT")
+    c.setFont("Helvetica", 12)
+    c.drawCentredString(w / 2, h - 110, "Ushbu sertifikat quyidagi ishtirokchiga taqdim etiladi:")
+    c.setFont("Helvetica-Bold", 20)
+    c.drawCentredString(w / 2, h - 150, data.full_name)
+    c.setFont("Helvetica", 12)
+    c.drawString(60, h - 200, f"Test: {data.test_name}")
+    c.setFont("Helvetica-Bold", 18)
+    c.drawString(60, h - 235, "Foiz: 87.5%")
+    c.setFont("Helvetica-Bold", 18)
+    c.drawString(60, h - 270, "Daraja: B+")
+    c.setFont("Helvetica", 10)
+    c.drawRightString(w - 60, 60, f"Berilgan sana: {data.issued_at.strftime('%Y-%m-%d %H:%M UTC')}")
+    c.showPage()
+    c.save()
+
+
+def _current_milliy(out_path: Path, data: cert.CertificateData) -> None:
+    cert.render_milliy_certificate(
+        out_path,
+        full_name=data.full_name,
+        test_name=data.test_name,
+        percent=87.5,
+        level="B+",
+        issued_at=data.issued_at,
+    )
+
+
+RENDERERS: Dict[str, Dict[str, Callable[[Path, cert.CertificateData], None]]] = {
+    "legacy": {"simple": _legacy_simple, "sat": _legacy_sat, "milliy": _legacy_milliy},
+    "current": {
+        "simple": cert.render_simple_certificate,
+        "sat": cert.render_sat_style_certificate,
+        "milliy": _current_milliy,
+    },
+}
+
+
+def _bench(fn: Callable[[Path, cert.CertificateData], None], out_dir: Path, n: int) -> tuple[float, float, int]:
+    times: List[float] = []
+    size = 0
+    for i in range(-WARMUP, n):
+        data = cert.CertificateData(
+            full_name=f"Ishtirokchi {i:05d}",
+            test_name="SAT Practice Test 7",
+            score_text=str(200 + (i % 600)),
+            issued_at=datetime(2026, 1, 1, 12, 0),
+        )
+        out = out_dir / f"c_{i}.pdf"
+        t0 = time.perf_counter()
+        fn(out, data)
+        if i < 0:
+            continue
+        times.append((time.perf_counter() - t0) * 1000)
+        size = out.stat().st_size
+    return statistics.mean(times), statistics.median(times), size
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=200, help="har renderer uchun sertifikatlar soni")
+    ap.add_argument("--check", action="store_true", help="hajm/vaqt regressiyasida exit 1")
+    args = ap.parse_args()
+
+    results: Dict[Tuple[str, str], Tuple[float, float, int]] = {}
+    print(f"{'renderer':<10} {'style':<8} {'mean ms':>9} {'median ms':>10} {'bytes':>8} {'vs legacy':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, styles in RENDERERS.items():
+            for style, fn in styles.items():
+                d = Path(tmp) / name / style
+                d.mkdir(parents=True)
+                with _reportlab_defaults() if name == "legacy" else contextlib.nullcontext():
+                    mean, median, size = _bench(fn, d, args.n)
+                results[(name, style)] = (mean, median, size)
+                base = results.get(("legacy", style))
+                delta = f"{(size - base[2]) / base[2] * 100:+.1f}%" if base and name != "legacy" else ""
+                print(f"{name:<10} {style:<8} {mean:>9.3f} {median:>10.3f} {size:>8} {delta:>10}")
+
+    if args.check:
+        failed = []
+        for style in RENDERERS["legacy"]:
+            l_mean, _, l_size = results[("legacy", style)]
+            c_mean, _, c_size = results[("current", style)]
+            if c_size > l_size:
+                failed.append(f"{style}: {c_size} bytes > legacy {l_size}")
+            if c_mean > l_mean * TIME_TOLERANCE:
+                failed.append(f"{style}: {c_mean:.3f} ms > legacy {l_mean:.3f} ms x{TIME_TOLERANCE}")
+        for line in failed:
+            print("REGRESSION", line)
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()